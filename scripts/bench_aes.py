@@ -0,0 +1,51 @@
+"""Compares the throughput of the AES backends used for Mega downloads.
+
+Usage: python scripts/bench_aes.py [size in MB]
+"""
+import importlib.util
+import os
+import sys
+import time
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src" / "media_import"
+# pyaes is vendored into the libs directory by scripts/build.py
+sys.path.append(str(SRC_DIR / "libs"))
+
+
+def load_aes_module():
+    spec = importlib.util.spec_from_file_location("aes", SRC_DIR / "pathlike" / "aes.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def throughput(func, size: int) -> float:
+    """Returns MB/s"""
+    start = time.perf_counter()
+    func()
+    return size / (time.perf_counter() - start) / 1_000_000
+
+
+def bench(size: int) -> None:
+    aes = load_aes_module()
+    key = os.urandom(16)
+    data = os.urandom(size)
+    # Mega decrypts attributes and keys in small CBC messages.
+    small_messages = [os.urandom(64) for _ in range(max(1, size // 64 // 100))]
+    small_size = sum(len(message) for message in small_messages)
+
+    print(f"{'backend':<14}{'CTR MB/s':>12}{'CBC MB/s':>12}{'CBC 64B MB/s':>16}")
+    for backend in aes.available_backends():
+        ctr = throughput(lambda: backend.ctr(key, 0)(data), size)
+        cbc = throughput(lambda: backend.cbc_decrypt(key, data), size)
+        cbc_small = throughput(
+            lambda: [backend.cbc_decrypt(key, message) for message in small_messages],
+            small_size,
+        )
+        print(f"{backend.name:<14}{ctr:>12.1f}{cbc:>12.1f}{cbc_small:>16.1f}")
+
+
+if __name__ == "__main__":
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 4
+    bench(int(size_mb * 1_000_000))
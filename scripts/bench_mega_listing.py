@@ -0,0 +1,102 @@
+"""Times listing a large synthetic Mega folder with MegaRoot.
+
+Key and attribute decryption is replaced by a stub that counts calls,
+so the timings show the cost of walking the node tree.
+The result is compared with the previous walk, which rescanned all nodes for every folder.
+
+Usage: python scripts/bench_mega_listing.py [number of nodes] [number of folders]
+You need to build the add-on first (python scripts/build.py).
+"""
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.media_import.pathlike.mega import MegaRoot, mega  # noqa: E402
+
+
+def make_nodes(node_cnt: int, folder_cnt: int) -> List[Dict[str, Any]]:
+    """Returns nodes of a random tree. Attributes are stored unencrypted in 'a'."""
+    rng = random.Random(0)
+    nodes: List[Dict[str, Any]] = [
+        {"h": "root", "p": "owner", "t": 1, "k": "", "a": {"n": "root"}}
+    ]
+    folders = ["root"]
+    for i in range(folder_cnt):
+        handle = f"d{i}"
+        nodes.append(
+            {"h": handle, "p": rng.choice(folders), "t": 1, "k": "", "a": {"n": handle}}
+        )
+        folders.append(handle)
+    for i in range(node_cnt - folder_cnt - 1):
+        ext = rng.choice(["png", "jpg", "mp3", "txt", "pdf"])
+        nodes.append(
+            {
+                "h": f"f{i}",
+                "p": rng.choice(folders),
+                "t": 0,
+                "k": "",
+                "a": {"n": f"file{i}.{ext}"},
+                "s": rng.randint(1, 10_000_000),
+            }
+        )
+    # The API doesn't list parents before their children.
+    rng.shuffle(nodes)
+    return nodes
+
+
+def legacy_walk(nodes: List[Dict[str, Any]], id: str, found: List[str]) -> None:
+    """The walk MegaRoot used before: every folder rescans all nodes."""
+    for node in nodes:
+        if node["p"] != id:
+            continue
+        if node["t"] == 1:
+            legacy_walk(nodes, node["h"], found)
+        if node["t"] != 0:
+            continue
+        found.append(node["h"])
+
+
+def bench(node_cnt: int, folder_cnt: int) -> None:
+    nodes = make_nodes(node_cnt, folder_cnt)
+    decrypt_calls = 0
+
+    def decrypt_node_key(key_data: str, shared_key: Any) -> tuple:
+        nonlocal decrypt_calls
+        decrypt_calls += 1
+        return (0,) * 8
+
+    mega.list_files = lambda id: nodes  # type: ignore
+    mega.decrypt_node_key = decrypt_node_key  # type: ignore
+    mega.decrypt_attribute = lambda attrs, key, is_file=True: attrs  # type: ignore
+
+    root = MegaRoot.__new__(MegaRoot)
+    root.public_handle = "handle"
+    root.shared_key = ""
+    root.id = "root"
+    start = time.perf_counter()
+    root.get_data(use_cache=False)
+    indexed_time = time.perf_counter() - start
+
+    sys.setrecursionlimit(max(10_000, folder_cnt * 2))
+    legacy_found: List[str] = []
+    start = time.perf_counter()
+    legacy_walk(nodes, "root", legacy_found)
+    legacy_time = time.perf_counter() - start
+
+    file_cnt = sum(1 for node in nodes if node["t"] == 0)
+    print(f"{node_cnt} nodes, {folder_cnt} folders, {file_cnt} file nodes")
+    print(f"indexed walk: {indexed_time:.3f}s, {len(root.files)} media files")
+    print(f"legacy walk:  {legacy_time:.3f}s (without decryption)")
+    print(f"decrypted keys: {decrypt_calls} (root folder + file nodes)")
+    media_ids = {file.id for file in root.files}
+    assert [id for id in legacy_found if id in media_ids] == [file.id for file in root.files]
+
+
+if __name__ == "__main__":
+    node_cnt = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    folder_cnt = int(sys.argv[2]) if len(sys.argv) > 2 else 3_000
+    bench(node_cnt, folder_cnt)
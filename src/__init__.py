@@ -5,6 +5,7 @@ from aqt.qt import QAction
 
 from .anking import get_anking_menu
 from .media_import import open_import_dialog
+from .media_import.pathlike.hashcache import close_hash_cache
 
 
 def setupMenu(handler: Callable[[], None]) -> None:
@@ -15,3 +16,4 @@ def setupMenu(handler: Callable[[], None]) -> None:
 
 
 gui_hooks.main_window_did_init.append(lambda: setupMenu(open_import_dialog))
+gui_hooks.profile_will_close.append(close_hash_cache)
@@ -1,11 +1,16 @@
-from typing import List
+import json
+import sqlite3
+from datetime import datetime
+from typing import Any, Dict, List
 
 from anki.media import media_paths_from_col_path
 from aqt import mw
 from aqt.qt import *
-from aqt.utils import openFolder, restoreGeom, saveGeom
+from aqt.utils import openFolder, restoreGeom, saveGeom, showWarning, tooltip
 
-from .importing import ImportResult
+from .importing import ImportResult, resume_import
+from .journal import JournalInfo, latest_journal
+from .pathlike.hashcache import hash_cache
 from .tabs import ApkgTab, GDriveTab, ImportTab, LocalTab, MegaTab
 
 
@@ -26,7 +31,30 @@ class ImportResultDialog(QMessageBox):
         text = f"<h3><b>{title}</b></h3>{details}<br>"
         self.setText(text)
         self.setTextFormat(Qt.TextFormat.RichText)
-        self.setDetailedText("\n".join(result.logs))
+        detailed_text = "\n".join(result.logs)
+        if result.report is not None:
+            report = result.report
+            detailed_text += "\n\nReport:\n" + json.dumps(report, indent=2)
+            self.addButton(QMessageBox.StandardButton.Ok)
+            report_btn = self.addButton("Save Report...", QMessageBox.ButtonRole.NoRole)
+            # Every button of a message box closes it. Saving shouldn't.
+            report_btn.clicked.disconnect()  # type: ignore
+            report_btn.clicked.connect(lambda: self.save_report(report))  # type: ignore
+        self.setDetailedText(detailed_text)
+
+    def save_report(self, report: Dict[str, Any]) -> None:
+        """Saves the performance report as JSON, so it can be compared with other imports."""
+        started = str(report.get("started", "")).replace(":", "-")
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Save Report", f"media_import_report_{started}.json", "JSON (*.json)"
+        )
+        if not path:
+            return
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        except OSError as err:
+            showWarning(f"Couldn't save the report: {err}", parent=self)
 
 
 class ImportDialog(QDialog):
@@ -44,6 +72,10 @@ class ImportDialog(QDialog):
         self.main_layout = main_layout
         self.setLayout(main_layout)
 
+        self.journal = latest_journal()
+        if self.journal is not None:
+            self.setup_resume_row(self.journal)
+
         main_tab = QTabWidget()
         self.main_tab = main_tab
         main_tab.setFocusPolicy(Qt.FocusPolicy.StrongFocus)
@@ -60,6 +92,27 @@ class ImportDialog(QDialog):
         main_tab.addTab(self.mega_tab, "Mega")
         self.tabs: List[ImportTab] = [self.local_tab, self.gdrive_tab, self.mega_tab]
 
+    def setup_resume_row(self, journal: JournalInfo) -> None:
+        resume_row = QHBoxLayout()
+        self.resume_row = resume_row
+        self.main_layout.addLayout(resume_row)
+
+        started = datetime.fromtimestamp(journal.created).strftime("%Y-%m-%d %H:%M")
+        label = QLabel(
+            f"An import from '{journal.name}', started {started}, was interrupted. "
+            f"({journal.remaining} / {journal.total} files left)"
+        )
+        label.setWordWrap(True)
+        resume_row.addWidget(label, 1)
+
+        discard_btn = QPushButton("Discard")
+        discard_btn.clicked.connect(self.on_discard_journal)  # type: ignore
+        resume_row.addWidget(discard_btn)
+
+        resume_btn = QPushButton("Resume Import")
+        resume_btn.clicked.connect(self.on_resume)  # type: ignore
+        resume_row.addWidget(resume_btn)
+
     def setup_buttons(self) -> None:
         button_row = QHBoxLayout()
         self.main_layout.addLayout(button_row)
@@ -68,6 +121,29 @@ class ImportDialog(QDialog):
         media_dir_btn.clicked.connect(self.open_media_dir)  # type: ignore
         button_row.addWidget(media_dir_btn)
 
+        clear_cache_btn = QPushButton("Clear Hash Cache")
+        clear_cache_btn.setToolTip(
+            "Forget the stored hashes of local files. They are computed again when needed."
+        )
+        clear_cache_btn.clicked.connect(self.clear_hash_cache)  # type: ignore
+        button_row.addWidget(clear_cache_btn)
+
+        sync_checkbox = QCheckBox("Only new or changed files")
+        sync_checkbox.setToolTip(
+            "Skip files that didn't change since they were last imported from the same source."
+        )
+        self.sync_checkbox = sync_checkbox
+        button_row.addWidget(sync_checkbox)
+
+        hardlink_checkbox = QCheckBox("Hard link local files")
+        hardlink_checkbox.setToolTip(
+            "Link files of local folders into the media folder instead of copying them, "
+            "when both are on the same drive. This saves space, but the files are shared: "
+            "editing one of them changes the other as well."
+        )
+        self.hardlink_checkbox = hardlink_checkbox
+        button_row.addWidget(hardlink_checkbox)
+
         button_row.addStretch(1)
         cancel_btn = QPushButton("Cancel")
         cancel_btn.clicked.connect(self.close)  # type: ignore
@@ -89,6 +165,17 @@ class ImportDialog(QDialog):
         media_dir = media_paths_from_col_path(mw.col.path)[0]
         openFolder(media_dir)
 
+    def clear_hash_cache(self) -> None:
+        cache = hash_cache()
+        if cache is None:
+            return
+        try:
+            cache.clear()
+        except sqlite3.Error as err:
+            showWarning(f"Couldn't clear the hash cache: {err}", parent=self)
+            return
+        tooltip("Cleared the hash cache.", parent=self)
+
     def closeEvent(self, evt: QCloseEvent) -> None:
         saveGeom(self, f"addon-mediaImport-import")
         for tab in self.tabs:
@@ -97,6 +184,25 @@ class ImportDialog(QDialog):
     def on_import(self) -> None:
         self.tab.on_import()
 
+    def on_resume(self) -> None:
+        if self.journal is None:
+            return
+        journal = self.journal
+        self.hide_resume_row()
+        resume_import(journal, self.finish_import)
+
+    def on_discard_journal(self) -> None:
+        if self.journal is not None:
+            self.journal.remove()
+        self.hide_resume_row()
+
+    def hide_resume_row(self) -> None:
+        self.journal = None
+        while self.resume_row.count():
+            widget = self.resume_row.takeAt(0).widget()
+            if widget is not None:
+                widget.deleteLater()
+
     @property
     def tab(self) -> "ImportTab":
         return self.main_tab.currentWidget()  # type: ignore
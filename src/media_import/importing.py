@@ -1,45 +1,87 @@
+import bisect
+import errno
+import math
 import os
+import queue
+import tempfile
+import threading
+import time
 import traceback
 import unicodedata
-from concurrent.futures import Future
+from concurrent.futures import (FIRST_COMPLETED, Future, ThreadPoolExecutor,
+                                as_completed, wait)
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+from pathlib import Path
+from typing import (Any, Callable, Collection, Dict, Iterator, List, NamedTuple,
+                    Optional, Sequence, Tuple, Type)
 
 import aqt
 from anki.media import media_paths_from_col_path
 from aqt.utils import askUserDialog
 from requests.exceptions import RequestException
 
-from .pathlike import FileLike, LocalRoot, RootPath
-from .pathlike.errors import AddonError
+from .journal import ImportJournal, JournalInfo
+from .manifest import Manifest
+from .pathlike import FileLike, ListingToken, LocalFile, LocalRoot, RootPath
+from .pathlike.errors import AddonError, RateLimitError, RequestError, ServerError
 from .pathlike.gdrive import GDriveRoot, gdrive
+from .pathlike.partial import PartialDownload, partial_dir
+from .pathlike.transport import HostStats, in_context, observing, transport
+from .scheduler import CircuitBreaker, Throttle, TransferQueue
 
 # if there are at least so many files in a gdrive directory, it will be downloaded as a zip file
 GDRIVE_DOWNLOAD_AS_ZIP_THRESHOLD = 5
 
+# number of threads that compare files with the same name
+HASH_WORKERS = min(8, (os.cpu_count() or 1) + 2)
+
+# Downloads of files at least this large can be resumed after a failure.
+RESUMABLE_MIN_SIZE = 8 * 1024 * 1024
+
+# Errors of local files that won't go away by retrying
+PERMANENT_ERRNOS = (errno.ENOENT, errno.EACCES)
+
+# Most progress updates that are sent to the main thread per second
+PROGRESS_UPDATES_PER_SECOND = 10
+
+# The ETA is estimated from a moving average of the throughput, sampled at least this often,
+# in which a sample's weight decays by a factor of e every ETA_TIME_CONSTANT seconds.
+ETA_SAMPLE_SECONDS = 0.5
+ETA_TIME_CONSTANT = 10.0
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+REPORT_VERSION = 1
+
 
 class ImportResult(NamedTuple):
     logs: List[str]
     success: bool
+    # Performance report in JSON serializable form. See ImportMetrics.
+    report: Optional[Dict[str, Any]] = None
 
 
 class ImportInfo:
     """Handles files_list count and their size"""
 
-    files: list
+    files: Collection[FileLike]
     tot: int
     prev: int
+    running: int  # Files that are being transferred right now
+    failed: int  # Files that were given up on
 
     tot_size: int
     size: int
-    prev_time: datetime
-    prev_file_size: int
+    throughput: Optional[float]  # Smoothed bytes per second. None until first measured.
 
-    def __init__(self, files: list) -> None:
+    def __init__(self, files: Collection[FileLike]) -> None:
         self.files = files
         self.tot = len(files)
         self.prev = self.tot
         self.diff = 0
+        self.running = 0
+        self.failed = 0
         self.calculate_size()
         self.tot_size = self.size
 
@@ -53,21 +95,38 @@ class ImportInfo:
         self.size = 0
         for file in self.files:
             self.size += file.size
-        self.prev_time = datetime.now()
-        self.prev_file_size = 0
+        self.throughput = None
+        self._sample_start = time.monotonic()
+        self._sample_bytes = 0
 
     def update_size(self, file: FileLike) -> None:
         self.size -= file.size
-        self.prev_file_size = file.size
-        self.prev_time = datetime.now()
+        self._sample_bytes += file.size
+        self._update_throughput()
+
+    def _update_throughput(self) -> None:
+        """Folds the bytes transferred since the last sample into an exponentially weighted
+        moving average. Samples are at least ETA_SAMPLE_SECONDS long, so many small files
+        count as one sample, and older samples fade with time instead of per file."""
+        now = time.monotonic()
+        elapsed = now - self._sample_start
+        if elapsed < ETA_SAMPLE_SECONDS:
+            return
+        rate = self._sample_bytes / elapsed
+        if self.throughput is None:
+            self.throughput = rate
+        else:
+            weight = 1 - math.exp(-elapsed / ETA_TIME_CONSTANT)
+            self.throughput += weight * (rate - self.throughput)
+        self._sample_start = now
+        self._sample_bytes = 0
 
     @property
     def remaining_time_str(self) -> str:
-        if not self.prev_file_size and self.prev_time:
+        """Empty until the throughput was measured."""
+        if not self.throughput:
             return ""
-        timedelta = datetime.now() - self.prev_time
-        estimate = timedelta * self.size / self.prev_file_size
-        return self._format_timedelta(estimate)
+        return self._format_timedelta(timedelta(seconds=self.size / self.throughput))
 
     @property
     def size_str(self) -> str:
@@ -79,14 +138,14 @@ class ImportInfo:
 
     @property
     def curr(self) -> int:
-        return len(self.files)
+        return len(self.files) + self.running
 
     @property
     def left(self) -> int:
-        return self.tot - self.curr
+        return self.tot - self.curr - self.failed
 
     def _format_timedelta(self, timedelta: timedelta) -> str:
-        tot_secs = timedelta.seconds
+        tot_secs = int(timedelta.total_seconds())
         units = [60, 60 * 60, 60 * 60 * 24]
         seconds = tot_secs % units[0]
         minutes = (tot_secs % units[1]) // units[0]
@@ -111,26 +170,244 @@ class ImportInfo:
             size = size / 1000
         return "%.1f%s" % (size, "TB")
         
-def import_media(src: RootPath, on_done: Callable[[ImportResult], None]) -> None:
-    """Import media from a directory, and its subdirectories."""
-    MediaImporter().import_media(src, on_done)
+class ProgressReporter:
+    """Sends progress from a worker thread to the progress dialog, coalescing updates.
+    At most max_rate updates are sent per second, and only one waits on the main thread
+    at a time. It shows the latest state once it runs, so no update is out of date."""
 
-class MediaImporter:
+    def __init__(self, max_rate: float = PROGRESS_UPDATES_PER_SECOND) -> None:
+        self.interval = 1 / max_rate
+        self._latest: Optional[Tuple[str, int, int]] = None
+        self._pending = False
+        self._sent_at = 0.0
+        self._lock = threading.Lock()
+
+    def due(self) -> bool:
+        """Whether an update would be sent now. Lets callers skip building one that wouldn't."""
+        return not self._pending and time.monotonic() - self._sent_at >= self.interval
+
+    def update(self, label: str, value: int, max: int, force: bool = False) -> None:
+        """If force is True, the update is sent even if one was sent recently."""
+        with self._lock:
+            self._latest = (label, value, max)
+            if self._pending or not (force or self.due()):
+                return
+            self._pending = True
+            self._sent_at = time.monotonic()
+        aqt.mw.taskman.run_on_main(self._apply)
+
+    def _apply(self) -> None:
+        with self._lock:
+            self._pending = False
+            latest = self._latest
+        if latest is not None:
+            label, value, max = latest
+            aqt.mw.progress.update(label=label, value=value, max=max)
+
+
+class Histogram:
+    """Counts values in buckets with fixed upper bounds, plus one for larger values.
+    Percentiles are estimated as the upper bound of the bucket they fall in."""
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = percent / 100 * self.count
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.bounds[idx] if idx < len(self.bounds) else round(self.max, 3)
+        return round(self.max, 3)
+
+    def to_dict(self) -> Dict[str, Any]:
+        buckets = {f"<={bound}": count for bound, count in zip(self.bounds, self.counts)}
+        buckets[f">{self.bounds[-1]}"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 3) if self.count else None,
+            "max": round(self.max, 3),
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": buckets,
+        }
+
+
+class BackendMetrics:
+    """Transfers of one type of file"""
 
     def __init__(self) -> None:
+        self.transfers = 0
+        self.failures = 0  # Files that were given up on
+        self.retries = 0
+        self.rate_limits = 0
+        self.bytes = 0
+        self.latency = Histogram()  # Seconds per file
+
+    def to_dict(self, seconds: Optional[float]) -> Dict[str, Any]:
+        """seconds is the duration of the transfer phase, for the throughput."""
+        return {
+            "transfers": self.transfers,
+            "failures": self.failures,
+            "retries": self.retries,
+            "rate_limits": self.rate_limits,
+            "bytes": self.bytes,
+            "bytes_per_second": round(self.bytes / seconds) if seconds else None,
+            "latency": self.latency.to_dict(),
+        }
+
+
+class HostMetrics:
+    """HTTP requests to one host"""
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.errors = 0  # Error statuses and requests without a response
+        self.retries = 0  # Done by the transport before returning a response
+        self.latency = Histogram()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "latency": self.latency.to_dict(),
+        }
+
+
+class ImportMetrics:
+    """Timings and counters of an import, reported in ImportResult.report
+    so runs can be compared. Phases may overlap in a pipelined import."""
+
+    def __init__(self) -> None:
+        self.started = datetime.now()
+        self.phases: Dict[str, float] = {}  # {phase: seconds}
+        self.backends: Dict[str, BackendMetrics] = {}  # {FileLike type: metrics}
+        self.hosts: Dict[str, HostMetrics] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Adds the time spent in the block to the phase."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.monotonic() - start)
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def backend(self, file: FileLike) -> BackendMetrics:
+        with self._lock:
+            return self.backends.setdefault(type(file).__name__, BackendMetrics())
+
+    def record_request(
+        self, host: str, seconds: float, status: Optional[int], retries: int
+    ) -> None:
+        """Observer of the transport. Called from any thread."""
+        with self._lock:
+            metrics = self.hosts.setdefault(host, HostMetrics())
+            metrics.requests += 1
+            metrics.retries += retries
+            if status is None or status >= 400:
+                metrics.errors += 1
+            metrics.latency.record(seconds)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            transfer_time = self.phases.get("transfer")
+            return {
+                "started": self.started.isoformat(timespec="seconds"),
+                "phases": {name: round(secs, 3) for name, secs in self.phases.items()},
+                "backends": {
+                    name: metrics.to_dict(transfer_time)
+                    for name, metrics in self.backends.items()
+                },
+                "requests": {
+                    host: metrics.to_dict() for host, metrics in self.hosts.items()
+                },
+            }
+
+
+def import_media(
+    src: RootPath,
+    on_done: Callable[[ImportResult], None],
+    allow_hardlink: bool = False,
+    sync: bool = False,
+) -> None:
+    """Import media from a directory, and its subdirectories.
+    If allow_hardlink is True, local files are hard linked into collection.media when possible.
+    If sync is True, files that didn't change since the last import from src are skipped.
+    If src isn't listed yet, files are imported while it's being listed. See RootPath.iter_files()"""
+    MediaImporter(allow_hardlink, sync).import_media(src, on_done)
+
+
+def resume_import(journal: JournalInfo, on_done: Callable[[ImportResult], None]) -> None:
+    """Continue an interrupted import with the files that weren't imported yet."""
+    MediaImporter(journal.allow_hardlink).resume_import(journal, on_done)
+
+class MediaImporter:
+
+    def __init__(self, allow_hardlink: bool = False, sync: bool = False) -> None:
+        self._allow_hardlink = allow_hardlink
+        self._sync = sync
+        self._strategies: Dict[str, int] = {}  # {strategy: count of files added with it}
         self._logs: List[str] = []
         self._on_done: Optional[Callable[[ImportResult], None]] = None
         self._info: Optional[ImportInfo] = None
         self._src: Optional[RootPath] = None
         self._files_list: Optional[List[FileLike]] = None
+        self._queue: Optional[TransferQueue] = None
+        self._breakers: Dict[Type[FileLike], CircuitBreaker] = {}
+        self._throttles: Dict[Type[FileLike], Throttle] = {}
+        self._started: Dict[Future, float] = {}  # {transfer: time it started}
+        self._journal: Optional[ImportJournal] = None
+        self._manifest: Optional[Manifest] = None
+        self._listed: List[FileLike] = []  # All files of src, before any were skipped
+        self._analyzed = False  # Whether files were checked against collection.media
+        self._skipped_unchanged = 0  # Files skipped by sync mode
+        # Files that a pipelined import skipped without asking, by reason
+        self._skipped_invalid = 0
+        self._skipped_conflicts = 0
+        self._not_imported: List[FileLike] = []  # Name conflicts and failed files
+        # Files that passed the checks while src is being listed, waiting to join the queue
+        self._incoming: "queue.Queue[FileLike]" = queue.Queue()
+        self._lister: Optional[Future] = None
+        self._listing_token: Optional[ListingToken] = None
+        self._metrics = ImportMetrics()
+        # Connection stats of the transport before the import
+        self._transport_stats: Dict[str, HostStats] = {}
+        self._resumed = False
 
     def import_media(self, src: RootPath, on_done: Callable[[ImportResult], None]) -> None:
         """Import media from a directory, and its subdirectories."""
         self._on_done = on_done
         self._src = src
+        self._prepare_transport()
+        if src.listing_time is not None:
+            self._metrics.add_phase("listing", src.listing_time)
 
         try:
-            self._import_media_part_1()
+            if src.listed:
+                self._import_media_part_1()
+            else:
+                self._import_media_pipelined()
         except Exception as err:
             tb = traceback.format_exc()
             print(tb)
@@ -139,15 +416,197 @@ class MediaImporter:
             self._logs.append(str(err))
             self._finish_import("", success=False)
 
+    def resume_import(
+        self, info: JournalInfo, on_done: Callable[[ImportResult], None]
+    ) -> None:
+        """Skips listing and analyzing the files, which was done before the import was interrupted.
+        The root is restored in the background, as that checks which of its files still exist."""
+        self._on_done = on_done
+        aqt.mw.taskman.with_progress(
+            task=info.load,
+            on_done=lambda future: self._on_journal_loaded(info, future),
+            label="Resuming import",
+        )
+
+    def _on_journal_loaded(self, info: JournalInfo, future: Future) -> None:
+        try:
+            journal: ImportJournal = future.result()
+        except (OSError, ValueError) as err:
+            info.remove()
+            self._log(str(err))
+            self._log(f"The import from '{info.name}' can't be resumed anymore.")
+            self._on_done(ImportResult(self._logs, success=False))
+            return
+        self._src = journal.root
+        self._journal = journal
+        self._resumed = True
+        self._prepare_transport()
+        missing = set(self._src.missing)
+        self._listed = [file for file in journal.files if file not in missing]
+        self._analyzed = True
+        self._manifest = load_manifest(self._src)
+        self._files_list = [file for file in journal.remaining if file not in missing]
+        self._info = ImportInfo(self._files_list)
+        self._log(
+            f"Resuming import from '{self._src.name}': "
+            f"{len(journal.done)} / {len(journal.files)} media files were already imported."
+        )
+        for file in journal.remaining:
+            if file in missing:
+                self._log(f"'{file.name}' doesn't exist anymore and is skipped.")
+        self._log(f"{self._info.curr} media files will be processed.")
+        aqt.mw.taskman.with_progress(
+            task=self._import_files_list,
+            on_done=self._on_import_done,
+            label="Importing"
+        )
+
+    def _prepare_transport(self) -> None:
+        """Makes room for the connections of src, and remembers the stats from before,
+        so only the connections of this import are reported."""
+        if self._src.remote:
+            transport.reserve(self._src.max_connections())
+        self._transport_stats = transport.stats()
+
+    def _import_media_pipelined(self) -> None:
+        """Lists, checks and transfers files at the same time, so the first files are imported
+        before the listing is complete. There's no asking about name conflicts before
+        transferring, so files that conflict are skipped and logged instead."""
+        self._manifest = load_manifest(self._src)
+        self._analyzed = True
+        self._files_list = []
+        self._info = ImportInfo(self._files_list)
+        aqt.mw.taskman.with_progress(
+            task=self._import_files_list,
+            on_done=self._on_import_done,
+            label="Importing"
+        )
+
+    def _list_and_check(self, token: ListingToken) -> None:
+        """The stages of the pipeline before the transfer, run in their own thread.
+        Files of src are checked as soon as they are listed, and the ones to import
+        are put on self._incoming. Files with a name that was already taken are compared
+        once the listing is done, only to tell apart identical files from name conflicts."""
+        media_dir = aqt.mw.col.media.dir()
+        names: Dict[str, FileLike] = {}  # {name: first file with it}
+        unnormalized: List[FileLike] = []
+        unchanged = 0
+        # (file, file it has the same name as)
+        pairs: List[Tuple[FileLike, FileLike]] = []
+        in_collection: List[bool] = []  # Whether the other file of the pair is in collection.media
+
+        listing_start = time.monotonic()
+        for file in self._src.iter_files(token):
+            self._listed.append(file)
+            if file.name != unicodedata.normalize("NFC", file.name):
+                unnormalized.append(file)
+                continue
+            if (
+                self._sync
+                and self._manifest is not None
+                and self._manifest.is_unchanged(file)
+                and os.path.exists(os.path.join(media_dir, file.name))
+            ):
+                unchanged += 1
+                continue
+            if file.name in names:
+                pairs.append((file, names[file.name]))
+                in_collection.append(False)
+            elif os.path.exists(os.path.join(media_dir, file.name)):
+                pairs.append((file, LocalFile(Path(media_dir, file.name))))
+                in_collection.append(True)
+            else:
+                names[file.name] = file
+                self._incoming.put(file)
+        self._metrics.add_phase("listing", time.monotonic() - listing_start)
+        with self._metrics.phase("analysis"):
+            # The transfer reports progress meanwhile.
+            is_identical = compare_files(pairs, report_progress=False)
+
+        self._log(f"{len(self._listed)} media files found.")
+        if unnormalized:
+            self._not_imported.extend(unnormalized)
+            self._skipped_invalid += len(unnormalized)
+            self._log(
+                f"{len(unnormalized)} files have invalid file names: {[x.name for x in unnormalized]}"
+            )
+        if unchanged:
+            self._log(
+                f"{unchanged} files were skipped because they didn't change since the last import."
+            )
+        duplicates = sum(
+            same and not existing for existing, same in zip(in_collection, is_identical)
+        )
+        if duplicates:
+            self._log(f"{duplicates} files were skipped because they are identical.")
+        existing = sum(same and existing for existing, same in zip(in_collection, is_identical))
+        if existing:
+            self._log(f"{existing} files were skipped because they already exist in collection.")
+
+        for conflicts_in_collection, msg in (
+            (False, "files have the same name as other files being imported:"),
+            (True, "files have the same name as existing media files:"),
+        ):
+            name_conflicts = [
+                file
+                for (file, _), existing, same in zip(pairs, in_collection, is_identical)
+                if not same and existing == conflicts_in_collection
+            ]
+            if name_conflicts:
+                self._not_imported.extend(name_conflicts)
+                self._skipped_conflicts += len(name_conflicts)
+                self._log(f"{len(name_conflicts)} {msg}")
+                self._log_file_names(name_conflicts)
+
+    def _take_incoming(self, timeout: Optional[float] = None) -> None:
+        """Moves files that passed the checks to the transfer queue.
+        If timeout is given, waits up to that long for the first one."""
+        try:
+            while True:
+                if timeout is not None:
+                    file = self._incoming.get(timeout=timeout)
+                    timeout = None
+                else:
+                    file = self._incoming.get_nowait()
+                self._queue.add(file)
+                self._info.tot += 1
+                self._info.tot_size += file.size
+                self._info.size += file.size
+        except queue.Empty:
+            pass
+
+    @property
+    def _listing(self) -> bool:
+        """Whether src is still being listed"""
+        return self._lister is not None and not self._lister.done()
+
+    def _stop_listing(self) -> None:
+        if self._listing_token is not None:
+            self._listing_token.cancel()
+        if self._lister is not None:
+            wait([self._lister])
+
+    @contextmanager
+    def _listing_stopped_on_exit(self) -> Iterator[None]:
+        """Stops the listing when the block exits, also if it raised,
+        so it doesn't go on in the background after the transfer."""
+        try:
+            yield
+        finally:
+            self._stop_listing()
+
     def _import_media_part_1(self) -> None:
 
         # Get the name of all media files.
         self._files_list = self._src.files
+        self._listed = list(self._files_list)
+        self._manifest = load_manifest(self._src)
         self._info = ImportInfo(self._files_list)
         self._log(f"{self._info.tot} media files found.")
 
         # Normalize file names
-        unnormalized = find_unnormalized_name(self._files_list)
+        with self._metrics.phase("normalization"):
+            unnormalized = find_unnormalized_name(self._files_list)
         if len(unnormalized):
             self._finish_import(
                 f"{len(unnormalized)} files have invalid file names: {[x.name for x in unnormalized]}",
@@ -155,38 +614,66 @@ class MediaImporter:
             )
             return
 
+        # Check for name conflicts in the background and then continue with part 2 of the import.
+        # (Checking for file conflicts can take quite a while and we don't want to block the UI.)
+        aqt.mw.taskman.with_progress(
+            task=self._analyze_files,
+            on_done=self._import_media_part_2,
+            label="Analyzing media files",
+        )
+
+    def _analyze_files(self) -> Optional[List[FileLike]]:
+        """Returns files whose names conflict with existing media files,
+        or None if there are different new files with the same name."""
+        with observing(self._metrics.record_request), self._metrics.phase("analysis"):
+            return self._analyze_files_list()
+
+    def _analyze_files_list(self) -> Optional[List[FileLike]]:
+        if self._sync and self._manifest is not None:
+            self._skip_unchanged(self._manifest)
+
         # Make sure there isn't a name conflict within new files.
         if name_conflict_exists(self._files_list):
-            self._finish_import("There are multiple files with same filename.", success=False)
-            return
+            return None
 
         if self._info.update_count():
             self._log(f"{self._info.diff} files were skipped because they are identical.")
 
-        # Check collection.media if there is a file with same name in the background
-        # and then continue with part 2 of the import. 
-        # (Checking for file conflicts can take quite a while and we don't want to block the UI.)
-        aqt.mw.taskman.with_progress(
-            task=lambda: name_exists_in_collection(self._files_list),
-            on_done=self._import_media_part_2,
-            label="Analyzing media files",
-        )
+        # Check collection.media if there is a file with same name
+        return name_exists_in_collection(self._files_list)
+
+    def _skip_unchanged(self, manifest: Manifest) -> None:
+        """Removes files that didn't change since they were last imported and are still in collection.media."""
+        media_dir = aqt.mw.col.media.dir()
+        count = len(self._files_list)
+        self._files_list[:] = [
+            file
+            for file in self._files_list
+            if not (
+                manifest.is_unchanged(file)
+                and os.path.exists(os.path.join(media_dir, file.name))
+            )
+        ]
+        self._skipped_unchanged = count - len(self._files_list)
+        if self._info.update_count():
+            self._log(
+                f"{self._info.diff} files were skipped because they didn't change since the last import."
+            )
 
     def _import_media_part_2(self, future: Future) -> None:
         name_conflicts = future.result()
 
+        if name_conflicts is None:
+            self._finish_import("There are multiple files with same filename.", success=False)
+            return
+
+        self._analyzed = True
+        self._not_imported.extend(name_conflicts)
+
         if len(name_conflicts):
             msg = f"{len(name_conflicts)} files have the same name as existing media files:"
             self._log(msg)
-
-            max_file_amount_in_msg = 10
-            name_conflict_truncated = name_conflicts[:max_file_amount_in_msg]
-            file_names_str = ""
-            for file in name_conflict_truncated:
-                file_names_str += file.name + "\n"
-            file_names_str += "...\n" if len(name_conflicts) > max_file_amount_in_msg else ""
-
-            self._log(file_names_str + "-" * 16)
+            self._log_file_names(name_conflicts)
             ask_msg = msg + "\nDo you want to import the rest of the files?"
             diag = askUserDialog(ask_msg, buttons=["Abort Import", "Continue Import"])
             if diag.run() == "Abort Import":
@@ -210,9 +697,12 @@ class MediaImporter:
         self._log(f"{self._info.curr} media files will be processed.")
         self._info.calculate_size()
 
+        # The zip has the whole folder, so it's only worth it if sync mode didn't skip files.
+        # The manifest is still recorded from self._src when the zip import finishes.
         if (
             isinstance(self._src, GDriveRoot)
             and len(self._files_list) > GDRIVE_DOWNLOAD_AS_ZIP_THRESHOLD
+            and not self._skipped_unchanged
         ):
             gdrive.download_folder_zip(self._src.id, self._finish_import)
         else:
@@ -225,74 +715,323 @@ class MediaImporter:
 
     def _import_files_list(self) -> Tuple[bool, str]:
         """returns (is_success, result msg)"""
-        MAX_ERRORS = 5
-        error_cnt = 0  # Count of errors in succession
-
-        while True:
-            # Last file was added
-            if len(self._files_list) == 0:
-                return (True, f"{self._info.tot} media files were imported.")
+        with observing(self._metrics.record_request), self._metrics.phase("transfer"):
+            return self._transfer_files()
 
-            # Abort import
-            if aqt.mw.progress.want_cancel():
-                return (
-                    False,
-                    f"Import aborted.\n{self._info.left} / {self._info.tot} media files were imported.",
-                )
-
-            progress_msg = (
-                f"Adding media files ({self._info.left} / {self._info.tot})\n"
-                f"{self._info.size_str}/{self._info.tot_size_str} "
-                f"({self._info.remaining_time_str} left)"
-            )
-            aqt.mw.taskman.run_on_main(
-                lambda: aqt.mw.progress.update(
-                    label=progress_msg, value=self._info.left, max=self._info.tot
+    def _transfer_files(self) -> Tuple[bool, str]:
+        # Files of a pipelined import aren't known up front, so it has no journal.
+        if self._journal is None and self._src.listed:
+            try:
+                self._journal = ImportJournal.create(
+                    self._src, self._files_list, self._allow_hardlink
                 )
+            except OSError as err:
+                # The import works without a journal, it just can't be resumed.
+                print(f"Media Import: Couldn't create journal: {err}")
+        self._queue = TransferQueue(self._files_list)
+        self._info.files = self._queue
+        failed: List[FileLike] = []
+        max_workers = max(1, self._src.max_workers)
+        running: Dict[Future, FileLike] = {}
+        progress = ProgressReporter()
+        lister_executor = ThreadPoolExecutor(max_workers=1)
+        if not self._src.listed:
+            self._listing_token = ListingToken()
+            self._lister = lister_executor.submit(
+                in_context(self._list_and_check), self._listing_token
             )
 
-            file = self._files_list.pop(0)
-            self._info.update_size(file)
+        # The listing is stopped first on exit, before the executors wait for their tasks.
+        with lister_executor, ThreadPoolExecutor(
+            max_workers=max_workers
+        ) as executor, self._listing_stopped_on_exit():
+            while True:
+                # Abort import. Files that are already being transferred are finished first.
+                if aqt.mw.progress.want_cancel():
+                    self._stop_listing()
+                    self._wait_for_running(running, failed)
+                    return (
+                        False,
+                        f"Import aborted.\n{self._info.left} / {self._info.tot} media files were imported.",
+                    )
 
-            try:
-                add_media(file)
-                error_cnt = 0  # reset error_cnt on success
-            except (AddonError, RequestException) as err:
-                error_cnt += 1
-                self._log("-" * 16 + "\n" + str(err) + "\n" + "-" * 16)
-                if error_cnt > MAX_ERRORS:
-                    self._log(f"{self._info.left} files were not imported.")
-                    if self._info.left < 10:
-                        for file in self._files_list:
+                # Checked before taking files, so none are missed once the listing is done.
+                listing = self._listing
+                self._take_incoming()
+                while len(running) < max_workers:
+                    file = self._queue.pop()
+                    if file is None:
+                        break
+                    throttle = self._throttle(file)
+                    if self._breaker(file).is_open or (
+                        throttle is not None
+                        and (len(running) >= throttle.limit or not throttle.try_acquire())
+                    ):
+                        self._queue.put_back(file)
+                        break
+                    future = executor.submit(
+                        in_context(add_media), file, self._allow_hardlink
+                    )
+                    running[future] = file
+                    self._started[future] = time.monotonic()
+                    self._info.running += 1
+
+                # Last file was added
+                if not running and not len(self._queue) and not listing:
+                    break
+
+                if progress.due():
+                    progress.update(
+                        self._progress_msg(listing), self._info.left, self._info.tot
+                    )
+
+                # Wait for a transfer to finish, or for a file to be ready for retry.
+                # Time out regularly so cancellation is noticed during long transfers.
+                if not running:
+                    if listing and not len(self._queue):
+                        self._take_incoming(timeout=0.5)
+                    else:
+                        time.sleep(min(0.5, self._seconds_until_ready()))
+                    continue
+                done, _ = wait(running, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file = running.pop(future)
+                    self._info.running -= 1
+                    self._on_transfer_done(future, file, failed)
+
+                broken = [b for b in self._breakers.values() if b.is_broken]
+                if broken:
+                    self._stop_listing()
+                    self._wait_for_running(running, failed)
+                    self._log(f"{self._info.tot - self._info.left} files were not imported.")
+                    if self._info.tot - self._info.left < 10:
+                        for file in [*self._queue, *failed]:
                             self._log(file.name)
                     return (
                         False,
                         f"{self._info.left} / {self._info.tot} media files were imported.",
                     )
-                else:
-                    self._files_list.append(file)
+
+        if self._lister is not None:
+            try:
+                self._lister.result()
+            except (AddonError, RequestException, OSError) as err:
+                self._log(f"Listing '{self._src.name}' failed: {err}")
+                return (
+                    False,
+                    f"{self._info.left} / {self._info.tot} media files were imported.",
+                )
+        if failed or self._skipped_invalid or self._skipped_conflicts:
+            if failed:
+                self._log(f"{len(failed)} files could not be imported:")
+                self._log("\n".join(file.name for file in failed))
+            msg = f"{self._info.left} / {self._info.tot} media files were imported."
+            return (False, " ".join([msg, *self._skipped_msgs()]))
+        return (True, f"{self._info.tot} media files were imported.")
+
+    def _skipped_msgs(self) -> List[str]:
+        """Why a pipelined import skipped files without asking. Shown in the result dialog,
+        since the user isn't asked about name conflicts like when the files are listed first."""
+        msgs = []
+        if self._skipped_conflicts:
+            msgs.append(
+                f"{self._skipped_conflicts} files were skipped because of name conflicts. "
+                "To choose what to do with them, import after the files are listed."
+            )
+        if self._skipped_invalid:
+            msgs.append(f"{self._skipped_invalid} files with invalid names were skipped.")
+        return msgs
+
+    def _progress_msg(self, listing: bool) -> str:
+        tot_str = f"{self._info.tot}+" if listing else str(self._info.tot)
+        msg = (
+            f"Adding media files ({self._info.left} / {tot_str})\n"
+            f"{self._info.size_str}/{self._info.tot_size_str}"
+        )
+        remaining = self._info.remaining_time_str
+        return f"{msg} ({remaining} left)" if remaining else msg
+
+    def _on_transfer_done(
+        self, future: Future, file: FileLike, failed: List[FileLike]
+    ) -> None:
+        breaker = self._breaker(file)
+        throttle = self._throttle(file)
+        seconds = time.monotonic() - self._started.pop(future)
+        metrics = self._metrics.backend(file)
+        try:
+            self._count_strategy(future.result())
+            metrics.transfers += 1
+            metrics.bytes += file.size
+            metrics.latency.record(seconds)
+            breaker.record_success()
+            if throttle is not None:
+                throttle.record_success(seconds, file.size)
+            if self._journal is not None:
+                self._journal.record_done(file)
+            self._info.update_size(file)
+        except (AddonError, OSError) as err:
+            # RequestException is an OSError too.
+            self._log("-" * 16 + "\n" + str(err) + "\n" + "-" * 16)
+            if isinstance(err, RateLimitError):
+                metrics.rate_limits += 1
+                if throttle is not None:
+                    throttle.record_rate_limit()
+            # Server or network trouble is likely to affect other files too.
+            if isinstance(err, (ServerError, RequestException)):
+                breaker.record_failure()
+            permanent = (
+                not isinstance(err, RequestException)
+                and isinstance(err, OSError)
+                and err.errno in PERMANENT_ERRNOS
+            )
+            if not permanent and self._queue.retry(file):
+                metrics.retries += 1
+            else:
+                metrics.failures += 1
+                failed.append(file)
+                self._info.failed += 1
+                self._not_imported.append(file)
+                if self._journal is not None:
+                    self._journal.record_failed(file)
+
+    def _wait_for_running(
+        self, running: Dict[Future, FileLike], failed: List[FileLike]
+    ) -> None:
+        """Waits for transfers in progress to finish, and updates the counts."""
+        for future, file in running.items():
+            self._info.running -= 1
+            self._on_transfer_done(future, file, failed)
+        running.clear()
+
+    def _breaker(self, file: FileLike) -> CircuitBreaker:
+        """Each backend has its own circuit breaker."""
+        backend = type(file)
+        if backend not in self._breakers:
+            self._breakers[backend] = CircuitBreaker()
+        return self._breakers[backend]
+
+    def _throttle(self, file: FileLike) -> Optional[Throttle]:
+        """Transfers from remote backends adapt to their rate limits."""
+        if not self._src.remote:
+            return None
+        backend = type(file)
+        if backend not in self._throttles:
+            self._throttles[backend] = Throttle(max(1, self._src.max_workers))
+        return self._throttles[backend]
+
+    def _seconds_until_ready(self) -> float:
+        """How long until another file can be transferred"""
+        seconds = self._queue.seconds_until_ready() or 0.0
+        for breaker in self._breakers.values():
+            seconds = max(seconds, breaker.seconds_until_closed)
+        for throttle in self._throttles.values():
+            seconds = max(seconds, throttle.seconds_until_token())
+        return seconds
+
+    def _count_strategy(self, strategy: Optional[str]) -> None:
+        if strategy is not None:
+            self._strategies[strategy] = self._strategies.get(strategy, 0) + 1
 
     def _on_import_done(self, future: Future) -> None:
         try:
             (success, msg) = future.result()
-            self._finish_import(msg, success)
         except Exception as err:
-            raise err
+            # The import is finished either way, so the progress dialog closes.
+            tb = traceback.format_exc()
+            print(tb)
+            self._logs.append(tb)
+            (success, msg) = (False, str(err))
+        self._finish_import(msg, success)
 
     def _finish_import(self, msg: str, success: bool) -> None:
-        self._log(msg)
-        result = ImportResult(self._logs, success)
-        aqt.mw.progress.finish()
-        aqt.mw.col.media.check()
-        self._on_done(result)
+        try:
+            if isinstance(self._src, LocalRoot) and self._strategies:
+                strategies_str = ", ".join(
+                    f"{strategy}: {cnt}" for strategy, cnt in self._strategies.items()
+                )
+                self._log(f"Files were copied using {strategies_str}")
+            elif self._src.remote and transport.stats(self._transport_stats):
+                self._log(f"Connections: {transport.stats_str(self._transport_stats)}")
+            self._log(msg)
+            self._update_manifest()
+            if self._journal is not None:
+                # Incomplete imports can be resumed later.
+                if success:
+                    self._journal.remove()
+                else:
+                    self._journal.close()
+        finally:
+            aqt.mw.progress.finish()
+            with self._metrics.phase("media_check"):
+                aqt.mw.col.media.check()
+            result = ImportResult(self._logs, success, self._report(success))
+            self._on_done(result)
+
+    def _report(self, success: bool) -> Dict[str, Any]:
+        return {
+            "version": REPORT_VERSION,
+            "root": {"type": type(self._src).__name__, "name": self._src.name},
+            "options": {
+                "allow_hardlink": self._allow_hardlink,
+                "sync": self._sync,
+                "pipelined": self._lister is not None,
+                "resumed": self._resumed,
+            },
+            "success": success,
+            "files": {
+                "listed": len(self._listed),
+                "transferred": sum(self._strategies.values()),
+                "not_imported": len(self._not_imported),
+            },
+            "strategies": dict(self._strategies),
+            **self._metrics.to_dict(),
+        }
+
+    def _update_manifest(self) -> None:
+        """Records the files that are now in collection.media, for sync mode."""
+        if self._manifest is None or not self._analyzed:
+            return
+        media_dir = aqt.mw.col.media.dir()
+        not_imported = set(self._not_imported)
+        if self._queue is not None:
+            not_imported.update(self._queue)  # Left over when the import was aborted
+        self._manifest.update(
+            file
+            for file in self._listed
+            if file not in not_imported
+            and os.path.exists(os.path.join(media_dir, file.name))
+        )
+        try:
+            self._manifest.save()
+        except OSError as err:
+            print(f"Media Import: Couldn't save manifest: {err}")
 
     def _log(self, msg: str) -> None:
         print(f"Media Import: {msg}")
         self._logs.append(msg)
 
+    def _log_file_names(self, files: Sequence[FileLike]) -> None:
+        max_file_amount_in_msg = 10
+        file_names_str = ""
+        for file in files[:max_file_amount_in_msg]:
+            file_names_str += file.name + "\n"
+        file_names_str += "...\n" if len(files) > max_file_amount_in_msg else ""
+        self._log(file_names_str + "-" * 16)
+
 
 
 
+def load_manifest(src: RootPath) -> Optional[Manifest]:
+    # Temporary roots like downloaded zip files can't be imported again.
+    if not src.supports_snapshot:
+        return None
+    try:
+        return Manifest.load(src)
+    except OSError as err:
+        print(f"Media Import: Couldn't load manifest: {err}")
+        return None
+
+
 def find_unnormalized_name(files: Sequence[FileLike]) -> List[FileLike]:
     """Returns list of files whose names are not normalized."""
     unnormalized = []
@@ -308,52 +1047,131 @@ def name_conflict_exists(files_list: List[FileLike]) -> bool:
     """Returns True if there are different files with the same name.
     And removes identical files from files_list so only one remains."""
     file_names: Dict[str, FileLike] = {}  # {file_name: file_path}
-    identical: List[int] = []
+    duplicates: List[int] = []  # Indices of files whose name appeared before
 
     for idx, file in enumerate(files_list):
         name = file.name
         if name in file_names:
-            if file.is_identical(file_names[name]):
-                identical.append(idx)
-            else:
-                return True
+            duplicates.append(idx)
         else:
             file_names[name] = file
-    for idx in sorted(identical, reverse=True):
+
+    is_identical = compare_files(
+        [(files_list[idx], file_names[files_list[idx].name]) for idx in duplicates]
+    )
+    if not all(is_identical):
+        return True
+    for idx in sorted(duplicates, reverse=True):
         files_list.pop(idx)
     return False
 
 
 def name_exists_in_collection(files_list: List[FileLike]) -> List[FileLike]:
     """Returns list of files whose names conflict with existing media files.
-    And remove files if identical file exists in collection."""
-    media_dir = LocalRoot(media_paths_from_col_path(aqt.mw.col.path)[0], recursive=False)
-    collection_file_paths = media_dir.files
-    collection_files = {file.name: file for file in collection_file_paths}
+    And remove files if identical file exists in collection.
+    Only the names of files_list are looked up, so the size of the media folder doesn't matter."""
+    media_dir = Path(media_paths_from_col_path(aqt.mw.col.path)[0])
 
-    name_conflicts: List[FileLike] = []
     to_pop: List[int] = []
+    pairs: List[Tuple[FileLike, FileLike]] = []
 
     for idx, file in enumerate(files_list):
-        if file.name in collection_files:
+        collection_file_path = media_dir / file.name
+        if collection_file_path.is_file():
             to_pop.append(idx)
-            if not file.is_identical(collection_files[file.name]):
-                name_conflicts.append(file)
+            pairs.append((file, LocalFile(collection_file_path)))
+
+    is_identical = compare_files(pairs)
+    name_conflicts = [pair[0] for pair, same in zip(pairs, is_identical) if not same]
 
     for idx in sorted(to_pop, reverse=True):
         files_list.pop(idx)
     return name_conflicts
 
 
-def add_media(file: FileLike) -> bool:
+def compare_files(
+    pairs: Sequence[Tuple[FileLike, FileLike]], report_progress: bool = True
+) -> List[bool]:
+    """Returns whether the files of each pair are identical.
+    Comparisons run on a thread pool. Files are hashed in chunks, during which hashlib releases the GIL.
+    Progress is reported to the progress dialog, if one is open and report_progress is True."""
+    results = [False] * len(pairs)
+    if not pairs:
+        return results
+
+    progress = ProgressReporter()
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+        futures = {
+            executor.submit(in_context(file.is_identical), other): idx
+            for idx, (file, other) in enumerate(pairs)
+        }
+        for done_cnt, future in enumerate(as_completed(futures), start=1):
+            results[futures[future]] = future.result()
+            last = done_cnt == len(pairs)
+            if report_progress and (progress.due() or last):
+                progress.update(
+                    f"Analyzing media files ({done_cnt} / {len(pairs)})",
+                    done_cnt,
+                    len(pairs),
+                    force=last,
+                )
+    return results
+
+
+def add_media(file: FileLike, allow_hardlink: bool = False) -> Optional[str]:
     """
-    Returns true if file was added.
+    Returns how the file was added, or None if it already exists.
     col.media.check() should be called at the end.
     """
-    file_path = os.path.join(aqt.mw.col.media.dir(), file.name)
+    media_dir = aqt.mw.col.media.dir()
+    file_path = os.path.join(media_dir, file.name)
     if os.path.exists(file_path):
-        return False
-    with open(file_path, "wb") as f:
-        data = file.read_bytes()
-        f.write(data)
-        return True
+        return None
+    if isinstance(file, LocalFile):
+        if allow_hardlink and file.link_to(file_path):
+            return "hardlink"
+        if file.clone_to(file_path):
+            return "reflink"
+    if file.resumable and file.size >= RESUMABLE_MIN_SIZE:
+        dir = partial_dir()
+        if dir is not None:
+            return download_resumable(file, file_path, dir)
+    # Write to a temporary file first, so a failed transfer doesn't leave a truncated file behind.
+    fd, temp_path = tempfile.mkstemp(dir=media_dir, prefix=".", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if isinstance(file, LocalFile):
+                strategy = file.copy_into(f)
+            else:
+                for chunk in file.iter_chunks():
+                    f.write(chunk)
+                strategy = "stream"
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return strategy
+
+
+def download_resumable(file: FileLike, file_path: str, dir: str) -> str:
+    """Downloads into a partial file, continuing where a previous attempt stopped."""
+    partial = PartialDownload(dir, file)
+    start = partial.completed
+    try:
+        partial.open()
+        if start < file.size:
+            chunks = file.iter_chunks_from(start) if start else file.iter_chunks()
+            for chunk in chunks:
+                partial.write(chunk)
+    except BaseException:
+        # Keep what was downloaded for the next attempt.
+        try:
+            partial.record()
+        finally:
+            partial.close()
+        raise
+    if partial.completed != file.size:
+        partial.discard()
+        raise RequestError(-1, f"Downloaded {partial.completed} of {file.size} bytes")
+    partial.finish(file_path)
+    return "resume" if start else "stream"
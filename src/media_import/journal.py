@@ -0,0 +1,250 @@
+import json
+import os
+import threading
+import time
+from hashlib import md5
+from typing import (Any, Dict, List, NamedTuple, Optional, Set, TextIO, Tuple,
+                    Type)
+
+import aqt
+
+from .pathlike import FileLike, LocalRoot, RootPath
+from .pathlike.apkg import ApkgRoot
+from .pathlike.gdrive import GDriveRoot
+from .pathlike.mega import MegaRoot
+
+JOURNAL_DIRNAME = "media_import_journals"
+JOURNAL_VERSION = 2
+
+# Roots that can be restored from a journal, by class name
+ROOT_CLASSES: Dict[str, Type[RootPath]] = {
+    cls.__name__: cls for cls in (LocalRoot, ApkgRoot, GDriveRoot, MegaRoot)
+}
+
+
+class JournalInfo(NamedTuple):
+    """What the import dialog shows of a journal. Read without restoring the root,
+    which can take a while, e.g. to check which local files still exist."""
+
+    path: str
+    name: str  # Name of the root
+    total: int  # Number of files to transfer
+    done: int  # Number of files that were transferred
+    created: float  # When the import started, as a timestamp
+    allow_hardlink: bool
+
+    @property
+    def remaining(self) -> int:
+        return self.total - self.done
+
+    def load(self) -> "ImportJournal":
+        """Restores the root. Raises ValueError if the journal can't be resumed anymore."""
+        return ImportJournal.load(self.path)
+
+    def remove(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class ImportJournal:
+    """Progress of an import, saved to disk as files are transferred.
+    An interrupted import can be resumed from it, without listing and analyzing the files again.
+
+    The file is written in JSON lines. The first line holds the root and the files to transfer,
+    and every later line records one file that was transferred or given up on, by its index.
+    A line that was cut off by a crash is ignored."""
+
+    path: str
+    root: RootPath
+    files: List[FileLike]
+    done: Set[int]
+    failed: Set[int]
+    allow_hardlink: bool
+
+    def __init__(
+        self,
+        path: str,
+        root: RootPath,
+        files: List[FileLike],
+        allow_hardlink: bool = False,
+        done: Optional[Set[int]] = None,
+        failed: Optional[Set[int]] = None,
+    ) -> None:
+        self.path = path
+        self.root = root
+        self.files = files
+        self.allow_hardlink = allow_hardlink
+        self.done = done if done is not None else set()
+        self.failed = failed if failed is not None else set()
+        self._index = {file: idx for idx, file in enumerate(files)}
+        self._f: Optional[TextIO] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(
+        cls, root: RootPath, files: List[FileLike], allow_hardlink: bool = False
+    ) -> Optional["ImportJournal"]:
+        """Starts a new journal for root, replacing a previous one of the same root.
+        Returns None if the root can't be restored later."""
+        dir = journal_dir()
+        if dir is None or not root.supports_snapshot:
+            return None
+        header = {
+            "version": JOURNAL_VERSION,
+            "type": type(root).__name__,
+            "allow_hardlink": allow_hardlink,
+            "name": root.name,
+            "total": len(files),
+            "created": time.time(),
+            "root": root.to_snapshot(files),
+        }
+        journal = cls(journal_path(dir, root), root, files, allow_hardlink)
+        # Written to a temporary file first, so a crash can't leave a journal without its header.
+        temp_path = journal.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(header) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, journal.path)
+        return journal
+
+    @classmethod
+    def load(cls, path: str) -> "ImportJournal":
+        """Restores the root of the journal.
+        Raises ValueError if the journal is invalid or its root can't be restored anymore."""
+        (header, done, failed) = _read(path)
+        try:
+            root = ROOT_CLASSES[header["type"]].from_snapshot(header["root"])
+        # The snapshot may be of an older layout, or point to a file that changed since,
+        # e.g. an .apkg that isn't a zip file anymore. Either way it can't be resumed.
+        except Exception as err:
+            raise ValueError(f"Couldn't restore {header['type']}: {err!r}")
+        return cls(path, root, root.files, header["allow_hardlink"], done, failed - done)
+
+    @classmethod
+    def read_info(cls, path: str) -> JournalInfo:
+        """Reads what the journal is about, without restoring the root.
+        Raises ValueError if the journal is invalid."""
+        (header, done, _) = _read(path)
+        try:
+            return JournalInfo(
+                path,
+                name=str(header["name"]),
+                total=int(header["total"]),
+                done=len(done),
+                created=float(header["created"]),
+                allow_hardlink=header["allow_hardlink"],
+            )
+        except (KeyError, TypeError, ValueError) as err:
+            raise ValueError(f"Invalid journal: {err!r}")
+
+    @property
+    def remaining(self) -> List[FileLike]:
+        """Files that weren't transferred yet, including failed ones"""
+        return [file for idx, file in enumerate(self.files) if idx not in self.done]
+
+    def record_done(self, file: FileLike) -> None:
+        idx = self._index[file]
+        self.done.add(idx)
+        self.failed.discard(idx)
+        self._append({"done": idx})
+
+    def record_failed(self, file: FileLike) -> None:
+        idx = self._index[file]
+        self.failed.add(idx)
+        self._append({"failed": idx})
+
+    def _append(self, entry: dict) -> None:
+        with self._lock:
+            if self._f is None:
+                self._f = open(self.path, "a", encoding="utf-8")
+            self._f.write(json.dumps(entry) + "\n")
+            self._f.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+
+    def remove(self) -> None:
+        """Removes the journal once the import is complete."""
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _read(path: str) -> Tuple[Dict[str, Any], Set[int], Set[int]]:
+    """Returns (header, indices of done files, indices of failed files).
+    Raises ValueError if the header is invalid."""
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.read().split("\n")
+    try:
+        header = json.loads(lines[0])
+        if header["version"] != JOURNAL_VERSION:
+            raise ValueError("Unsupported journal version")
+        if header["type"] not in ROOT_CLASSES:
+            raise ValueError(f"Unknown root type {header['type']}")
+        header["allow_hardlink"] = bool(header["allow_hardlink"])
+        if "root" not in header:
+            raise ValueError("The journal has no root")
+    except (KeyError, TypeError) as err:
+        raise ValueError(f"Invalid journal: {err!r}")
+    done: Set[int] = set()
+    failed: Set[int] = set()
+    for line in lines[1:]:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(entry, dict):
+            continue
+        if isinstance(entry.get("done"), int):
+            done.add(entry["done"])
+        elif isinstance(entry.get("failed"), int):
+            failed.add(entry["failed"])
+    return (header, done, failed)
+
+
+def journal_dir() -> Optional[str]:
+    """Returns the directory for journals of the current profile, next to its collection.
+    Returns None if no collection is open."""
+    if aqt.mw is None or aqt.mw.col is None:
+        return None
+    dir = os.path.join(os.path.dirname(aqt.mw.col.path), JOURNAL_DIRNAME)
+    os.makedirs(dir, exist_ok=True)
+    return dir
+
+
+def journal_path(dir: str, root: RootPath) -> str:
+    """Each root has one journal."""
+    key = f"{type(root).__name__}:{root.raw}"
+    return os.path.join(dir, md5(key.encode("utf-8")).hexdigest() + ".jsonl")
+
+
+def latest_journal() -> Optional[JournalInfo]:
+    """Returns the journal of the most recent interrupted import that has files left.
+    Invalid journals are removed. Whether its root can still be restored is only known
+    once it's loaded, see JournalInfo.load()."""
+    dir = journal_dir()
+    if dir is None:
+        return None
+    paths = [
+        entry.path for entry in os.scandir(dir) if entry.name.endswith(".jsonl")
+    ]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths:
+        try:
+            info = ImportJournal.read_info(path)
+        except (OSError, ValueError) as err:
+            print(f"Media Import: Removing journal {path}: {err}")
+            os.remove(path)
+            continue
+        if info.remaining > 0:
+            return info
+        info.remove()
+    return None
@@ -0,0 +1,67 @@
+import json
+import os
+from hashlib import md5
+from typing import Dict, Iterable, Optional
+
+import aqt
+
+from .pathlike import FileLike, RootPath
+
+MANIFEST_DIRNAME = "media_import_manifests"
+MANIFEST_VERSION = 1
+
+
+class Manifest:
+    """Versions of the files of a root that are in the collection since its last import.
+    In sync mode, files whose version didn't change are skipped without being analyzed."""
+
+    path: str
+    entries: Dict[str, str]  # {key: version}. See FileLike.sync_version()
+
+    def __init__(self, path: str, entries: Optional[Dict[str, str]] = None) -> None:
+        self.path = path
+        self.entries = entries if entries is not None else {}
+
+    @classmethod
+    def load(cls, root: RootPath) -> Optional["Manifest"]:
+        """Returns an empty manifest if root wasn't imported before.
+        Returns None if no collection is open."""
+        dir = manifest_dir()
+        if dir is None:
+            return None
+        key = f"{type(root).__name__}:{root.raw}"
+        path = os.path.join(dir, md5(key.encode("utf-8")).hexdigest() + ".json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data["version"] == MANIFEST_VERSION:
+                return cls(path, data["entries"])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return cls(path)
+
+    def is_unchanged(self, file: FileLike) -> bool:
+        version = file.sync_version()
+        return version is not None and self.entries.get(version[0]) == version[1]
+
+    def update(self, files: Iterable[FileLike]) -> None:
+        for file in files:
+            version = file.sync_version()
+            if version is not None:
+                self.entries[version[0]] = version[1]
+
+    def save(self) -> None:
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "entries": self.entries}, f)
+        os.replace(temp_path, self.path)
+
+
+def manifest_dir() -> Optional[str]:
+    """Returns the directory for manifests of the current profile, next to its collection.
+    Returns None if no collection is open."""
+    if aqt.mw is None or aqt.mw.col is None:
+        return None
+    dir = os.path.join(os.path.dirname(aqt.mw.col.path), MANIFEST_DIRNAME)
+    os.makedirs(dir, exist_ok=True)
+    return dir
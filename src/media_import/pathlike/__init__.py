@@ -1,2 +1,2 @@
-from .base import FileLike, RootPath
+from .base import FileLike, ListingToken, RootPath
 from .local import LocalFile, LocalRoot
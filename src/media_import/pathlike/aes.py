@@ -0,0 +1,136 @@
+# AES for Mega, using the fastest implementation that can be imported.
+# C-accelerated libraries aren't vendored because they are platform specific,
+# but are used if Anki's Python happens to provide one. pyaes is the fallback.
+# This module doesn't import anything from the add-on, so scripts can load it on its own.
+
+from abc import ABC, abstractmethod
+from typing import Callable, List, Optional, Type
+
+BLOCK_SIZE = 16
+ZERO_IV = b"\0" * BLOCK_SIZE
+
+# Stateful AES-CTR decryption. Consecutive calls continue where the previous one stopped.
+CTRDecrypt = Callable[[bytes], bytes]
+
+
+class CipherBackend(ABC):
+    name: str
+
+    @abstractmethod
+    def ctr(self, key: bytes, initial_counter: int) -> CTRDecrypt:
+        """initial_counter is the 128 bit value of the first counter block."""
+        pass
+
+    @abstractmethod
+    def cbc_decrypt(self, key: bytes, data: bytes) -> bytes:
+        """Decrypts with a zero IV. len(data) must be a multiple of 16."""
+        pass
+
+
+class CryptographyBackend(CipherBackend):
+    name = "cryptography"
+
+    def __init__(self) -> None:
+        from cryptography.hazmat.primitives.ciphers import (  # type: ignore
+            Cipher, algorithms, modes)
+
+        self._Cipher = Cipher
+        self._algorithms = algorithms
+        self._modes = modes
+
+    def ctr(self, key: bytes, initial_counter: int) -> CTRDecrypt:
+        mode = self._modes.CTR(initial_counter.to_bytes(BLOCK_SIZE, "big"))
+        decryptor = self._Cipher(self._algorithms.AES(key), mode).decryptor()
+        return decryptor.update
+
+    def cbc_decrypt(self, key: bytes, data: bytes) -> bytes:
+        mode = self._modes.CBC(ZERO_IV)
+        decryptor = self._Cipher(self._algorithms.AES(key), mode).decryptor()
+        return decryptor.update(data) + decryptor.finalize()
+
+
+class PycryptodomeBackend(CipherBackend):
+    name = "pycryptodome"
+
+    def __init__(self) -> None:
+        try:
+            from Crypto.Cipher import AES  # type: ignore
+        except ImportError:
+            from Cryptodome.Cipher import AES  # type: ignore
+        self._AES = AES
+
+    def ctr(self, key: bytes, initial_counter: int) -> CTRDecrypt:
+        cipher = self._AES.new(
+            key,
+            self._AES.MODE_CTR,
+            nonce=b"",
+            initial_value=initial_counter.to_bytes(BLOCK_SIZE, "big"),
+        )
+        return cipher.decrypt
+
+    def cbc_decrypt(self, key: bytes, data: bytes) -> bytes:
+        return self._AES.new(key, self._AES.MODE_CBC, iv=ZERO_IV).decrypt(data)
+
+
+class PyaesBackend(CipherBackend):
+    name = "pyaes"
+
+    def __init__(self) -> None:
+        import pyaes  # type: ignore
+
+        self._pyaes = pyaes
+
+    def ctr(self, key: bytes, initial_counter: int) -> CTRDecrypt:
+        counter = self._pyaes.Counter(initial_value=initial_counter)
+        cipher = self._pyaes.AESModeOfOperationCTR(key, counter=counter)
+        return cipher.decrypt
+
+    def cbc_decrypt(self, key: bytes, data: bytes) -> bytes:
+        # pyaes only decrypts one block per call.
+        aes = self._pyaes.AESModeOfOperationCBC(key, ZERO_IV)
+        return b"".join(
+            aes.decrypt(data[i : i + BLOCK_SIZE])
+            for i in range(0, len(data), BLOCK_SIZE)
+        )
+
+
+# In order of preference. See scripts/bench_aes.py
+BACKEND_CLASSES: List[Type[CipherBackend]] = [
+    CryptographyBackend,
+    PycryptodomeBackend,
+    PyaesBackend,
+]
+
+
+def available_backends() -> List[CipherBackend]:
+    backends: List[CipherBackend] = []
+    for backend_class in BACKEND_CLASSES:
+        try:
+            backends.append(backend_class())
+        except ImportError:
+            pass
+    return backends
+
+
+_backend: Optional[CipherBackend] = None
+
+
+def get_backend() -> CipherBackend:
+    """Returns the preferred backend that can be imported."""
+    global _backend
+    if _backend is None:
+        _backend = available_backends()[0]
+    return _backend
+
+
+def set_backend(backend: CipherBackend) -> None:
+    global _backend
+    _backend = backend
+
+
+def ctr(key: bytes, initial_counter: int) -> CTRDecrypt:
+    return get_backend().ctr(key, initial_counter)
+
+
+def cbc_decrypt(key: bytes, data: bytes) -> bytes:
+    return get_backend().cbc_decrypt(key, data)
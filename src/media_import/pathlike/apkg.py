@@ -2,10 +2,10 @@ import json
 import zipfile
 from functools import cached_property
 from hashlib import md5
-from pathlib import Path
-from typing import Dict, List, Union
+from pathlib import Path, PurePosixPath
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
-from .base import FileLike, RootPath
+from .base import CHUNK_SIZE, FileLike, ListingToken, RootPath
 from .errors import (IncompatibleApkgFormatError, IsADirectoryError,
                      MalformedURLError, RootNotFoundError)
 
@@ -14,10 +14,14 @@ class ApkgRoot(RootPath):
     raw: str
     name: str
     files: List["FileLike"]
+    max_workers = 4
+    supports_snapshot = True
     path: Path
     zip_file: zipfile.ZipFile
 
-    def __init__(self, path: Union[str, Path]) -> None:
+    def __init__(
+        self, path: Union[str, Path], token: Optional[ListingToken] = None
+    ) -> None:
         self.raw = str(path)
         try:
             if isinstance(path, str):
@@ -34,6 +38,8 @@ class ApkgRoot(RootPath):
         except OSError:
             raise MalformedURLError()
         self.name = self.path.name
+        if token is not None:
+            token.check()
         self.zip_file = zipfile.ZipFile(self.path, "r")
         self.files = self.list_files()
 
@@ -47,6 +53,25 @@ class ApkgRoot(RootPath):
         ]
         return files
 
+    def to_snapshot(self, files: List["FileLike"]) -> Dict[str, Any]:
+        return {
+            "raw": self.raw,
+            "files": [[file.name, file._name_in_zip] for file in files],  # type: ignore
+        }
+
+    @classmethod
+    def from_snapshot(cls, data: Dict[str, Any]) -> "ApkgRoot":
+        root = cls.__new__(cls)
+        root.raw = data["raw"]
+        root.path = Path(root.raw)
+        root.name = root.path.name
+        root.zip_file = zipfile.ZipFile(root.path, "r")
+        root.files = [
+            FileInZip(name, zip_file=root.zip_file, name_in_zip=name_in_zip)
+            for name, name_in_zip in data["files"]
+        ]
+        return root
+
     def _media_dict(self) -> Dict[str, str]:
         try:
             # old media file format (json)
@@ -56,11 +81,63 @@ class ApkgRoot(RootPath):
         return result
 
 
+class ZipRoot(RootPath):
+    """Media files in a zip file, read without extracting the zip.
+    If subdir is given, only files inside it are listed."""
+
+    raw: str
+    name: str
+    files: List["FileLike"]
+    max_workers = 4
+    path: Path
+    zip_file: zipfile.ZipFile
+
+    def __init__(self, path: Union[str, Path], subdir: Optional[str] = None) -> None:
+        self.raw = str(path)
+        self.path = Path(path)
+        if not self.path.is_file():
+            raise RootNotFoundError()
+        try:
+            self.zip_file = zipfile.ZipFile(self.path, "r")
+        except zipfile.BadZipFile:
+            raise MalformedURLError()
+        self.name = subdir if subdir is not None else self.path.name
+        self.files = self.list_files(subdir)
+
+    def list_files(self, subdir: Optional[str]) -> List["FileLike"]:
+        files: List["FileLike"] = []
+        for info in self.zip_file.infolist():
+            if info.is_dir():
+                continue
+            path = PurePosixPath(info.filename)
+            if subdir is not None and path.parts[0] != subdir:
+                continue
+            if len(path.suffix) > 1 and self.has_media_ext(path.suffix[1:]):
+                files.append(
+                    FileInZip(path.name, zip_file=self.zip_file, name_in_zip=info.filename)
+                )
+        return files
+
+    def close(self) -> None:
+        self.zip_file.close()
+
+
+def top_level_dirs(zip_file: zipfile.ZipFile) -> List[str]:
+    """Returns names of the directories at the top of the zip file, in order of appearance."""
+    dirs: Dict[str, None] = {}
+    for name in zip_file.namelist():
+        parts = PurePosixPath(name).parts
+        if len(parts) > 1 or name.endswith("/"):
+            dirs[parts[0]] = None
+    return list(dirs)
+
+
 class FileInZip(FileLike):
     name: str
     extension: str
     _name_in_zip: str
     _zip_file: zipfile.ZipFile
+    _md5: Optional[str]
 
     def __init__(
         self,
@@ -72,20 +149,39 @@ class FileInZip(FileLike):
         self.extension = name.split(".")[-1]
         self._zip_file = zip_file 
         self._name_in_zip = name_in_zip
+        self._md5 = None
 
     @cached_property
     def size(self) -> int:  # type: ignore
         return self._zip_file.getinfo(self._name_in_zip).file_size
 
-    @cached_property
+    @property
+    def known_crc32(self) -> int:  # type: ignore
+        return self._zip_file.getinfo(self._name_in_zip).CRC
+
+    @property
     def md5(self) -> str:
-       return md5(self.read_bytes()).hexdigest()
+        # Not a cached_property, because it locks all instances of the class while computing.
+        if self._md5 is None:
+            self._md5 = self._compute_md5()
+        return self._md5
+
+    def _compute_md5(self) -> str:
+        hash = md5()
+        for chunk in self.iter_chunks():
+            hash.update(chunk)
+        return hash.hexdigest()
+
+    def sync_version(self) -> Optional[Tuple[str, str]]:
+        return (self._name_in_zip, f"{self.size}:{self.known_crc32}")
 
     def read_bytes(self) -> bytes:
         return self._zip_file.read(self._name_in_zip)
 
-    def is_identical(self, file: FileLike) -> bool:
-        try:
-            return file.size == self.size and file.md5 == self.md5 # type: ignore
-        except AttributeError:
-            return file.size == self.size
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        with self._zip_file.open(self._name_in_zip) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
@@ -1,25 +1,97 @@
+import time
 from abc import ABC, abstractmethod
-from typing import Any, List, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 
 import aqt.editor
 
+from .errors import ListingCancelled
+
 
 MEDIA_EXT: Tuple[str, ...] = aqt.editor.pics + aqt.editor.audio
 
+# Default size of the chunks files are read and written in
+CHUNK_SIZE = 1024 * 1024
+
+# Size of the head and tail samples compared before hashing whole files
+SAMPLE_SIZE = 64 * 1024
+
+
+class ListingToken:
+    """Passed to a root while it lists its files. Reports how many files were found so far,
+    and stops the listing when it is cancelled."""
+
+    # Seconds between progress reports
+    interval = 0.2
+
+    def __init__(self, on_progress: Optional[Callable[[int], None]] = None) -> None:
+        self.on_progress = on_progress
+        self.cancelled = False
+        self._reported_at = 0.0
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+    def check(self) -> None:
+        """Raises ListingCancelled if the listing was cancelled."""
+        if self.cancelled:
+            raise ListingCancelled()
+
+    def found(self, count: int) -> None:
+        """Called regularly while listing, with the number of files found so far."""
+        self.check()
+        now = time.monotonic()
+        if self.on_progress is not None and now - self._reported_at >= self.interval:
+            self._reported_at = now
+            self.on_progress(count)
+
 
 class RootPath(ABC):
     raw: str
     name: str
     files: List["FileLike"]
 
+    # How many files of this root may be transferred at the same time.
+    max_workers: int = 1
+    # Whether files are downloaded over the network
+    remote: bool = False
+    # False until all files are listed. Roots created with lazy=True list them in iter_files().
+    listed: bool = True
+    # Seconds it took to list the files, if measured
+    listing_time: Optional[float] = None
+    # Whether to_snapshot() and from_snapshot() can restore the root later, without
+    # listing it again. Temporary roots like downloaded zip files can't be restored.
+    supports_snapshot: bool = False
+    # Files of a restored snapshot that don't exist anymore. They keep their place in files.
+    missing: Sequence["FileLike"] = ()
+
     @abstractmethod
     def __init__(self, *args: Any, **kwargs: Any):
         """Raises an Exception if the path is not valid."""
         pass
 
+    def max_connections(self) -> int:
+        """The most requests to one host that importing from this root makes at once."""
+        return self.max_workers
+
     def has_media_ext(self, extension: str) -> bool:
         return extension.lower() in MEDIA_EXT
 
+    def iter_files(self, token: Optional[ListingToken] = None) -> Iterator["FileLike"]:
+        """Yields the files of the root. If it isn't listed yet, files are yielded as soon as
+        they are found and added to self.files, so they can be processed while listing continues."""
+        yield from self.files
+
+    def to_snapshot(self, files: List["FileLike"]) -> Dict[str, Any]:
+        """Returns JSON serializable data, from which from_snapshot() restores the root
+        with files. Only implemented by roots whose supports_snapshot is True."""
+        raise NotImplementedError
+
+    @classmethod
+    def from_snapshot(cls, data: Dict[str, Any]) -> "RootPath":
+        """Restores the root from the data of to_snapshot(), without listing it again.
+        The data may be outdated, so any exception means it can't be restored anymore."""
+        raise NotImplementedError
+
 
 class FileLike(ABC):
     id: str  # A string that can identify the file
@@ -31,7 +103,83 @@ class FileLike(ABC):
     def read_bytes(self) -> bytes:
         pass
 
-    def is_identical(self, file: "FileLike") -> bool:
-        """Returns True if its contents seems the same. 
-        Does not check if the names are identical."""
+    @abstractmethod
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Yields the contents of the file in pieces of at most chunk_size bytes,
+        so it doesn't have to be held in memory all at once."""
         pass
+
+    # Whether iter_chunks_from() can start in the middle of the file without reading what's before.
+    resumable: bool = False
+
+    def iter_chunks_from(self, start: int, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Like iter_chunks(), but starts at byte offset start.
+        By default the bytes before start are read and discarded."""
+        skipped = 0
+        for chunk in self.iter_chunks(chunk_size):
+            if skipped < start:
+                skipped += len(chunk)
+                if skipped <= start:
+                    continue
+                chunk = chunk[len(chunk) - (skipped - start) :]
+            yield chunk
+
+    # Checksums that are known without reading the file, e.g. from an API or zip metadata.
+    known_md5: Optional[str] = None
+    known_crc32: Optional[int] = None
+
+    @property
+    def md5(self) -> Optional[str]:
+        """md5 of the contents. None if it can't be computed without downloading the file."""
+        return self.known_md5
+
+    def crc32(self) -> Optional[int]:
+        """CRC32 of the contents. None if it can't be computed without downloading the file."""
+        return self.known_crc32
+
+    def sync_version(self) -> Optional[Tuple[str, str]]:
+        """Returns (key, version). key identifies the file within its root,
+        and version changes whenever its contents do.
+        None if changes can't be detected without reading the file."""
+        return None
+
+    def sample_hash(self) -> Optional[str]:
+        """A hash of the first and last SAMPLE_SIZE bytes.
+        None if reading them isn't cheap."""
+        return None
+
+    def is_identical(self, file: "FileLike") -> bool:
+        """Returns True if its contents seems the same.
+        Does not check if the names are identical.
+        Cheap fingerprints are compared first, so files are only read in full when necessary.
+        Files that can't be read cheaply are compared by size only."""
+        if file.size != self.size:
+            return False
+
+        # Checksums from metadata
+        if self.known_crc32 is not None and file.known_crc32 is not None:
+            return self.known_crc32 == file.known_crc32
+        if self.known_md5 is not None or file.known_md5 is not None:
+            if self.known_md5 is not None and file.known_md5 is not None:
+                return self.known_md5 == file.known_md5
+            known, other = (self, file) if self.known_md5 is not None else (file, self)
+            other_md5 = other.md5
+            return other_md5 is None or other_md5 == known.known_md5
+        if self.known_crc32 is not None or file.known_crc32 is not None:
+            known, other = (self, file) if self.known_crc32 is not None else (file, self)
+            other_crc32 = other.crc32()
+            if other_crc32 is not None:
+                return other_crc32 == known.known_crc32
+
+        # Samples of the contents
+        sample, other_sample = self.sample_hash(), file.sample_hash()
+        if sample is None or other_sample is None:
+            return True
+        if sample != other_sample:
+            return False
+        if self.size <= 2 * SAMPLE_SIZE:
+            return True  # The samples covered the whole file
+
+        # Whole contents
+        md5, other_md5 = self.md5, file.md5
+        return md5 is None or other_md5 is None or md5 == other_md5
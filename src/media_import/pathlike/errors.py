@@ -53,4 +53,9 @@ class RequestError(AddonError):
 
 class IncompatibleApkgFormatError(AddonError):
     """The apkg file format is not compatible with the add-on."""
-    pass
\ No newline at end of file
+    pass
+
+
+class ListingCancelled(AddonError):
+    """Listing files was stopped because its result isn't needed anymore."""
+    pass
@@ -1,18 +1,20 @@
-from concurrent.futures import Future
+from concurrent.futures import Future, ThreadPoolExecutor
 import time
-from typing import List, Callable, Any, TYPE_CHECKING, Tuple
+from typing import Dict, Iterator, List, Callable, Any, Optional, Sequence, TYPE_CHECKING, Tuple
 import requests
 import re
 import os
-from zipfile import ZipFile
+from zipfile import BadZipFile, ZipFile
 from tempfile import TemporaryDirectory
 
 from aqt import mw
 from aqt.webview import AnkiWebView, AnkiWebPage
 from aqt.qt import QWebEngineProfile, QWebEnginePage, QUrl
 
-from .base import FileLike, RootPath
-from .local import LocalRoot
+from .apkg import ZipRoot, top_level_dirs
+from .base import CHUNK_SIZE, FileLike, ListingToken, RootPath
+from .listingcache import ListingCache, listing_cache
+from .transport import in_context, transport
 from .errors import *
 
 if TYPE_CHECKING:
@@ -39,6 +41,11 @@ class PrivateWebPage(AnkiWebPage):
 
 importer: Optional["FolderAsZipImporter"]
 
+# Number of folders listed in one request. Each adds about 40 characters to the URL.
+PARENTS_PER_QUERY = 40
+# Number of list requests that run at the same time
+LISTING_WORKERS = 4
+
 
 class GDrive:
     REGEXP = r"drive.google.com/drive/folders/([^?]*)(?:\?|$)"
@@ -50,6 +57,7 @@ class GDrive:
     FIELDS_STR = ",".join(
         ["id", "name", "md5Checksum", "mimeType", "fileExtension", "size"]
     )
+    LIST_FIELDS_STR = FIELDS_STR + ",parents"
 
     def get_metadata(self, id: str) -> dict:
         url = f"{self.BASE_URL}/{id}"
@@ -58,6 +66,20 @@ class GDrive:
         ).json()
 
     def list_paths(self, id: str) -> List[dict]:
+        return self.list_children([id])[id]
+
+    def list_children(self, ids: Sequence[str]) -> Dict[str, List[dict]]:
+        """Lists the contents of several folders in one query. Returns {folder id: paths}"""
+        children: Dict[str, List[dict]] = {id: [] for id in ids}
+        query = " or ".join(f"'{id}' in parents" for id in ids)
+        for path in self._list_query(query):
+            # A file can be in several of the folders.
+            for parent in path.get("parents", []):
+                if parent in children:
+                    children[parent].append(path)
+        return children
+
+    def _list_query(self, query: str) -> List[dict]:
         url = self.BASE_URL
         result = []
         page_token = None
@@ -65,8 +87,8 @@ class GDrive:
             data = self.make_request(
                 url,
                 params={
-                    "q": f"'{id}' in parents",
-                    "fields": "nextPageToken,files({})".format(self.FIELDS_STR),
+                    "q": query,
+                    "fields": "nextPageToken,files({})".format(self.LIST_FIELDS_STR),
                     "key": API_KEY,
                     "pageSize": 1000,
                     "pageToken": page_token,
@@ -85,14 +107,40 @@ class GDrive:
         res = self.make_request(url, params={"alt": "media", "key": API_KEY})
         return res.content
 
+    def iter_download(
+        self, id: str, chunk_size: int = CHUNK_SIZE, start: int = 0
+    ) -> Iterator[bytes]:
+        """Downloads the file from byte offset start."""
+        url = f"{self.BASE_URL}/{id}"
+        headers = {"Range": f"bytes={start}-"} if start else None
+        res = self.make_request(
+            url, params={"alt": "media", "key": API_KEY}, stream=True, headers=headers
+        )
+        with res:
+            # Status 200 means the range was ignored and the whole file is sent.
+            skip = start if start and res.status_code == 200 else 0
+            for chunk in res.iter_content(chunk_size):
+                if skip:
+                    skipped = min(skip, len(chunk))
+                    chunk = chunk[skipped:]
+                    skip -= skipped
+                if chunk:
+                    yield chunk
+
     def download_folder_zip(
         self, id: str, on_done: Callable[[str, bool], None]
     ) -> None:
         global importer
         importer = FolderAsZipImporter(id, on_done)
 
-    def make_request(self, url: str, params: dict) -> requests.Response:
-        res = requests.get(url, params)
+    def make_request(
+        self,
+        url: str,
+        params: dict,
+        stream: bool = False,
+        headers: Optional[dict] = None,
+    ) -> requests.Response:
+        res = transport.get(url, params, stream=stream, headers=headers)
         if res.ok:
             return res
 
@@ -141,8 +189,8 @@ class FolderAsZipImporter:
     id: str
     # on_done: Callable[[str, bool], None]
     web: AnkiWebView
-    zip_dir: str
-    unzip_dir: str
+    zip_dir: TemporaryDirectory
+    root: Optional[ZipRoot] = None
     # qt6: QWebEngineDownloadRequest, qt5: QWebEngineDownloadItem
     request: Any = None
     error_msg: Optional[str] = None
@@ -150,21 +198,20 @@ class FolderAsZipImporter:
     def __init__(self, id: str, on_done: Callable[[str, bool], None]) -> None:
         self.id = id
         self.on_done = on_done  # type: ignore
-        with TemporaryDirectory() as zip_dir, TemporaryDirectory() as unzip_dir:
-            self.zip_dir = zip_dir
-            self.unzip_dir = unzip_dir
-            self.setup_web()
-            mw.taskman.run_in_background(
-                task=lambda: self.poll_download_progress(),
-                on_done=self.on_finish_download_zip,
-            )
+        # Removed in cleanup() once the files are imported
+        self.zip_dir = TemporaryDirectory()
+        self.setup_web()
+        mw.taskman.run_in_background(
+            task=lambda: self.poll_download_progress(),
+            on_done=self.on_finish_download_zip,
+        )
 
     def setup_web(self) -> None:
         web = AnkiWebView(mw)
         self.web = web
         profile = QWebEngineProfile(web)
         profile.setHttpAcceptLanguage("en")
-        profile.setDownloadPath(self.zip_dir)
+        profile.setDownloadPath(self.zip_dir.name)
         profile.downloadRequested.connect(self.on_download)  # type: ignore
         backgroundColor = web.page().backgroundColor()
         page = PrivateWebPage(profile, web._onBridgeCmd)
@@ -264,26 +311,38 @@ class FolderAsZipImporter:
         try:
             (success, msg) = future.result()
             if success:
-                self.unzip_and_install()
+                self.import_from_zip()
             else:
+                self.cleanup()
                 self.on_done(msg, success)
         except Exception as err:
+            self.cleanup()
             self.on_done(str(err), False)
 
-    def unzip_and_install(self) -> None:
+    def import_from_zip(self) -> None:
+        """Imports the files straight from the zip, without extracting it first."""
         from ..importing import import_media
 
-        zip_path = os.path.join(self.zip_dir, self.ZIP_NAME)
-        with ZipFile(zip_path) as zfile:
-            zfile.extractall(self.unzip_dir)
-            inner_dir = [d for d in os.scandir(self.unzip_dir) if d.is_dir()][0]
-            root = LocalRoot(inner_dir.path)
-            import_media(root, self.on_finish)
+        zip_path = os.path.join(self.zip_dir.name, self.ZIP_NAME)
+        try:
+            with ZipFile(zip_path) as zfile:
+                inner_dir = top_level_dirs(zfile)[0]
+        except (BadZipFile, IndexError):
+            raise RequestError(-1, "The downloaded zip file is invalid")
+        self.root = ZipRoot(zip_path, subdir=inner_dir)
+        import_media(self.root, self.on_finish)
 
     # TODO: refactor logs mechanism and progress dialog
     def on_finish(self, result: "ImportResult") -> None:
+        self.cleanup()
         self.on_done("Successfully imported media files", result.success)
 
+    def cleanup(self) -> None:
+        if self.root is not None:
+            self.root.close()
+            self.root = None
+        self.zip_dir.cleanup()
+
 
 gdrive = GDrive()
 
@@ -292,37 +351,180 @@ class GDriveRoot(RootPath):
     raw: str
     name: str
     files: List["FileLike"]
+    max_workers = 8
+    remote = True
+    supports_snapshot = True
 
     id: str
-
-    def __init__(self, url: str) -> None:
+    _cache: Optional[ListingCache] = None
+
+    def __init__(
+        self,
+        url: str,
+        use_cache: bool = True,
+        token: Optional[ListingToken] = None,
+        lazy: bool = False,
+        refresh: bool = False,
+    ) -> None:
+        """If lazy is True, nothing is requested until iter_files() is called,
+        which checks the folder and then yields its files as they are listed.
+        If refresh is True, the folder is listed again even if a cached listing
+        is within its TTL, and the cache is updated with it."""
         if not API_KEY:
             raise Exception("No API Key Found!")
         self.raw = url
         self.id = gdrive.parse_url(url)
+        # Drive has no cheap way to tell if anything in a folder tree changed,
+        # so cached listings are only used within their TTL.
+        self._cache = listing_cache() if use_cache else None
+        snapshot: Optional[Dict[str, Any]] = None
+        if self._cache and not refresh:
+            snapshot = self._cache.get(self.cache_key)
+        if snapshot is not None:
+            self._load_snapshot(snapshot)
+            return
+        if lazy:
+            self.name = self.id  # Until the folder is checked
+            self.files = []
+            self.listed = False
+            return
+        self._check_folder()
+        self.files = self.list_files(recursive=True, token=token)
+        if self._cache:
+            self._cache.put(self.cache_key, self.to_snapshot(self.files))
+
+    @property
+    def cache_key(self) -> str:
+        return f"gdrive:{self.id}"
+
+    def _check_folder(self) -> None:
+        """Sets self.name. Raises IsAFileError if the url isn't of a folder."""
         data = gdrive.get_metadata(self.id)
         self.name = data["name"]
         if not gdrive.is_folder(data):
             raise IsAFileError
-        self.files = self.list_files(recursive=True)
 
-    def list_files(self, recursive: bool) -> List["FileLike"]:
+    def max_connections(self) -> int:
+        # A lazy root is listed while files are downloaded.
+        return self.max_workers + (0 if self.listed else LISTING_WORKERS)
+
+    def iter_files(self, token: Optional[ListingToken] = None) -> Iterator["FileLike"]:
+        if self.listed:
+            yield from self.files
+            return
+        self._check_folder()
+        for result in self.iter_tree(recursive=True, workers=LISTING_WORKERS):
+            for paths in result.values():
+                for path in paths:
+                    file = self.file_from_path(path)
+                    if file is not None:
+                        self.files.append(file)
+                        yield file
+            if token is not None:
+                token.found(len(self.files))
+        self.listed = True
+        if self._cache:
+            self._cache.put(self.cache_key, self.to_snapshot(self.files))
+
+    def to_snapshot(self, files: List["FileLike"]) -> Dict[str, Any]:
+        return {
+            "raw": self.raw,
+            "id": self.id,
+            "name": self.name,
+            "files": [file.to_dict() for file in files],  # type: ignore
+        }
+
+    @classmethod
+    def from_snapshot(cls, data: Dict[str, Any]) -> "GDriveRoot":
+        root = cls.__new__(cls)
+        root.raw = data["raw"]
+        root.id = data["id"]
+        root._load_snapshot(data)
+        return root
+
+    def _load_snapshot(self, data: Dict[str, Any]) -> None:
+        self.name = data["name"]
+        self.files = [GDriveFile(file) for file in data["files"]]
+
+    def list_files(
+        self,
+        recursive: bool,
+        workers: int = LISTING_WORKERS,
+        token: Optional[ListingToken] = None,
+    ) -> List["FileLike"]:
+        children = self.list_tree(recursive, workers, token)
         files: List["FileLike"] = []
-        self.search_files(files, self.id, recursive)
+        self.search_files(files, children, self.id, recursive)
         return files
 
-    def search_files(self, files: List["FileLike"], id: str, recursive: bool) -> None:
-        paths = gdrive.list_paths(id)
-        for path in paths:
+    def list_tree(
+        self, recursive: bool, workers: int, token: Optional[ListingToken] = None
+    ) -> Dict[str, List[dict]]:
+        """Returns {folder id: paths} of the whole tree."""
+        children: Dict[str, List[dict]] = {}
+        for result in self.iter_tree(recursive, workers):
+            children.update(result)
+            if token is not None:
+                token.found(self._count_files(children))
+        return children
+
+    def iter_tree(self, recursive: bool, workers: int) -> Iterator[Dict[str, List[dict]]]:
+        """Lists the folders level by level, and yields {folder id: paths} of each request.
+        Folders of the same level are listed several per request, and requests run concurrently."""
+        children: Dict[str, List[dict]] = {}
+        level = [self.id]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while level:
+                batches = [
+                    level[i : i + PARENTS_PER_QUERY]
+                    for i in range(0, len(level), PARENTS_PER_QUERY)
+                ]
+                for result in executor.map(in_context(gdrive.list_children), batches):
+                    children.update(result)
+                    yield result
+                if not recursive:
+                    break
+                # dict keeps the order while removing duplicates.
+                next_level: Dict[str, None] = {}
+                for id in level:
+                    for path in children[id]:
+                        if gdrive.is_folder(path) and path["id"] not in children:
+                            next_level[path["id"]] = None
+                level = list(next_level)
+
+    def _count_files(self, children: Dict[str, List[dict]]) -> int:
+        return sum(
+            not gdrive.is_folder(path) for paths in children.values() for path in paths
+        )
+
+    def search_files(
+        self,
+        files: List["FileLike"],
+        children: Dict[str, List[dict]],
+        id: str,
+        recursive: bool,
+    ) -> None:
+        """Adds files in the same order as listing each folder depth-first."""
+        # Paths are popped from the end of the stack, so they're pushed in reverse.
+        stack = list(reversed(children[id]))
+        while stack:
+            path = stack.pop()
             if gdrive.is_folder(path):
                 if recursive:
-                    self.search_files(files, path["id"], recursive=True)
-            elif ("fileExtension" in path) and self.has_media_ext(
-                path["fileExtension"]
-            ):
-                # Google docs files don't have file extensions
-                file = GDriveFile(path)
-                files.append(file)
+                    stack.extend(reversed(children[path["id"]]))
+            else:
+                file = self.file_from_path(path)
+                if file is not None:
+                    files.append(file)
+
+    def file_from_path(self, path: dict) -> Optional["GDriveFile"]:
+        """Returns None if the path isn't a media file."""
+        # Google docs files don't have file extensions
+        if gdrive.is_folder(path) or "fileExtension" not in path:
+            return None
+        if not self.has_media_ext(path["fileExtension"]):
+            return None
+        return GDriveFile(path)
 
 
 class GDriveFile(FileLike):
@@ -330,6 +532,7 @@ class GDriveFile(FileLike):
     name: str
     extension: str
     size: int
+    resumable = True
 
     _md5: str
     id: str
@@ -346,15 +549,28 @@ class GDriveFile(FileLike):
         self.id = self.path
         self._md5 = data["md5Checksum"]
 
+    def to_dict(self) -> dict:
+        """Returns the file's metadata in the format of the API."""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "fileExtension": self.extension,
+            "size": str(self.size),
+            "md5Checksum": self._md5,
+        }
+
+    def sync_version(self) -> Optional[Tuple[str, str]]:
+        return (self.id, self._md5)
+
     def read_bytes(self) -> bytes:
         return gdrive.download_file(self.id)
 
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        return gdrive.iter_download(self.id, chunk_size)
+
+    def iter_chunks_from(self, start: int, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        return gdrive.iter_download(self.id, chunk_size, start)
+
     @property
-    def md5(self) -> str:
+    def known_md5(self) -> str:  # type: ignore
         return self._md5
-
-    def is_identical(self, file: "FileLike") -> bool:
-        try:  # Calculating md5 is slow for local file.
-            return file.size == self.size and file.md5 == self.md5  # type: ignore
-        except AttributeError:
-            return file.size == self.size
@@ -0,0 +1,153 @@
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import aqt
+
+CACHE_FILENAME = "media_import_hashes.db"
+SCHEMA_VERSION = 2
+
+
+class HashCache:
+    """Hashes (md5, crc32) of local files, stored on disk so unchanged files are not hashed again.
+    An entry is only used if path, size, mtime_ns and inode all still match."""
+
+    path: str
+    max_entries: int
+
+    def __init__(self, path: str, max_entries: int = 200_000) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._puts = 0
+        try:
+            self._connect()
+        except sqlite3.DatabaseError:
+            # Corrupted file. It's only a cache, so start over.
+            self._remove_files()
+            self._connect()
+
+    def _connect(self) -> None:
+        """Closes the connection again if the database can't be set up,
+        so its files can be removed (which fails on Windows while they're open)."""
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=OFF")
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+            if version != SCHEMA_VERSION:
+                db.execute("DROP TABLE IF EXISTS hashes")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS hashes ("
+                "path TEXT, kind TEXT, size INTEGER, mtime_ns INTEGER, inode INTEGER, "
+                "value TEXT, used REAL, PRIMARY KEY (path, kind))"
+            )
+            db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            self._db = db
+            self._prune()
+        except sqlite3.Error:
+            db.close()
+            raise
+
+    def _remove_files(self) -> None:
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(self.path + suffix)
+            except FileNotFoundError:
+                pass
+
+    def get(self, path: Path, stat: os.stat_result, kind: str = "md5") -> Optional[str]:
+        """Returns None if there's no valid entry, or if the database can't be read right now,
+        e.g. because another process locked it or it is corrupted."""
+        with self._lock:
+            try:
+                row = self._db.execute(
+                    "SELECT size, mtime_ns, inode, value FROM hashes WHERE path = ? AND kind = ?",
+                    (str(path), kind),
+                ).fetchone()
+                if row is None or tuple(row[:3]) != stat_key(stat):
+                    return None
+                self._db.execute(
+                    "UPDATE hashes SET used = ? WHERE path = ? AND kind = ?",
+                    (time.time(), str(path), kind),
+                )
+            except sqlite3.Error as err:
+                print(f"Media Import: Couldn't read hash cache: {err}")
+                return None
+            return row[3]
+
+    def put(
+        self, path: Path, stat: os.stat_result, value: str, kind: str = "md5"
+    ) -> None:
+        """Does nothing if the database can't be written, e.g. because it's read-only."""
+        with self._lock:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (str(path), kind, *stat_key(stat), value, time.time()),
+                )
+                self._puts += 1
+                if self._puts % 1000 == 0:
+                    self._prune()
+            except sqlite3.Error as err:
+                print(f"Media Import: Couldn't write hash cache: {err}")
+
+    def _prune(self) -> None:
+        """Removes the least recently used entries above max_entries."""
+        self._db.execute(
+            "DELETE FROM hashes WHERE rowid IN "
+            "(SELECT rowid FROM hashes ORDER BY used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def clear(self) -> None:
+        """Forgets all entries. Files are hashed again the next time they are compared."""
+        with self._lock:
+            self._db.execute("DELETE FROM hashes")
+            self._db.execute("VACUUM")
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def stat_key(stat: os.stat_result) -> Tuple[int, int, int]:
+    """The parts of a stat result that change when the file's contents may have changed"""
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+_cache: Optional[HashCache] = None
+_cache_lock = threading.Lock()
+
+
+def hash_cache() -> Optional[HashCache]:
+    """Returns the cache of the current profile, stored next to its collection.
+    Returns None if no collection is open."""
+    global _cache
+    if aqt.mw is None or aqt.mw.col is None:
+        return None
+    path = os.path.join(os.path.dirname(aqt.mw.col.path), CACHE_FILENAME)
+    with _cache_lock:
+        if _cache is None or _cache.path != path:
+            if _cache is not None:
+                _cache.close()
+                _cache = None
+            try:
+                _cache = HashCache(path)
+            except (sqlite3.Error, OSError) as err:
+                # Files are hashed without the cache.
+                print(f"Media Import: Couldn't open hash cache: {err}")
+                return None
+        return _cache
+
+
+def close_hash_cache() -> None:
+    """Closes the cache of the profile that is being closed."""
+    global _cache
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+            _cache = None
@@ -0,0 +1,104 @@
+import json
+import os
+import time
+from hashlib import md5
+from typing import Any, Dict, Optional
+
+import aqt
+
+LISTING_DIRNAME = "media_import_listings"
+LISTING_VERSION = 1
+# Listings younger than this are used without asking the server.
+LISTING_TTL = 10 * 60
+# Number of listings that are kept. The least recently used ones are removed.
+MAX_LISTINGS = 20
+
+
+class ListingCache:
+    """Listings of remote folders, stored as snapshots of their roots (see RootPath.to_snapshot).
+    A listing older than the TTL can still be used if its validator matches,
+    which is a digest of whatever the server returns cheaply and changes with the folder."""
+
+    dir: str
+
+    def __init__(self, dir: str) -> None:
+        self.dir = dir
+
+    def get(
+        self, key: str, validator: Optional[str] = None, ttl: float = LISTING_TTL
+    ) -> Optional[Dict[str, Any]]:
+        """Returns the snapshot if it's younger than ttl, or if validator is the one
+        it was stored with. Returns None otherwise."""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            if entry["version"] != LISTING_VERSION or entry["key"] != key:
+                return None
+            fresh = time.time() - entry["fetched"] < ttl
+            if not fresh and (validator is None or validator != entry["validator"]):
+                return None
+            if not fresh:
+                # Validated. Counts as fetched again.
+                entry["fetched"] = time.time()
+                self._write(path, entry)
+            else:
+                os.utime(path)  # Marks it as recently used
+            return entry["snapshot"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def put(
+        self, key: str, snapshot: Optional[Dict[str, Any]], validator: Optional[str] = None
+    ) -> None:
+        if snapshot is None:
+            return
+        entry = {
+            "version": LISTING_VERSION,
+            "key": key,
+            "fetched": time.time(),
+            "validator": validator,
+            "snapshot": snapshot,
+        }
+        try:
+            self._write(self._path(key), entry)
+            self._prune()
+        except OSError as err:
+            print(f"Media Import: Couldn't cache listing: {err}")
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.dir, md5(key.encode("utf-8")).hexdigest() + ".json")
+
+    def _write(self, path: str, entry: Dict[str, Any]) -> None:
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(temp_path, path)
+
+    def _prune(self) -> None:
+        paths = [
+            entry.path for entry in os.scandir(self.dir) if entry.name.endswith(".json")
+        ]
+        if len(paths) <= MAX_LISTINGS:
+            return
+        paths.sort(key=os.path.getmtime)
+        for path in paths[: len(paths) - MAX_LISTINGS]:
+            os.remove(path)
+
+
+def listing_cache() -> Optional[ListingCache]:
+    """Returns the cache of the current profile, stored next to its collection.
+    Returns None if no collection is open."""
+    if aqt.mw is None or aqt.mw.col is None:
+        return None
+    dir = os.path.join(os.path.dirname(aqt.mw.col.path), LISTING_DIRNAME)
+    try:
+        os.makedirs(dir, exist_ok=True)
+    except OSError:
+        return None
+    return ListingCache(dir)
+
+
+def digest(data: Any) -> str:
+    """Returns a validator for JSON serializable data."""
+    return md5(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
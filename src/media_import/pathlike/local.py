@@ -1,21 +1,84 @@
-from functools import cached_property
+import ctypes
+import errno
+import fnmatch
+import mmap
+import os
+import sys
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from hashlib import md5
 from pathlib import Path
-from typing import List, Union
+from typing import (Any, BinaryIO, Callable, Dict, Iterator, List, Optional,
+                    Sequence, Tuple, Union)
 
-from .base import FileLike, RootPath
+from .base import CHUNK_SIZE, SAMPLE_SIZE, FileLike, ListingToken, RootPath
 from .errors import IsAFileError, MalformedURLError, RootNotFoundError
+from .hashcache import hash_cache, stat_key
+
+# Directories that never contain media to import
+IGNORED_DIRS: Tuple[str, ...] = (".git", ".svn", ".hg", "__MACOSX", "@eaDir", ".Trash*")
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore
+
+# ioctl request that makes a copy-on-write clone of a file (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+# Errors that mean a copy strategy isn't supported for the files, rather than that copying failed.
+UNSUPPORTED_ERRNOS = (
+    errno.ENOSYS,
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.EPERM,
+)
+
+_clonefile: Union[Callable[[bytes, bytes, int], int], None] = None
+if sys.platform == "darwin":
+    try:
+        _libc = ctypes.CDLL(None, use_errno=True)
+        _clonefile = _libc.clonefile
+        _clonefile.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_uint32]  # type: ignore
+        _clonefile.restype = ctypes.c_int  # type: ignore
+    except (OSError, AttributeError):
+        _clonefile = None
 
 
 class LocalRoot(RootPath):
     raw: str
     name: str
     files: List["FileLike"]
+    max_workers = 4
+    supports_snapshot = True
+    # Directories scanned at the same time. Helps most on network shares.
+    walk_workers = 8
+    ignore: Sequence[str] = IGNORED_DIRS
+    order_by_inode = False
+    recursive = True
 
     path: Path
 
-    def __init__(self, path: Union[str, Path], recursive: bool = True) -> None:
+    def __init__(
+        self,
+        path: Union[str, Path],
+        recursive: bool = True,
+        token: Optional[ListingToken] = None,
+        ignore: Sequence[str] = IGNORED_DIRS,
+        order_by_inode: bool = False,
+        lazy: bool = False,
+    ) -> None:
+        """Directories whose names match a glob pattern in ignore are skipped.
+        If order_by_inode is True, files are sorted by inode instead of listing order,
+        which lets spinning disks read them sequentially.
+        If lazy is True, files are only listed by iter_files(), in the order they're found."""
         self.raw = str(path)
+        self.ignore = ignore
+        self.order_by_inode = order_by_inode
+        self.recursive = recursive
         try:
             if isinstance(path, str):
                 self.path = Path(path)
@@ -29,20 +92,128 @@ class LocalRoot(RootPath):
         except OSError:
             raise MalformedURLError()
         self.name = self.path.name
-        self.files = self.list_files(recursive=recursive)
+        if lazy:
+            self.files = []
+            self.listed = False
+        else:
+            self.files = self.list_files(recursive=recursive, token=token)
+
+    def iter_files(self, token: Optional[ListingToken] = None) -> Iterator["FileLike"]:
+        if self.listed:
+            yield from self.files
+            return
+        for _, entries in self._walk(self.recursive, {}, token):
+            for entry in entries:
+                if isinstance(entry, LocalFile):
+                    self.files.append(entry)
+                    yield entry
+        self.listed = True
+
+    def list_files(
+        self, recursive: bool, token: Optional[ListingToken] = None
+    ) -> List["FileLike"]:
+        """Scans directories concurrently, then collects the files in the same order
+        as walking the tree depth-first."""
+        scans: Dict[str, List[Union["LocalFile", str]]] = {}
+        inodes: Dict["LocalFile", int] = {}
+        for dir, entries in self._walk(recursive, inodes, token):
+            scans[dir] = entries
 
-    def list_files(self, recursive: bool) -> List["FileLike"]:
         files: List["FileLike"] = []
-        self.search_files(files, self.path, recursive)
+        self.search_files(files, scans, str(self.path), recursive)
+        if self.order_by_inode:
+            files.sort(key=lambda file: inodes.get(file, 0))  # type: ignore
         return files
 
-    def search_files(self, files: List["FileLike"], src: Path, recursive: bool) -> None:
-        for path in src.iterdir():
-            if path.is_file():
-                if len(path.suffix) > 1 and self.has_media_ext(path.suffix[1:]):
-                    files.append(LocalFile(path))
-            elif recursive and path.is_dir():
-                self.search_files(files, path, recursive=True)
+    def _walk(
+        self,
+        recursive: bool,
+        inodes: Dict["LocalFile", int],
+        token: Optional[ListingToken] = None,
+    ) -> Iterator[Tuple[str, List[Union["LocalFile", str]]]]:
+        """Scans directories concurrently, and yields (dir, entries) as each scan completes.
+        Subdirectories are already being scanned while the entries are processed."""
+        found = 0
+        executor = ThreadPoolExecutor(max_workers=self.walk_workers)
+        try:
+            root_dir = str(self.path)
+            pending = {executor.submit(self._scan_dir, root_dir, inodes): root_dir}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dir = pending.pop(future)
+                    entries = future.result()
+                    found += sum(isinstance(entry, LocalFile) for entry in entries)
+                    if token is not None:
+                        token.found(found)
+                    if recursive:
+                        for entry in entries:
+                            if isinstance(entry, str):
+                                pending[executor.submit(self._scan_dir, entry, inodes)] = entry
+                    yield dir, entries
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _scan_dir(
+        self, dir: str, inodes: Dict["LocalFile", int]
+    ) -> List[Union["LocalFile", str]]:
+        """Returns the media files and the paths of the subdirectories in dir, in listed order."""
+        entries: List[Union["LocalFile", str]] = []
+        with os.scandir(dir) as it:
+            for entry in it:
+                # is_file() and is_dir() use the type from the directory listing when available.
+                if entry.is_file():
+                    ext = os.path.splitext(entry.name)[1]
+                    if len(ext) > 1 and self.has_media_ext(ext[1:]):
+                        file = LocalFile(Path(entry.path), entry.stat().st_size)
+                        if self.order_by_inode:
+                            inodes[file] = entry.inode()
+                        entries.append(file)
+                elif entry.is_dir() and not self.is_ignored(entry.name):
+                    entries.append(entry.path)
+        return entries
+
+    def is_ignored(self, dir_name: str) -> bool:
+        return any(fnmatch.fnmatchcase(dir_name, pattern) for pattern in self.ignore)
+
+    def to_snapshot(self, files: List["FileLike"]) -> Dict[str, Any]:
+        return {"raw": self.raw, "files": [file.key for file in files]}  # type: ignore
+
+    @classmethod
+    def from_snapshot(cls, data: Dict[str, Any]) -> "LocalRoot":
+        root = cls.__new__(cls)
+        root.raw = data["raw"]
+        root.path = Path(root.raw)
+        root.name = root.path.name
+        root.files = []
+        root.missing = []
+        for path in data["files"]:
+            try:
+                size: Optional[int] = os.stat(path).st_size
+            except OSError:
+                size = None
+            file = LocalFile(Path(path), size)
+            root.files.append(file)
+            if size is None:
+                root.missing.append(file)
+        return root
+
+    def search_files(
+        self,
+        files: List["FileLike"],
+        scans: Dict[str, List[Union["LocalFile", str]]],
+        dir: str,
+        recursive: bool,
+    ) -> None:
+        stack: List[Iterator[Union["LocalFile", str]]] = [iter(scans[dir])]
+        while stack:
+            entry = next(stack[-1], None)
+            if entry is None:  # Done with this directory
+                stack.pop()
+            elif isinstance(entry, LocalFile):
+                files.append(entry)
+            elif recursive:
+                stack.append(iter(scans[entry]))
 
 
 class LocalFile(FileLike):
@@ -51,26 +222,199 @@ class LocalFile(FileLike):
     extension: str
 
     path: Path
+    _md5: Optional[str]
+    _size: Optional[int]
 
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, size: Optional[int] = None):
+        """size can be passed if it's already known from listing the directory."""
         self.key = str(path)
         self.name = path.name
         self.extension = path.suffix[1:]
         self.path = path
+        self._md5 = None
+        self._size = size
 
-    @cached_property
-    def size(self) -> int: # type: ignore
-        return self.path.stat().st_size
+    @property
+    def size(self) -> int:  # type: ignore
+        # Not a cached_property, because it locks all instances of the class while computing.
+        if self._size is None:
+            self._size = self.path.stat().st_size
+        return self._size
 
-    @cached_property
+    @property
     def md5(self) -> str:
-        return md5(self.read_bytes()).hexdigest()
+        # Not a cached_property, because it locks all instances of the class while computing.
+        if self._md5 is None:
+            self._md5 = self._cached_hash("md5", self._compute_md5)
+        return self._md5
+
+    def crc32(self) -> int:
+        return int(self._cached_hash("crc32", self._compute_crc32), 16)
+
+    def sync_version(self) -> Optional[Tuple[str, str]]:
+        try:
+            stat = self.path.stat()
+        except OSError:
+            return None
+        return (self.key, f"{stat.st_size}:{stat.st_mtime_ns}")
+
+    def sample_hash(self) -> str:
+        hash = md5()
+        with self.path.open("rb") as f:
+            hash.update(f.read(SAMPLE_SIZE))
+            if self.size > SAMPLE_SIZE:
+                f.seek(max(SAMPLE_SIZE, self.size - SAMPLE_SIZE))
+                hash.update(f.read(SAMPLE_SIZE))
+        return hash.hexdigest()
+
+    def _cached_hash(self, kind: str, compute: Callable[[], str]) -> str:
+        """Returns the hash from the hash cache, or computes and caches it."""
+        cache = hash_cache()
+        stat = self.path.stat()
+        if cache is not None:
+            cached_value = cache.get(self.path, stat, kind)
+            if cached_value is not None:
+                return cached_value
+        value = compute()
+        # Don't cache the hash if the file was modified while it was read.
+        if cache is not None and stat_key(self.path.stat()) == stat_key(stat):
+            cache.put(self.path, stat, value, kind)
+        return value
+
+    def _compute_md5(self) -> str:
+        hash = md5()
+        self._feed_contents(hash.update)
+        return hash.hexdigest()
+
+    def _compute_crc32(self) -> str:
+        crc = 0
+
+        def update(data: Any) -> None:
+            nonlocal crc
+            crc = zlib.crc32(data, crc)
+
+        self._feed_contents(update)
+        return f"{crc:08x}"
+
+    def _feed_contents(self, update: Callable[[Any], None]) -> None:
+        """Passes the contents to update, from a memory map if possible
+        so they don't have to be copied into Python objects."""
+        with self.path.open("rb") as f:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):  # Empty file, or not supported by the filesystem
+                mapped = None
+            if mapped is not None:
+                with mapped:
+                    update(mapped)
+                return
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                update(chunk)
 
     def read_bytes(self) -> bytes:
         return self.path.read_bytes()
 
-    def is_identical(self, file: FileLike) -> bool:
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        with self.path.open("rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def link_to(self, dst: str) -> bool:
+        """Creates a hard link at dst if it is on the same filesystem. Returns True on success.
+        The link shares its data with this file, so later edits to either of them affect both."""
+        try:
+            if os.stat(os.path.dirname(dst)).st_dev != self.path.stat().st_dev:
+                return False
+            os.link(self.path, dst)
+        except OSError:
+            return False
+        return True
+
+    def clone_to(self, dst: str) -> bool:
+        """Creates a copy-on-write clone at dst (APFS on macOS). Returns True on success."""
+        if _clonefile is None:
+            return False
+        return _clonefile(os.fsencode(self.path), os.fsencode(dst), 0) == 0
+
+    def copy_into(self, dst: BinaryIO) -> str:
+        """Copies the contents into dst, an empty file opened for writing.
+        The kernel does the copying where possible. Returns the name of the strategy used."""
+        with self.path.open("rb") as src:
+            src_fd = src.fileno()
+            dst_fd = dst.fileno()
+            if _reflink(src_fd, dst_fd):
+                return "reflink"
+            if _copy_file_range(src_fd, dst_fd):
+                return "copy_file_range"
+            # A kernel copy that stopped short may have written part of the file,
+            # so each fallback starts over from an empty dst.
+            _rewind(src, dst)
+            if _sendfile(src_fd, dst_fd):
+                return "sendfile"
+            _rewind(src, dst)
+            while True:
+                chunk = src.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                dst.write(chunk)
+            return "stream"
+
+
+def _rewind(src: BinaryIO, dst: BinaryIO) -> None:
+    src.seek(0)
+    dst.seek(0)
+    dst.truncate()
+
+
+def _reflink(src_fd: int, dst_fd: int) -> bool:
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except OSError as err:
+        if err.errno in UNSUPPORTED_ERRNOS:
+            return False
+        raise
+    return True
+
+
+def _copy_file_range(src_fd: int, dst_fd: int) -> bool:
+    if not hasattr(os, "copy_file_range"):
+        return False
+    return _copy_in_kernel(
+        lambda offset: os.copy_file_range(src_fd, dst_fd, CHUNK_SIZE * 64), src_fd
+    )
+
+
+def _sendfile(src_fd: int, dst_fd: int) -> bool:
+    # Only Linux supports sendfile to regular files.
+    if not hasattr(os, "sendfile") or not sys.platform.startswith("linux"):
+        return False
+    return _copy_in_kernel(
+        lambda offset: os.sendfile(dst_fd, src_fd, offset, CHUNK_SIZE * 64), src_fd
+    )
+
+
+def _copy_in_kernel(copy_chunk: Callable[[int], int], src_fd: int) -> bool:
+    """Calls copy_chunk(offset) until the whole file is copied.
+    Returns False if the first call reports that the copy isn't supported,
+    or if the copy stopped before the end of the file. The caller then copies it in userspace."""
+    size = os.fstat(src_fd).st_size
+    offset = 0
+    while offset < size:
         try:
-            return file.size == self.size and file.md5 == self.md5  # type: ignore
-        except AttributeError:
-            return file.size == self.size
+            copied = copy_chunk(offset)
+        except OSError as err:
+            if offset == 0 and err.errno in UNSUPPORTED_ERRNOS:
+                return False
+            raise
+        if copied == 0:
+            return False
+        offset += copied
+    return True
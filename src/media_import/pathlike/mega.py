@@ -1,10 +1,13 @@
-from typing import Any, Dict, List, Tuple, Union, Optional
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Deque, Dict, Iterator, List, Sequence, Tuple, Union, Optional
 import random
-import requests
+import threading
+import time
 import json
 import re
 
-from pyaes import AESModeOfOperationCTR, Counter  # type: ignore
+from . import aes
 from .megacrypto import (  # type: ignore
     a32_to_str,
     base64_to_a32,
@@ -13,8 +16,23 @@ from .megacrypto import (  # type: ignore
     decrypt_key,
 )
 
-from .base import RootPath, FileLike
+from .base import CHUNK_SIZE, RootPath, FileLike, ListingToken
 from .errors import *
+from .listingcache import digest, listing_cache
+from .transport import in_context, transport
+
+# Files at least this large are downloaded in several byte ranges at the same time.
+RANGE_DOWNLOAD_THRESHOLD = 16 * 1024 * 1024
+# Must be a multiple of the AES block size, so each range starts at a counter boundary.
+RANGE_SIZE = 4 * 1024 * 1024
+RANGE_WORKERS = 4
+
+# Number of download URLs that are requested in one API request
+DOWNLOAD_URL_BATCH_SIZE = 100
+# Download URLs stop working after a while, so they aren't reused after this many seconds.
+DOWNLOAD_URL_TTL = 30 * 60
+# Statuses of downloads from URLs that have expired
+EXPIRED_URL_STATUSES = (403, 404, 410)
 
 
 def error_from_err_code(ecode: int) -> AddonError:
@@ -61,8 +79,37 @@ class Mega:
         for type in self.REGEXP:
             for regexp in self.REGEXP[type]:
                 self.URL_PATTERNS[type].append(re.compile(regexp))
+        # {file id: (download url, size, time it was requested)}
+        self._download_urls: Dict[str, Tuple[str, int, float]] = {}
+        self._download_urls_lock = threading.Lock()
 
     def api_request(self, data: Union[dict, list], root_folder: Optional[str]) -> dict:
+        json_resp = self._post(data, root_folder)
+        try:
+            if isinstance(json_resp, list):
+                int_resp = json_resp[0] if isinstance(json_resp[0], int) else None
+            elif isinstance(json_resp, int):
+                int_resp = json_resp
+        except IndexError:
+            int_resp = None
+        if int_resp is not None:
+            raise error_from_err_code(int_resp)
+        return json_resp[0]
+
+    def api_request_batch(
+        self, commands: List[dict], root_folder: Optional[str]
+    ) -> List[Union[dict, AddonError]]:
+        """Sends several commands in one request.
+        Errors of single commands are returned in place of their results instead of raised."""
+        json_resp = self._post(commands, root_folder)
+        if isinstance(json_resp, int):
+            raise error_from_err_code(json_resp)
+        return [
+            error_from_err_code(result) if isinstance(result, int) else result
+            for result in json_resp
+        ]
+
+    def _post(self, data: Union[dict, list], root_folder: Optional[str]) -> Any:
         params: Dict[str, Any] = {"id": self.sequence_num}
         if root_folder:
             params["n"] = root_folder
@@ -73,49 +120,178 @@ class Mega:
             data = [data]
 
         url = r"https://g.api.mega.co.nz/cs"
-        response = requests.post(url, params=params, data=json.dumps(data))
+        response = transport.post(url, params=params, data=json.dumps(data))
 
         if not response.ok:
             raise RequestError(response.status_code, response.reason)
 
         try:
-            json_resp = json.loads(response.text)
+            return json.loads(response.text)
         except json.JSONDecodeError:
             raise RequestError(response.status_code, response.reason)
 
-        try:
-            if isinstance(json_resp, list):
-                int_resp = json_resp[0] if isinstance(json_resp[0], int) else None
-            elif isinstance(json_resp, int):
-                int_resp = json_resp
-        except IndexError:
-            int_resp = None
-        if int_resp is not None:
-            raise error_from_err_code(int_resp)
-        return json_resp[0]
+    def download_url(
+        self, root_folder: str, file_id: str, prefetch_ids: Sequence[str] = ()
+    ) -> Tuple[str, int]:
+        """Returns (url, size) to download the file from.
+        URLs of prefetch_ids are requested in the same API request and kept for later."""
+        with self._download_urls_lock:
+            if self._has_fresh_download_url(file_id):
+                (url, size, _) = self._download_urls[file_id]
+                return (url, size)
+
+            ids = [file_id]
+            for id in prefetch_ids:
+                if len(ids) >= DOWNLOAD_URL_BATCH_SIZE:
+                    break
+                if id != file_id and not self._has_fresh_download_url(id):
+                    ids.append(id)
+
+        # Don't hold the lock during the request, so other workers can use
+        # URLs that are already known meanwhile.
+        results = self.api_request_batch(
+            [{"a": "g", "g": 1, "n": id} for id in ids], root_folder
+        )
+
+        with self._download_urls_lock:
+            now = time.monotonic()
+            for id, result in zip(ids, results):
+                # Seems to happens sometime... When "g" is missing, files are
+                # inaccessible also in the official also in the official web app.
+                # Strangely, files can come back later.
+                if isinstance(result, dict) and "g" in result:
+                    self._download_urls[id] = (result["g"], result["s"], now)
+            if file_id not in self._download_urls:
+                result = results[0] if results else None
+                if isinstance(result, AddonError):
+                    raise result
+                raise RequestError(-1, "File not accessible anymore")
+            (url, size, _) = self._download_urls[file_id]
+            return (url, size)
+
+    def forget_download_url(self, file_id: str) -> None:
+        with self._download_urls_lock:
+            self._download_urls.pop(file_id, None)
+
+    def _has_fresh_download_url(self, file_id: str) -> bool:
+        if file_id not in self._download_urls:
+            return False
+        return time.monotonic() - self._download_urls[file_id][2] < DOWNLOAD_URL_TTL
 
     def download_file(
         self, root_folder: str, file_id: str, file_key: Tuple[int, ...]
     ) -> bytes:
-        file_data = self.api_request({"a": "g", "g": 1, "n": file_id}, root_folder)
+        return b"".join(self.iter_download(root_folder, file_id, file_key))
 
+    def iter_download(
+        self,
+        root_folder: str,
+        file_id: str,
+        file_key: Tuple[int, ...],
+        chunk_size: int = CHUNK_SIZE,
+        prefetch_ids: Sequence[str] = (),
+        start: int = 0,
+    ) -> Iterator[bytes]:
+        """Downloads the file from byte offset start and decrypts it while it arrives.
+        Download URLs of prefetch_ids are requested together with the file's."""
         k = self.xor_key(file_key)
         iv = file_key[4:6] + (0, 0)
-
-        # Seems to happens sometime... When this occurs, files are
-        # inaccessible also in the official also in the official web app.
-        # Strangely, files can come back later.
-        if "g" not in file_data:
-            raise RequestError(-1, "File not accessible anymore")
-        file_url = file_data["g"]
-        encrypted_file = requests.get(file_url).content
-
         k_str = a32_to_str(k)
-        counter = Counter(initial_value=((iv[0] << 32) + iv[1]) << 64)
-        aes = AESModeOfOperationCTR(k_str, counter=counter)
-        file = aes.decrypt(encrypted_file)
+        initial_counter = ((iv[0] << 32) + iv[1]) << 64
 
-        return file
+        try:
+            (file_url, size) = self.download_url(root_folder, file_id, prefetch_ids)
+            # Resumed downloads always use ranges.
+            if size >= RANGE_DOWNLOAD_THRESHOLD or start:
+                offset = start
+                refreshed = False
+                while True:
+                    try:
+                        ranges = self._iter_ranges(
+                            file_url, size, k_str, initial_counter, offset
+                        )
+                        for data in ranges:
+                            offset += len(data)
+                            for chunk_start in range(0, len(data), chunk_size):
+                                yield data[chunk_start : chunk_start + chunk_size]
+                        return
+                    except RequestError as err:
+                        if refreshed or err.code not in EXPIRED_URL_STATUSES:
+                            raise
+                        # The URL may have expired during the download.
+                        # Continue from offset with a new one, but only once.
+                        refreshed = True
+                        self.forget_download_url(file_id)
+                        (file_url, size) = self.download_url(root_folder, file_id)
+
+            response = transport.get(file_url, stream=True)
+            if response.status_code in EXPIRED_URL_STATUSES:
+                # The URL may have expired earlier than expected. Try again with a new one.
+                response.close()
+                self.forget_download_url(file_id)
+                (file_url, size) = self.download_url(root_folder, file_id)
+                response = transport.get(file_url, stream=True)
+            decrypt = aes.ctr(k_str, initial_counter)
+            with response:
+                if not response.ok:
+                    raise RequestError(response.status_code, response.reason)
+                for encrypted_chunk in response.iter_content(chunk_size):
+                    # CTR mode keeps its position between calls.
+                    yield decrypt(encrypted_chunk)
+        finally:
+            # Either the URL isn't needed anymore, or it may not work when the download is retried.
+            self.forget_download_url(file_id)
+
+    def _iter_ranges(
+        self,
+        file_url: str,
+        size: int,
+        k_str: bytes,
+        initial_counter: int,
+        offset: int = 0,
+    ) -> Iterator[bytes]:
+        """Downloads and decrypts RANGE_WORKERS ranges at a time, and yields them in order.
+        Starts from byte offset."""
+        executor = ThreadPoolExecutor(max_workers=RANGE_WORKERS)
+        pending: Deque[Future] = deque()
+        try:
+            start = offset
+            while start < size:
+                # Ranges end at multiples of RANGE_SIZE, so only the first range
+                # after an offset can start in the middle of an AES block.
+                end = min(start - start % RANGE_SIZE + RANGE_SIZE, size)
+                pending.append(
+                    executor.submit(
+                        in_context(self._download_range),
+                        file_url,
+                        start,
+                        end,
+                        k_str,
+                        initial_counter,
+                    )
+                )
+                start = end
+                if len(pending) >= RANGE_WORKERS:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _download_range(
+        self, file_url: str, start: int, end: int, k_str: bytes, initial_counter: int
+    ) -> bytes:
+        """Downloads bytes [start, end) of the file and decrypts them."""
+        # The counter is incremented once per 16 byte block,
+        # so decryption has to start at the beginning of a block.
+        block_start = start - start % aes.BLOCK_SIZE
+        response = transport.get(f"{file_url}/{block_start}-{end - 1}")
+        if not response.ok:
+            raise RequestError(response.status_code, response.reason)
+        if len(response.content) != end - block_start:
+            raise RequestError(-1, "Received an incomplete range of the file")
+        decrypt = aes.ctr(k_str, initial_counter + block_start // aes.BLOCK_SIZE)
+        return decrypt(response.content)[start - block_start :]
 
     def list_files(self, id: str) -> List[dict]:
         data = [{"a": "f", "c": 1, "ca": 1, "r": 1}]
@@ -173,64 +349,210 @@ class MegaRoot(RootPath):
     raw: str
     name: str
     files: List["FileLike"]
+    max_workers = 4
+    remote = True
+    supports_snapshot = True
 
     public_handle: str
     shared_key: str
     id: Optional[str]
+    _use_cache = True
+
+    def __init__(
+        self,
+        url: str,
+        use_cache: bool = True,
+        token: Optional[ListingToken] = None,
+        lazy: bool = False,
+        refresh: bool = False,
+    ) -> None:
+        """If lazy is True, nothing is requested until iter_files() is called,
+        which yields the files while their nodes are decrypted.
+        If refresh is True, a cached listing is only used if the nodes didn't change,
+        even if it's within its TTL."""
+        self._parse(url)
+        if lazy:
+            self._use_cache = use_cache
+            if refresh or not self._load_cached(use_cache):
+                self.name = self.public_handle  # Until the nodes are listed
+                self.files = []
+                self.listed = False
+        else:
+            self.get_data(use_cache, token, refresh)
 
-    def __init__(self, url: str) -> None:
+    def _parse(self, url: str) -> None:
         self.raw = url
         (public_handle, key, id) = mega.parse_url(url)
         self.public_handle = public_handle
         self.shared_key = base64_to_a32(key)
         self.id = id
-        self.get_data()
+        self._positions: Dict[str, int] = {}  # {file id: index in self.files}
+        self._positions_lock = threading.Lock()
+
+    def max_connections(self) -> int:
+        # Large files are downloaded by several ranges at once.
+        return self.max_workers * RANGE_WORKERS
+
+    def to_snapshot(self, files: List["FileLike"]) -> Dict[str, Any]:
+        return {
+            "raw": self.raw,
+            "name": self.name,
+            "files": [
+                [file.id, list(file.key), file.name, file.extension, file.size, file.ts]  # type: ignore
+                for file in files
+            ],
+        }
 
-    def get_data(self) -> None:
+    @classmethod
+    def from_snapshot(cls, data: Dict[str, Any]) -> "MegaRoot":
+        root = cls.__new__(cls)
+        root._parse(data["raw"])
+        root._load_snapshot(data)
+        return root
+
+    def _load_snapshot(self, data: Dict[str, Any]) -> None:
+        self.name = data["name"]
+        self.files = [
+            MegaFile(self, id=id, key=tuple(key), name=name, ext=ext, size=size, ts=ts)
+            for id, key, name, ext, size, ts in data["files"]
+        ]
+
+    def ids_after(self, file: "MegaFile", count: int) -> List[str]:
+        """Returns ids of up to count files that come after file in self.files.
+        They are likely to be downloaded soon."""
+        with self._positions_lock:
+            idx = self._positions.get(file.id)
+            # The importer removes files from self.files, so the positions may be outdated.
+            if idx is None or idx >= len(self.files) or self.files[idx] is not file:
+                self._positions = {f.id: i for i, f in enumerate(self.files)}
+                idx = self._positions.get(file.id)
+            if idx is None:
+                return []
+            return [f.id for f in self.files[idx + 1 : idx + count]]
+
+    @property
+    def cache_key(self) -> str:
+        return f"mega:{self.public_handle}:{self.id}"
+
+    def get_data(
+        self,
+        use_cache: bool = True,
+        token: Optional[ListingToken] = None,
+        refresh: bool = False,
+    ) -> None:
         """Sets self.name and self.files"""
+        if not refresh and self._load_cached(use_cache):
+            return
+        for _ in self._list_nodes(use_cache, token):
+            pass
+
+    def iter_files(self, token: Optional[ListingToken] = None) -> Iterator["FileLike"]:
+        if self.listed:
+            yield from self.files
+            return
+        yield from self._list_nodes(self._use_cache, token)
+        self.listed = True
+
+    def _load_cached(self, use_cache: bool) -> bool:
+        """Loads the cached listing if it's within its TTL. Returns False if there is none."""
+        cache = listing_cache() if use_cache else None
+        snapshot = cache.get(self.cache_key) if cache else None
+        if snapshot is None:
+            return False
+        self._load_snapshot(snapshot)
+        return True
+
+    def _list_nodes(
+        self, use_cache: bool, token: Optional[ListingToken] = None
+    ) -> Iterator["MegaFile"]:
+        """Lists the nodes, then yields the media files as they're added to self.files."""
+        cache = listing_cache() if use_cache else None
         nodes = mega.list_files(self.public_handle)
+        # Decrypting the nodes is the slow part. It's skipped if none of them changed.
+        validator = digest(nodes)
+        # The nodes are current, so only the validator tells if the listing still is.
+        snapshot = cache.get(self.cache_key, validator, ttl=0) if cache else None
+        if snapshot is not None:
+            self._load_snapshot(snapshot)
+            yield from self.files  # type: ignore
+            return
+        yield from self._read_nodes(nodes, token)
+        if cache:
+            cache.put(self.cache_key, self.to_snapshot(self.files), validator)
+
+    def _read_nodes(
+        self, nodes: List[Dict[str, Any]], token: Optional[ListingToken] = None
+    ) -> Iterator["MegaFile"]:
         if self.id:
             root_id = self.id
         else:
             root_id = nodes[0]["h"]
+
+        # Index the nodes by their parent once, so the tree can be walked in linear time.
+        children: Dict[str, List[Dict[str, Any]]] = {}
+        root_node = None
         for node in nodes:
+            children.setdefault(node["p"], []).append(node)
             if node["h"] == root_id:
-                key = mega.decrypt_node_key(node["k"], self.shared_key)
-                attrs = mega.decrypt_attribute(node["a"], key, is_file=False)
-                self.name = attrs["n"]
-                break
-        if not self.name:  # This shouldn't happen.
+                root_node = node
+        if root_node is None:  # This shouldn't happen.
             raise RequestError(msg="Couldn't find the subfolder.")
+
+        key = mega.decrypt_node_key(root_node["k"], self.shared_key)
+        attrs = mega.decrypt_attribute(root_node["a"], key, is_file=False)
+        self.name = attrs["n"]
         self.files = []
-        self.search_files(nodes, root_id, recursive=True)
+        yield from self.search_files(children, root_id, recursive=True, token=token)
 
     def search_files(
-        self, nodes: List[Dict[str, Any]], id: str, recursive: bool
-    ) -> None:
-        for node in nodes:
-            if node["p"] != id:  # Node is not in this folder 'id'
+        self,
+        children: Dict[str, List[Dict[str, Any]]],
+        id: str,
+        recursive: bool,
+        token: Optional[ListingToken] = None,
+    ) -> Iterator["MegaFile"]:
+        """Walks the tree depth first, in the order the nodes were listed,
+        and yields the files as they're added to self.files. Only file nodes are decrypted."""
+        stack: List[Iterator[Dict[str, Any]]] = [iter(children.get(id, []))]
+        while stack:
+            node = next(stack[-1], None)
+            if node is None:  # Done with this folder
+                stack.pop()
                 continue
             if node["t"] == 1:  # Is folder
-                self.search_files(nodes, node["h"], recursive)
-            if node["t"] != 0:  # Not a file. Special node.
+                if recursive:
+                    stack.append(iter(children.get(node["h"], [])))
                 continue
-            key = mega.decrypt_node_key(node["k"], self.shared_key)
-            attrs = mega.decrypt_attribute(node["a"], key)
-            name = attrs["n"]
-            if not "." in name:
-                continue
-            ext = name.split(".")[-1]
-            if not self.has_media_ext(ext):
+            if node["t"] != 0:  # Not a file. Special node.
                 continue
-            file = MegaFile(
-                root=self,
-                id=node["h"],
-                key=key,
-                name=attrs["n"],
-                ext=ext,
-                size=node["s"],
-            )
-            self.files.append(file)
+            file = self.file_from_node(node)
+            if file is not None:
+                self.files.append(file)
+                if token is not None:
+                    token.found(len(self.files))
+                yield file
+
+    def file_from_node(self, node: Dict[str, Any]) -> Optional["MegaFile"]:
+        """Returns None if the node isn't a media file."""
+        key = mega.decrypt_node_key(node["k"], self.shared_key)
+        attrs = mega.decrypt_attribute(node["a"], key)
+        if not attrs:  # Couldn't be decrypted
+            return None
+        name = attrs["n"]
+        if not "." in name:
+            return None
+        ext = name.split(".")[-1]
+        if not self.has_media_ext(ext):
+            return None
+        return MegaFile(
+            root=self,
+            id=node["h"],
+            key=key,
+            name=name,
+            ext=ext,
+            size=node["s"],
+            ts=node.get("ts", 0),
+        )
 
 
 class MegaFile(FileLike):
@@ -239,8 +561,11 @@ class MegaFile(FileLike):
     extension: str
     size: int
 
+    resumable = True
+
     key: Tuple[int, ...]
     root: MegaRoot
+    ts: int
 
     def __init__(
         self,
@@ -250,6 +575,7 @@ class MegaFile(FileLike):
         name: str,
         ext: str,
         size: int,
+        ts: int = 0,
     ) -> None:
         self.root = root
         self.id = id
@@ -257,9 +583,24 @@ class MegaFile(FileLike):
         self.name = name
         self.extension = ext
         self.size = size
+        self.ts = ts  # Modification time
+
+    def sync_version(self) -> Optional[Tuple[str, str]]:
+        return (self.id, f"{self.size}:{self.ts}")
 
     def read_bytes(self) -> bytes:
         return mega.download_file(self.root.public_handle, self.id, self.key)
 
-    def is_identical(self, file: FileLike) -> bool:
-        return file.size == self.size
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        return mega.iter_download(
+            self.root.public_handle,
+            self.id,
+            self.key,
+            chunk_size,
+            prefetch_ids=self.root.ids_after(self, DOWNLOAD_URL_BATCH_SIZE),
+        )
+
+    def iter_chunks_from(self, start: int, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        return mega.iter_download(
+            self.root.public_handle, self.id, self.key, chunk_size, start=start
+        )
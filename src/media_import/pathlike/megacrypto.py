@@ -1,7 +1,7 @@
 # This code is copied from mega.py library
 # which is licenced under Apache License 2.0
 # https://github.com/odwyersoftware/mega.py
-# Modified to use pyaes instead of pycrypto
+# Modified to use the AES backends of aes.py instead of pycrypto
 
 # type: ignore
 
@@ -10,7 +10,7 @@ import struct
 import codecs
 import json
 
-from pyaes import AESModeOfOperationCBC
+from . import aes
 
 
 def makebyte(x):
@@ -55,11 +55,7 @@ def base64_url_encode(data):
 
 def aes_cbc_decrypt(data, key):
     """data is must be multiple of 16 bytes"""
-    aes = AESModeOfOperationCBC(key, makebyte("\0" * 16))
-    decrypted = b""
-    for i in range(0, len(data), 16):
-        decrypted += aes.decrypt(data[i : i + 16])
-    return decrypted
+    return aes.cbc_decrypt(key, data)
 
 
 def aes_cbc_decrypt_a32(data, key):
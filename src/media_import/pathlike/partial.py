@@ -0,0 +1,140 @@
+import json
+import os
+import shutil
+import time
+from hashlib import md5
+from typing import BinaryIO, Optional, Set
+
+import aqt
+
+from .base import FileLike
+
+PARTIAL_DIRNAME = "media_import_partial"
+# Partial downloads that weren't resumed for this long are removed.
+MAX_AGE = 7 * 24 * 60 * 60
+# How often the journal is updated while downloading, in bytes
+JOURNAL_INTERVAL = 4 * 1024 * 1024
+
+
+class PartialDownload:
+    """A download that is written to a partial file, with a small sidecar journal
+    recording how many bytes of it are complete. An interrupted download can continue
+    from there, even in a later import.
+
+    The journal is only trusted if the file's id, size and checksum are unchanged."""
+
+    data_path: str
+    journal_path: str
+
+    def __init__(self, dir: str, file: FileLike) -> None:
+        self._key = f"{type(file).__name__}:{file.id}"
+        self._size = file.size
+        self._checksum = file.known_md5
+        name = md5(self._key.encode("utf-8")).hexdigest()
+        self.data_path = os.path.join(dir, name + ".part")
+        self.journal_path = os.path.join(dir, name + ".json")
+        self._f: Optional[BinaryIO] = None
+        self._recorded = 0
+        self.completed = self._read_journal()
+
+    def _read_journal(self) -> int:
+        try:
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                journal = json.load(f)
+            if (
+                journal["key"] != self._key
+                or journal["size"] != self._size
+                or journal["checksum"] != self._checksum
+            ):
+                return 0
+            # Bytes that are in the journal but didn't reach the disk are downloaded again.
+            return min(int(journal["completed"]), os.path.getsize(self.data_path))
+        except (OSError, ValueError, KeyError, TypeError):
+            return 0
+
+    def open(self) -> BinaryIO:
+        """Opens the partial file positioned after its completed bytes."""
+        if self.completed:
+            self._f = open(self.data_path, "r+b")
+        else:
+            self._f = open(self.data_path, "wb")
+        self._f.truncate(self.completed)
+        self._f.seek(self.completed)
+        self._recorded = self.completed
+        return self._f
+
+    def write(self, data: bytes) -> None:
+        assert self._f is not None
+        self._f.write(data)
+        self.completed += len(data)
+        if self.completed - self._recorded >= JOURNAL_INTERVAL:
+            self.record()
+
+    def record(self) -> None:
+        """Writes the number of completed bytes to the journal, after they are on disk."""
+        if self._f is not None:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+        journal = {
+            "key": self._key,
+            "size": self._size,
+            "checksum": self._checksum,
+            "completed": self.completed,
+        }
+        temp_path = self.journal_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(journal, f)
+        os.replace(temp_path, self.journal_path)
+        self._recorded = self.completed
+
+    def close(self) -> None:
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def finish(self, dst: str) -> None:
+        """Moves the completed file to dst."""
+        self.close()
+        try:
+            os.replace(self.data_path, dst)
+        except OSError:
+            # On another file system than the media folder
+            shutil.move(self.data_path, dst)
+        self._remove(self.journal_path)
+
+    def discard(self) -> None:
+        self.close()
+        self._remove(self.data_path)
+        self._remove(self.journal_path)
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+_pruned_dirs: Set[str] = set()
+
+
+def partial_dir() -> Optional[str]:
+    """Returns the directory for partial downloads of the current profile, next to its collection.
+    Returns None if no collection is open."""
+    if aqt.mw is None or aqt.mw.col is None:
+        return None
+    dir = os.path.join(os.path.dirname(aqt.mw.col.path), PARTIAL_DIRNAME)
+    os.makedirs(dir, exist_ok=True)
+    if dir not in _pruned_dirs:
+        _pruned_dirs.add(dir)
+        remove_stale(dir)
+    return dir
+
+
+def remove_stale(dir: str, max_age: float = MAX_AGE) -> None:
+    now = time.time()
+    for entry in os.scandir(dir):
+        try:
+            if now - entry.stat().st_mtime > max_age:
+                os.remove(entry.path)
+        except OSError:
+            pass
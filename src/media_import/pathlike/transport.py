@@ -0,0 +1,184 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import (Any, Callable, Dict, Iterator, NamedTuple, Optional, Tuple,
+                    TypeVar)
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Seconds to wait for a connection, and for the next bytes of a response
+CONNECT_TIMEOUT = 10.0
+READ_TIMEOUT = 60.0
+# Connections kept open per host until an import reserves more. See Transport.reserve()
+POOL_SIZE = 10
+# Number of hosts whose connections are kept open
+POOL_HOSTS = 8
+# Idempotent requests are retried on connection errors and these statuses.
+GET_RETRIES = 3
+RETRY_STATUSES = (500, 502, 503, 504)
+
+# Called after each request with (host, seconds, status, retries).
+# status is None if no response was received.
+RequestObserver = Callable[[str, float, Optional[int], int], None]
+
+# Observer of the requests made in the current context. See observing()
+_observer: ContextVar[Optional[RequestObserver]] = ContextVar(
+    "request_observer", default=None
+)
+
+T = TypeVar("T")
+
+
+class HostStats(NamedTuple):
+    requests: int
+    connections: int
+
+    @property
+    def reused(self) -> int:
+        """Number of requests that didn't need a new connection"""
+        return max(self.requests - self.connections, 0)
+
+
+class Transport:
+    """Shared HTTP session, so connections are kept alive between requests."""
+
+    def __init__(
+        self,
+        pool_size: int = POOL_SIZE,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        retries: int = GET_RETRIES,
+    ) -> None:
+        self.timeout: Tuple[float, float] = (connect_timeout, read_timeout)
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=RETRY_STATUSES,
+            # POST requests are only retried if they couldn't connect.
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            raise_on_status=False,
+        )
+        self.pool_size = pool_size
+        self._adapter = HTTPAdapter(
+            pool_connections=POOL_HOSTS, pool_maxsize=pool_size, max_retries=retry
+        )
+        self._pool_lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
+
+    def reserve(self, connections: int) -> None:
+        """Keeps at least so many connections per host open.
+        Called before an import, with the number of requests to one host it makes at once."""
+        with self._pool_lock:
+            if connections <= self.pool_size:
+                return
+            self.pool_size = connections
+            # Connections in use are closed once they are released.
+            self._adapter.poolmanager.clear()
+            self._adapter.init_poolmanager(POOL_HOSTS, connections)
+
+    def get(
+        self,
+        url: str,
+        params: Optional[dict] = None,
+        stream: bool = False,
+        headers: Optional[dict] = None,
+    ) -> requests.Response:
+        return self._request("GET", url, params=params, stream=stream, headers=headers)
+
+    def post(
+        self, url: str, params: Optional[dict] = None, data: Any = None
+    ) -> requests.Response:
+        return self._request("POST", url, params=params, data=data)
+
+    def _request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        """For streamed responses, the time until the headers arrived is observed."""
+        start = time.monotonic()
+        response = None
+        try:
+            response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            return response
+        finally:
+            self._notify(url, time.monotonic() - start, response)
+
+    def _notify(
+        self, url: str, seconds: float, response: Optional[requests.Response]
+    ) -> None:
+        observer = _observer.get()
+        if observer is None:
+            return
+        status = response.status_code if response is not None else None
+        # Retries done by urllib3 are only visible in the history of the response.
+        retry = getattr(getattr(response, "raw", None), "retries", None)
+        retries = len(retry.history) if isinstance(retry, Retry) else 0
+        host = urlsplit(url).hostname or ""
+        observer(host, seconds, status, retries)
+
+    def stats(
+        self, since: Optional[Dict[str, HostStats]] = None
+    ) -> Dict[str, HostStats]:
+        """Returns {host: stats} for the hosts whose connections are currently kept.
+        If since is an earlier result, only what happened after it is counted."""
+        with self._pool_lock:
+            pools = self._adapter.poolmanager.pools
+        result: Dict[str, HostStats] = {}
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            prev = result.get(pool.host, HostStats(0, 0))
+            result[pool.host] = HostStats(
+                prev.requests + pool.num_requests,
+                prev.connections + pool.num_connections,
+            )
+        if since is not None:
+            for host, before in since.items():
+                if host not in result:
+                    continue
+                # Pools that were dropped in between start again from 0.
+                now = result[host]
+                if now.requests >= before.requests:
+                    result[host] = HostStats(
+                        now.requests - before.requests,
+                        max(now.connections - before.connections, 0),
+                    )
+            result = {host: stat for host, stat in result.items() if stat.requests}
+        return result
+
+    def stats_str(self, since: Optional[Dict[str, HostStats]] = None) -> str:
+        return ", ".join(
+            f"{host}: {stat.reused}/{stat.requests} requests reused a connection"
+            for host, stat in self.stats(since).items()
+        )
+
+
+@contextmanager
+def observing(observer: RequestObserver) -> Iterator[None]:
+    """Passes the requests made in the block to observer, including the ones of tasks
+    started in it with in_context(). Requests of other imports aren't passed to it."""
+    token = _observer.set(observer)
+    try:
+        yield
+    finally:
+        _observer.reset(token)
+
+
+def in_context(fn: Callable[..., T]) -> Callable[..., T]:
+    """Wraps fn to run with the observer of the caller, in whichever thread calls it.
+    Threads of an executor don't inherit it by themselves."""
+    context = contextvars.copy_context()
+
+    def run(*args: Any, **kwargs: Any) -> T:
+        # A context can't be entered by several threads at once.
+        return context.copy().run(fn, *args, **kwargs)
+
+    return run
+
+
+transport = Transport()
@@ -0,0 +1,226 @@
+import heapq
+import random
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .pathlike import FileLike
+
+
+class TransferQueue:
+    """Files waiting to be transferred.
+    Failed files are retried after an exponential backoff with jitter."""
+
+    def __init__(
+        self,
+        files: Iterable[FileLike],
+        max_attempts: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ) -> None:
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._ready: Deque[FileLike] = deque(files)
+        # heap of (due time, insertion order, file)
+        self._delayed: List[Tuple[float, int, FileLike]] = []
+        self._attempts: Dict[FileLike, int] = {}
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return len(self._ready) + len(self._delayed)
+
+    def __iter__(self) -> Iterator[FileLike]:
+        yield from self._ready
+        for _, _, file in self._delayed:
+            yield file
+
+    def __contains__(self, file: object) -> bool:
+        return any(f is file for f in self)
+
+    def pop(self) -> Optional[FileLike]:
+        """Returns the next file that can be transferred now, or None."""
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            self._ready.append(heapq.heappop(self._delayed)[2])
+        if self._ready:
+            return self._ready.popleft()
+        return None
+
+    def add(self, file: FileLike) -> None:
+        """Adds a file to the end of the queue, e.g. one that was listed after the transfer started."""
+        self._ready.append(file)
+
+    def put_back(self, file: FileLike) -> None:
+        """Returns a popped file to the front of the queue, without counting an attempt."""
+        self._ready.appendleft(file)
+
+    def retry(self, file: FileLike) -> bool:
+        """Schedules file to be retried later.
+        Returns False if it failed too many times, in which case it is dropped."""
+        attempts = self._attempts.get(file, 0) + 1
+        self._attempts[file] = attempts
+        if attempts >= self.max_attempts:
+            return False
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        delay *= random.uniform(0.5, 1.0)
+        self._seq += 1
+        heapq.heappush(self._delayed, (time.monotonic() + delay, self._seq, file))
+        return True
+
+    def attempts(self, file: FileLike) -> int:
+        return self._attempts.get(file, 0)
+
+    def seconds_until_ready(self) -> Optional[float]:
+        """Returns 0 if a file is ready, None if the queue is empty."""
+        if self._ready:
+            return 0
+        if self._delayed:
+            return max(0.0, self._delayed[0][0] - time.monotonic())
+        return None
+
+
+class CircuitBreaker:
+    """Pauses transfers from a backend after a burst of failures, instead of giving up right away.
+    The pause doubles every time the breaker trips again without a success in between."""
+
+    def __init__(
+        self, threshold: int = 5, cooldown: float = 15.0, max_trips: int = 4
+    ) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_trips = max_trips
+        self.failures = 0  # Failures in succession
+        self.trips = 0  # Times tripped since the last success
+        self._open_until = 0.0
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.trips = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self._open_until = time.monotonic() + self.cooldown * 2**self.trips
+            self.trips += 1
+            self.failures = 0
+
+    @property
+    def is_open(self) -> bool:
+        """True while transfers should be paused."""
+        return time.monotonic() < self._open_until
+
+    @property
+    def seconds_until_closed(self) -> float:
+        return max(0.0, self._open_until - time.monotonic())
+
+    @property
+    def is_broken(self) -> bool:
+        """True if the backend kept failing after all pauses. The import should be aborted."""
+        return self.trips > self.max_trips
+
+
+class Throttle:
+    """Adapts how fast requests are sent to a backend.
+    A token bucket limits the rate of requests, and the number of concurrent transfers
+    follows AIMD: it grows slowly while transfers succeed, and is halved on rate limit errors
+    or when transfers become much slower than usual.
+    The rate is unlimited until the first rate limit error. It is then set a little below
+    the rate at which requests succeeded, and is raised again a little on every success."""
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        min_rate: float = 0.2,
+        decrease: float = 0.5,
+        rate_decrease: float = 0.8,
+        rate_increase: float = 0.05,
+        slow_factor: float = 4.0,
+        window: float = 10.0,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.min_rate = min_rate
+        self.decrease = decrease
+        self.rate_decrease = rate_decrease
+        self.rate_increase = rate_increase
+        self.slow_factor = slow_factor
+        self.window = window
+        self.concurrency = float(max_concurrency)
+        self.rate: Optional[float] = None  # requests per second
+        self._tokens = 0.0
+        self._refilled_at = time.monotonic()
+        self._succeeded: Deque[float] = deque()  # Times requests succeeded within the window
+        self._fastest: Optional[float] = None  # Fastest transfer, in seconds per MiB
+        self._decreased_at = 0.0
+
+    @property
+    def limit(self) -> int:
+        """Number of transfers that may run at the same time"""
+        return max(1, int(self.concurrency))
+
+    def try_acquire(self) -> bool:
+        """Takes a token if one is available. Returns False if the request must wait."""
+        now = time.monotonic()
+        self._refill(now)
+        if self.rate is not None:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+        return True
+
+    def seconds_until_token(self) -> float:
+        if self.rate is None:
+            return 0.0
+        self._refill(time.monotonic())
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+    def record_success(self, seconds: float, size: int) -> None:
+        self._succeeded.append(time.monotonic())
+        # Normalized by size, so large files don't look slow.
+        per_mib = seconds / max(1.0, size / (1024 * 1024))
+        if self._fastest is None or per_mib < self._fastest:
+            self._fastest = per_mib
+        if per_mib > self._fastest * self.slow_factor and seconds > 1.0:
+            self._decrease(rate_limited=False)
+            return
+        # Additive increase: one more transfer after about `limit` successes
+        self.concurrency = min(
+            float(self.max_concurrency), self.concurrency + 1 / self.concurrency
+        )
+        if self.rate is not None:
+            self.rate += self.rate_increase
+
+    def record_rate_limit(self) -> None:
+        self._decrease(rate_limited=True)
+
+    def _decrease(self, rate_limited: bool) -> None:
+        now = time.monotonic()
+        # Transfers that were already running report the same congestion. Only react once.
+        if now - self._decreased_at < 1.0:
+            return
+        self._decreased_at = now
+        self.concurrency = max(1.0, self.concurrency * self.decrease)
+        if rate_limited:
+            # The rate may have grown beyond what actually succeeded.
+            rate = self.success_rate(now)
+            if self.rate is not None:
+                rate = min(rate, self.rate)
+            self.rate = max(self.min_rate, rate * self.rate_decrease)
+            self._tokens = 0.0
+            self._refilled_at = now
+
+    def success_rate(self, now: Optional[float] = None) -> float:
+        """Successful requests per second within the last window"""
+        now = time.monotonic() if now is None else now
+        while self._succeeded and self._succeeded[0] < now - self.window:
+            self._succeeded.popleft()
+        if not self._succeeded:
+            return 0.0
+        return len(self._succeeded) / max(1.0, now - self._succeeded[0])
+
+    def _refill(self, now: float) -> None:
+        if self.rate is not None:
+            # Allows a burst of up to the concurrency limit after being idle.
+            burst = max(1.0, self.concurrency)
+            self._tokens = min(burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
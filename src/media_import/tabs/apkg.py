@@ -9,6 +9,7 @@ except ImportError:
 from aqt.qt import *
 from aqt.utils import tooltip
 
+from ..pathlike import ListingToken
 from ..pathlike.apkg import ApkgRoot
 from .base import ImportTab
 
@@ -30,8 +31,10 @@ class ApkgTab(ImportTab):
         self.root_not_found_msg = "File doesn't exist."
         self.is_a_directory_msg = "Path is a directory."
 
-    def create_root_file(self, url: str) -> ApkgRoot:
-        return ApkgRoot(url)
+    def create_root_file(
+        self, url: str, token: ListingToken, refresh: bool = False
+    ) -> ApkgRoot:
+        return ApkgRoot(url, token=token)
 
     def on_btn(self) -> None:
         path = self.get_apkg_path()
@@ -40,7 +43,7 @@ class ApkgTab(ImportTab):
             self.update_root_file()
 
     def on_input_change(self) -> None:
-        self.update_root_file()
+        self.schedule_update()
 
     # File Browse Dialog
     def file_name_filter(self) -> str:
@@ -2,12 +2,13 @@ from concurrent.futures import Future
 from typing import TYPE_CHECKING, Optional
 from requests.exceptions import ConnectionError, Timeout, RequestException  # type: ignore
 import math
+import time
 
 from aqt import mw
 from aqt.qt import *
 from aqt.utils import tooltip
 
-from ..pathlike import RootPath
+from ..pathlike import ListingToken, RootPath
 from ..pathlike.errors import *
 from ..importing import import_media
 
@@ -34,10 +35,15 @@ def small_qlabel(text: str) -> QLabel:
     return label
 
 
+# Milliseconds to wait after the last keystroke before the input is checked
+DEBOUNCE_MS = 400
+
+
 class ImportTab(QWidget):
     dialog: "ImportDialog"
     valid_path: bool
     rootpath: Optional[RootPath]
+    token: Optional[ListingToken]
 
     # Messages that differ by tab. Define them in subclasses.
     button_text: str
@@ -54,6 +60,10 @@ class ImportTab(QWidget):
         self.dialog = dialog
         self.valid_path = False
         self.rootpath: Optional[RootPath] = None
+        self.token = None  # Of the listing in progress
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.timeout.connect(self.update_root_file)  # type: ignore
         self.setup()
 
     def define_texts(self) -> None:
@@ -89,13 +99,38 @@ class ImportTab(QWidget):
         main_layout.addStretch(1)
 
     def on_import(self) -> None:
+        if not self.valid_path and self.token is not None:
+            # Don't wait for the listing. Files are imported while they're listed instead.
+            self.import_while_listing()
+            return
         if not self.valid_path:
             tooltip(self.import_not_valid_tooltip)
             return
         if self.rootpath.raw != self.path_input.text():
             self.update_root_file()
             return
-        import_media(self.rootpath, self.dialog.finish_import)
+        import_media(
+            self.rootpath,
+            self.dialog.finish_import,
+            allow_hardlink=self.dialog.hardlink_checkbox.isChecked(),
+            sync=self.dialog.sync_checkbox.isChecked(),
+        )
+
+    def import_while_listing(self) -> None:
+        try:
+            root = self.create_lazy_root(self.path_input.text())
+        except AddonError:
+            root = None
+        if root is None:
+            tooltip(self.import_not_valid_tooltip)
+            return
+        self.cancel_listing()
+        import_media(
+            root,
+            self.dialog.finish_import,
+            allow_hardlink=self.dialog.hardlink_checkbox.isChecked(),
+            sync=self.dialog.sync_checkbox.isChecked(),
+        )
 
     def on_input_change(self) -> None:
         return
@@ -103,16 +138,39 @@ class ImportTab(QWidget):
     def on_btn(self) -> None:
         return
 
+    def schedule_update(self) -> None:
+        """Calls update_root_file once the input stops changing."""
+        self.valid_path = False
+        self.debounce_timer.start(DEBOUNCE_MS)
+
+    def cancel_listing(self) -> None:
+        self.debounce_timer.stop()
+        if self.token is not None:
+            self.token.cancel()
+            self.token = None
+
     def clear_path(self) -> None:
+        self.cancel_listing()
         self.path_input.setText("")
         self.sub_text.setText(self.empty_input_msg)
         self.rootpath = None
         self.valid_path = False
 
-    def create_root_file(self, url: str) -> RootPath:
+    def create_root_file(
+        self, url: str, token: ListingToken, refresh: bool = False
+    ) -> RootPath:
+        """Lists the root in the background. If refresh is True, the user asked to check
+        the input again, so remote roots don't use cached listings that are still fresh."""
         pass
 
-    def update_root_file(self) -> None:
+    def create_lazy_root(self, url: str) -> Optional[RootPath]:
+        """Returns a root that isn't listed yet, or None if the tab can't import while listing.
+        Called on the main thread, so it shouldn't make requests."""
+        return None
+
+    def update_root_file(self, refresh: bool = False) -> None:
+        # A listing of the previous input isn't needed anymore.
+        self.cancel_listing()
         self.valid_path = False
         url = self.path_input.text()
         if url == "":
@@ -121,10 +179,23 @@ class ImportTab(QWidget):
 
         self.sub_text.setText(self.while_create_rootpath_msg)
 
+        def on_progress(count: int) -> None:
+            def update() -> None:
+                if self.token is token:
+                    self.sub_text.setText(
+                        f"{self.while_create_rootpath_msg} ({count} files found so far)"
+                    )
+
+            mw.taskman.run_on_main(update)
+
+        token = ListingToken(on_progress)
+        self.token = token
+
         def on_done(fut: Future) -> None:
             curr_url = self.path_input.text()
-            if not url == curr_url:
+            if token.cancelled or not url == curr_url:
                 return
+            self.token = None
             self.rootpath = None
             try:
                 self.rootpath = fut.result()
@@ -171,5 +242,10 @@ class ImportTab(QWidget):
                     "There is still an option to export apkg files in the old format on the export dialog."
                     )
 
-        mw.taskman.run_in_background(
-            self.create_root_file, on_done, {"url": url})
+        def create() -> RootPath:
+            start = time.monotonic()
+            root = self.create_root_file(url, token, refresh)
+            root.listing_time = time.monotonic() - start
+            return root
+
+        mw.taskman.run_in_background(create, on_done)
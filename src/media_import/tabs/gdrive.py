@@ -1,5 +1,6 @@
 from typing import TYPE_CHECKING
 
+from ..pathlike import ListingToken
 from ..pathlike.gdrive import GDriveRoot
 from .base import ImportTab
 if TYPE_CHECKING:
@@ -22,7 +23,12 @@ class GDriveTab(ImportTab):
         self.is_a_file_msg = "This URL leads to a file. Please write a URL to a folder"
 
     def on_btn(self) -> None:
-        self.update_root_file()
+        self.update_root_file(refresh=True)
 
-    def create_root_file(self, url: str) -> GDriveRoot:
-        return GDriveRoot(url)
+    def create_root_file(
+        self, url: str, token: ListingToken, refresh: bool = False
+    ) -> GDriveRoot:
+        return GDriveRoot(url, token=token, refresh=refresh)
+
+    def create_lazy_root(self, url: str) -> GDriveRoot:
+        return GDriveRoot(url, lazy=True)
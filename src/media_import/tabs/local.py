@@ -10,6 +10,7 @@ from aqt.qt import *
 from aqt.utils import tooltip
 import aqt.editor
 
+from ..pathlike import ListingToken
 from ..pathlike.local import LocalRoot
 from .base import ImportTab
 
@@ -33,8 +34,13 @@ class LocalTab(ImportTab):
             "This path leads to a file. Please write a path to a folder."
         )
 
-    def create_root_file(self, url: str) -> LocalRoot:
-        return LocalRoot(url)
+    def create_root_file(
+        self, url: str, token: ListingToken, refresh: bool = False
+    ) -> LocalRoot:
+        return LocalRoot(url, token=token)
+
+    def create_lazy_root(self, url: str) -> LocalRoot:
+        return LocalRoot(url, lazy=True)
 
     def on_btn(self) -> None:
         path = self.get_directory()
@@ -43,7 +49,7 @@ class LocalTab(ImportTab):
             self.update_root_file()
 
     def on_input_change(self) -> None:
-        self.update_root_file()
+        self.schedule_update()
 
     # File Browse Dialog
     def file_name_filter(self) -> str:
@@ -1,5 +1,6 @@
 from typing import TYPE_CHECKING
 
+from ..pathlike import ListingToken
 from .base import ImportTab
 if TYPE_CHECKING:
     from .base import ImportDialog
@@ -22,8 +23,14 @@ class MegaTab(ImportTab):
         self.is_a_file_msg = "This URL leads to a file. Please write a URL to a folder"
 
     def on_btn(self) -> None:
-        self.update_root_file()
+        self.update_root_file(refresh=True)
 
-    def create_root_file(self, url: str) -> "MegaRoot":
+    def create_root_file(
+        self, url: str, token: ListingToken, refresh: bool = False
+    ) -> "MegaRoot":
         from ..pathlike.mega import MegaRoot
-        return MegaRoot(url)
+        return MegaRoot(url, token=token, refresh=refresh)
+
+    def create_lazy_root(self, url: str) -> "MegaRoot":
+        from ..pathlike.mega import MegaRoot
+        return MegaRoot(url, lazy=True)
@@ -0,0 +1,153 @@
+import os
+import zipfile
+import zlib
+from hashlib import md5
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Callable, Dict, List, Optional
+
+import pytest
+
+from src.media_import import importing
+from src.media_import.importing import ImportResult
+from src.media_import.pathlike import local
+from src.media_import.pathlike.apkg import FileInZip, ZipRoot, top_level_dirs
+from src.media_import.pathlike.errors import (MalformedURLError, RequestError,
+                                              RootNotFoundError)
+from src.media_import.pathlike.gdrive import FolderAsZipImporter
+from src.media_import.pathlike.local import LocalFile
+
+# Like the zips Google Drive makes of a folder, which has everything in a top-level folder
+MEMBERS: Dict[str, bytes] = {
+    "Folder/": b"",
+    "Folder/a.png": os.urandom(3000),
+    "Folder/notes.txt": b"not media",
+    "Folder/noext": b"no extension",
+    "Folder/sub/": b"",
+    "Folder/sub/b.JPG": os.urandom(100),
+    "Folder/sub/deeper/c.mp3": b"sound",
+    "top.png": b"not in a folder",
+    "Second/d.png": b"other folder",
+}
+
+
+def make_zip(path: Path, members: Dict[str, bytes] = MEMBERS) -> Path:
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zfile:
+        for name, contents in members.items():
+            zfile.writestr(name, contents)
+    return path
+
+
+@pytest.fixture
+def zip_path(tmp_path: Path) -> Path:
+    return make_zip(tmp_path / "media.zip")
+
+
+def test_top_level_dirs(zip_path: Path) -> None:
+    with zipfile.ZipFile(zip_path) as zfile:
+        assert top_level_dirs(zfile) == ["Folder", "Second"]
+
+
+def test_top_level_dirs_without_dir_entries(tmp_path: Path) -> None:
+    path = make_zip(tmp_path / "files.zip", {"a.png": b"a", "Folder/b.png": b"b"})
+    with zipfile.ZipFile(path) as zfile:
+        assert top_level_dirs(zfile) == ["Folder"]
+
+
+def test_zip_root_lists_media_of_subdir(zip_path: Path) -> None:
+    root = ZipRoot(zip_path, subdir="Folder")
+    assert root.name == "Folder"
+    assert [file.name for file in root.files] == ["a.png", "b.JPG", "c.mp3"]
+    for file in root.files:
+        assert file.read_bytes() == MEMBERS[file._name_in_zip]  # type: ignore
+    root.close()
+
+
+def test_zip_root_without_subdir_lists_all_media(zip_path: Path) -> None:
+    root = ZipRoot(zip_path)
+    assert root.name == "media.zip"
+    assert [file.name for file in root.files] == [
+        "a.png",
+        "b.JPG",
+        "c.mp3",
+        "top.png",
+        "d.png",
+    ]
+    root.close()
+
+
+def test_zip_root_errors(tmp_path: Path) -> None:
+    with pytest.raises(RootNotFoundError):
+        ZipRoot(tmp_path / "missing.zip")
+    not_zip = tmp_path / "not.zip"
+    not_zip.write_bytes(b"not a zip file")
+    with pytest.raises(MalformedURLError):
+        ZipRoot(not_zip)
+
+
+def test_file_in_zip_checksums(
+    zip_path: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(local, "hash_cache", lambda: None)
+    contents = MEMBERS["Folder/a.png"]
+    copy = tmp_path / "a.png"
+    copy.write_bytes(contents)
+    root = ZipRoot(zip_path, subdir="Folder")
+    file = root.files[0]
+    assert isinstance(file, FileInZip)
+
+    assert file.size == len(contents)
+    assert file.known_crc32 == zlib.crc32(copy.read_bytes())
+    assert file.md5 == md5(contents).hexdigest()
+    assert b"".join(file.iter_chunks(100)) == contents
+    assert file.is_identical(LocalFile(copy))
+    assert not file.is_identical(root.files[1])
+    root.close()
+
+
+@pytest.fixture
+def importer() -> FolderAsZipImporter:
+    """An importer whose zip was downloaded, without the web view that downloads it."""
+    importer = FolderAsZipImporter.__new__(FolderAsZipImporter)
+    importer.zip_dir = TemporaryDirectory()
+    return importer
+
+
+def test_import_from_zip(
+    importer: FolderAsZipImporter, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    make_zip(Path(importer.zip_dir.name) / FolderAsZipImporter.ZIP_NAME)
+    imported: List[List[bytes]] = []
+    results: List[bool] = []
+
+    def import_media(src: ZipRoot, on_done: Callable[[ImportResult], None]) -> None:
+        imported.append([file.read_bytes() for file in src.files])
+        assert src.name == "Folder"
+        on_done(ImportResult([], True))
+
+    monkeypatch.setattr(importing, "import_media", import_media)
+    importer.on_done = lambda msg, success: results.append(success)  # type: ignore
+    importer.import_from_zip()
+
+    names = ["Folder/a.png", "Folder/sub/b.JPG", "Folder/sub/deeper/c.mp3"]
+    assert imported == [[MEMBERS[name] for name in names]]
+    assert results == [True]
+    # The zip is removed once the files are imported.
+    assert importer.root is None
+    assert not os.path.exists(importer.zip_dir.name)
+
+
+@pytest.mark.parametrize(
+    "contents", [b"not a zip file", None], ids=["invalid", "no folder"]
+)
+def test_import_from_invalid_zip(
+    importer: FolderAsZipImporter, contents: Optional[bytes]
+) -> None:
+    path = Path(importer.zip_dir.name) / FolderAsZipImporter.ZIP_NAME
+    if contents is None:
+        make_zip(path, {"a.png": b"a"})
+    else:
+        path.write_bytes(contents)
+    with pytest.raises(RequestError):
+        importer.import_from_zip()
+    importer.cleanup()
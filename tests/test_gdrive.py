@@ -0,0 +1,222 @@
+import re
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import aqt
+import pytest
+from pytest_anki import AnkiSession
+from pytestqt.qtbot import QtBot  # type: ignore
+
+from src.media_import.pathlike import gdrive as gdrive_module
+from src.media_import.pathlike.gdrive import PARENTS_PER_QUERY, GDriveRoot, gdrive
+from src.media_import.pathlike.listingcache import ListingCache
+
+ROOT_ID = "root"
+FOLDER_MIME = "application/vnd.google-apps.folder"
+PAGE_SIZE = 7
+
+
+class FakeResponse:
+    status_code = 200
+    ok = True
+
+    def __init__(self, data: dict, content: bytes = b"") -> None:
+        self.data = data
+        self.content = content
+
+    def json(self) -> dict:
+        return self.data
+
+    def iter_content(self, chunk_size: int) -> Iterator[bytes]:
+        yield self.content
+
+    def __enter__(self) -> "FakeResponse":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+
+class FakeDrive:
+    """Answers files.list and files.get requests from an in-memory tree.
+    Like Drive, list results aren't grouped by parent and come in pages."""
+
+    def __init__(self) -> None:
+        self.paths: List[dict] = []
+        self.queries: List[List[str]] = []
+
+    def add_folder(self, id: str, parent: str) -> None:
+        self.paths.append(
+            {"id": id, "name": id, "mimeType": FOLDER_MIME, "parents": [parent]}
+        )
+
+    def add_file(self, name: str, *parents: str) -> None:
+        path: Dict[str, Any] = {
+            "id": f"id-{name}",
+            "name": name,
+            "mimeType": "image/png",
+            "size": "1",
+            "md5Checksum": "0" * 32,
+        }
+        if "." in name:
+            path["fileExtension"] = name.rsplit(".", 1)[1]
+        path["parents"] = list(parents)
+        self.paths.append(path)
+
+    def children(self, id: str) -> List[dict]:
+        return [path for path in self.paths if id in path["parents"]]
+
+    def make_request(
+        self, url: str, params: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> FakeResponse:
+        assert params is not None
+        if params.get("alt") == "media":
+            id = url.rsplit("/", 1)[1]
+            return FakeResponse({}, id.encode())
+        if url != gdrive.BASE_URL:
+            return FakeResponse({"id": ROOT_ID, "name": "Root", "mimeType": FOLDER_MIME})
+        ids = re.findall(r"'([^']+)' in parents", params["q"])
+        assert len(ids) <= PARENTS_PER_QUERY
+        if params["pageToken"] is None:
+            self.queries.append(ids)
+        matched = [
+            path for path in self.paths if any(id in path["parents"] for id in ids)
+        ]
+        start = int(params["pageToken"] or 0)
+        data: Dict[str, Any] = {"files": matched[start : start + PAGE_SIZE]}
+        if start + PAGE_SIZE < len(matched):
+            data["nextPageToken"] = str(start + PAGE_SIZE)
+        return FakeResponse(data)
+
+
+@pytest.fixture
+def drive(monkeypatch: pytest.MonkeyPatch) -> FakeDrive:
+    drive = FakeDrive()
+    # More folders on one level than fit in a query.
+    for i in range(PARENTS_PER_QUERY + 5):
+        folder = f"folder{i}"
+        drive.add_folder(folder, ROOT_ID)
+        drive.add_file(f"{folder}-a.png", folder)
+        drive.add_file(f"{folder}-notes.txt", folder)
+        drive.add_file(f"{folder}-doc", folder)
+        if i % 10 == 0:
+            drive.add_folder(f"{folder}-sub", folder)
+            drive.add_file(f"{folder}-sub-b.jpg", f"{folder}-sub")
+    drive.add_file("top.mp3", ROOT_ID)
+    drive.add_file("shared.png", "folder1", "folder2")
+    monkeypatch.setattr(gdrive_module, "API_KEY", "key")
+    monkeypatch.setattr(gdrive, "make_request", drive.make_request)
+    return drive
+
+
+def old_listing(drive: FakeDrive, root: GDriveRoot, id: str) -> List[str]:
+    """Names in the order the listing had when each folder was requested recursively."""
+    names = []
+    for path in drive.children(id):
+        if path["mimeType"] == FOLDER_MIME:
+            names += old_listing(drive, root, path["id"])
+        elif "fileExtension" in path and root.has_media_ext(path["fileExtension"]):
+            names.append(path["name"])
+    return names
+
+
+def url() -> str:
+    return f"https://drive.google.com/drive/folders/{ROOT_ID}"
+
+
+def test_list_children_follows_pages(drive: FakeDrive) -> None:
+    ids = ["folder1", "folder2", "folder3"]
+    children = gdrive.list_children(ids)
+    for id in ids:
+        assert [path["id"] for path in children[id]] == [
+            path["id"] for path in drive.children(id)
+        ]
+    assert drive.queries == [ids]
+
+
+def test_listing_matches_recursive_listing(drive: FakeDrive) -> None:
+    root = GDriveRoot(url(), use_cache=False)
+
+    expected = old_listing(drive, root, ROOT_ID)
+    assert [file.name for file in root.files] == expected
+    assert "shared.png" in expected
+    # The top level, then two queries for the folders, then their subfolders.
+    assert [len(ids) for ids in drive.queries] == [
+        1,
+        PARENTS_PER_QUERY,
+        5,
+        len([i for i in range(PARENTS_PER_QUERY + 5) if i % 10 == 0]),
+    ]
+
+
+def test_lazy_listing_yields_same_files(drive: FakeDrive) -> None:
+    root = GDriveRoot(url(), use_cache=False, lazy=True)
+
+    names = [file.name for file in root.iter_files()]
+    assert sorted(names) == sorted(old_listing(drive, root, ROOT_ID))
+    assert len(names) == len(set(names)) + 1  # shared.png is in two folders
+
+
+def test_refresh_skips_fresh_cached_listing(
+    drive: FakeDrive, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    cache = ListingCache(str(tmp_path))
+    monkeypatch.setattr(gdrive_module, "listing_cache", lambda: cache)
+    names = [file.name for file in GDriveRoot(url()).files]
+    queries = len(drive.queries)
+
+    drive.add_file("added.png", ROOT_ID)
+    # Within the TTL, the cached listing is used.
+    assert [file.name for file in GDriveRoot(url()).files] == names
+    assert len(drive.queries) == queries
+
+    refreshed = [file.name for file in GDriveRoot(url(), refresh=True).files]
+    assert "added.png" in refreshed
+    assert len(drive.queries) == 2 * queries
+    # The refreshed listing replaces the cached one.
+    assert [file.name for file in GDriveRoot(url()).files] == refreshed
+
+
+def test_sync_downloads_changed_files_only(
+    anki_session: AnkiSession, qtbot: QtBot, monkeypatch: pytest.MonkeyPatch
+) -> None:
+
+    with anki_session.profile_loaded():
+        from src.media_import.importing import ImportResult, import_media
+
+        drive = FakeDrive()
+        for i in range(8):
+            drive.add_file(f"sync{i}.png", ROOT_ID)
+        monkeypatch.setattr(gdrive_module, "API_KEY", "key")
+        monkeypatch.setattr(gdrive, "make_request", drive.make_request)
+        media_dir = Path(aqt.mw.col.media.dir())
+        zip_downloads = []
+
+        def download_folder_zip(id: str, on_done: Callable[[str, bool], None]) -> None:
+            zip_downloads.append(id)
+            for path in drive.paths:
+                (media_dir / path["name"]).write_bytes(path["id"].encode())
+            on_done("Successfully imported media files", True)
+
+        monkeypatch.setattr(gdrive, "download_folder_zip", download_folder_zip)
+
+        def sync() -> ImportResult:
+            results: List[ImportResult] = []
+            root = GDriveRoot(url(), use_cache=False)
+            import_media(root, on_done=results.append, sync=True)
+            qtbot.wait_until(lambda: len(results) == 1, timeout=8000)
+            return results[0]
+
+        # Nothing is skipped, so the folder is downloaded as a zip.
+        assert sync().success
+        assert zip_downloads == [ROOT_ID]
+
+        for i in range(8, 14):
+            drive.add_file(f"sync{i}.png", ROOT_ID)
+        result = sync()
+        assert result.success
+        assert "8 files were skipped because they didn't change" in "\n".join(result.logs)
+        # Only the new files are downloaded, one by one.
+        assert zip_downloads == [ROOT_ID]
+        for i in range(8, 14):
+            assert (media_dir / f"sync{i}.png").read_bytes() == f"id-sync{i}.png".encode()
@@ -0,0 +1,128 @@
+import os
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from src.media_import.pathlike import hashcache, local
+from src.media_import.pathlike.hashcache import HashCache
+from src.media_import.pathlike.local import LocalFile
+
+
+@pytest.fixture
+def cache(tmp_path: Path) -> HashCache:
+    return HashCache(str(tmp_path / "hashes.db"))
+
+
+@pytest.fixture
+def media_file(tmp_path: Path) -> Path:
+    path = tmp_path / "image.png"
+    path.write_bytes(b"contents")
+    return path
+
+
+def test_hit(cache: HashCache, media_file: Path) -> None:
+    stat = media_file.stat()
+    assert cache.get(media_file, stat) is None
+    cache.put(media_file, stat, "abc")
+    assert cache.get(media_file, stat) == "abc"
+    # Each kind of hash has its own entry.
+    assert cache.get(media_file, stat, "crc32") is None
+
+
+def test_invalidated_when_mtime_changes(cache: HashCache, media_file: Path) -> None:
+    cache.put(media_file, media_file.stat(), "abc")
+    stat = media_file.stat()
+    os.utime(media_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert cache.get(media_file, media_file.stat()) is None
+
+
+def test_invalidated_when_size_changes(cache: HashCache, media_file: Path) -> None:
+    stat = media_file.stat()
+    cache.put(media_file, stat, "abc")
+    media_file.write_bytes(b"longer contents")
+    # Keep the mtime, so only the size differs.
+    os.utime(media_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert cache.get(media_file, media_file.stat()) is None
+
+
+def test_persists_between_instances(tmp_path: Path, media_file: Path) -> None:
+    path = str(tmp_path / "hashes.db")
+    cache = HashCache(path)
+    cache.put(media_file, media_file.stat(), "abc")
+    cache.close()
+    assert HashCache(path).get(media_file, media_file.stat()) == "abc"
+
+
+def test_recovers_from_corrupt_db(tmp_path: Path, media_file: Path) -> None:
+    path = tmp_path / "hashes.db"
+    path.write_bytes(b"this is not a database" * 100)
+    cache = HashCache(str(path))
+    assert cache.get(media_file, media_file.stat()) is None
+    cache.put(media_file, media_file.stat(), "abc")
+    assert cache.get(media_file, media_file.stat()) == "abc"
+
+
+def test_clear(cache: HashCache, media_file: Path) -> None:
+    cache.put(media_file, media_file.stat(), "abc")
+    cache.clear()
+    assert cache.get(media_file, media_file.stat()) is None
+
+
+class FailingDatabase:
+    def __init__(self, error: sqlite3.Error) -> None:
+        self.error = error
+
+    def execute(self, *args: object) -> None:
+        raise self.error
+
+    def close(self) -> None:
+        pass
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        sqlite3.OperationalError("database is locked"),
+        sqlite3.DatabaseError("database disk image is malformed"),
+        sqlite3.IntegrityError("constraint failed"),
+    ],
+)
+def test_db_errors_fall_back_to_hashing(
+    cache: HashCache,
+    media_file: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    error: sqlite3.Error,
+) -> None:
+    cache._db = FailingDatabase(error)  # type: ignore
+    cache.put(media_file, media_file.stat(), "abc")
+    assert cache.get(media_file, media_file.stat()) is None
+
+    monkeypatch.setattr(local, "hash_cache", lambda: cache)
+    assert LocalFile(media_file).md5 == "98bf7d8c15784f0a3d63204441e1e2aa"
+
+
+def test_local_file_uses_cache(
+    cache: HashCache, media_file: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(local, "hash_cache", lambda: cache)
+    md5 = LocalFile(media_file).md5
+    assert cache.get(media_file, media_file.stat()) == md5
+
+    # A cached value is returned without reading the file.
+    cache.put(media_file, media_file.stat(), "cached")
+    assert LocalFile(media_file).md5 == "cached"
+
+
+def test_close_hash_cache(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    col = type("Col", (), {"path": str(tmp_path / "collection.anki2")})
+    monkeypatch.setattr(hashcache.aqt, "mw", type("MW", (), {"col": col}))
+    cache = hashcache.hash_cache()
+    assert cache is not None
+    assert hashcache.hash_cache() is cache
+
+    hashcache.close_hash_cache()
+    with pytest.raises(sqlite3.ProgrammingError):
+        cache._db.execute("SELECT 1")
+    assert hashcache.hash_cache() is not cache
+    hashcache.close_hash_cache()
@@ -1,5 +1,7 @@
+import json
+import time
 from pathlib import Path
-from typing import Protocol
+from typing import Iterator, Optional, Protocol
 
 import aqt
 import pytest
@@ -98,6 +100,265 @@ def test_mega_import(anki_session: AnkiSession, test_import: ImportTester) -> No
         test_import(root)
 
 
+def test_failing_file_is_reported(
+    anki_session: AnkiSession, qtbot: QtBot, tmp_path: Path
+) -> None:
+
+    with anki_session.profile_loaded():
+        from src.media_import.importing import ImportResult, import_media
+        from src.media_import.pathlike.local import LocalRoot
+
+        for name in ["ok1.png", "ok2.png", "deleted.png"]:
+            (tmp_path / name).write_bytes(name.encode())
+        root = LocalRoot(tmp_path)
+        # Deleted after listing, so the transfer fails.
+        (tmp_path / "deleted.png").unlink()
+
+        results: list[ImportResult] = []
+        import_media(root, on_done=results.append)
+        qtbot.wait_until(lambda: len(results) == 1, timeout=8000)
+
+        result = results[0]
+        assert not result.success
+        assert "deleted.png" in "\n".join(result.logs)
+        assert result.report is not None
+        assert result.report["backends"]["LocalFile"]["failures"] == 1
+        # Not retried, since the file is gone for good.
+        assert result.report["backends"]["LocalFile"]["retries"] == 0
+        media_dir = Path(aqt.mw.col.media.dir())
+        assert {"ok1.png", "ok2.png"} <= set(get_filenames_in_collection(media_dir))
+
+
+def test_pipelined_import_reports_skipped_files(
+    anki_session: AnkiSession, qtbot: QtBot, tmp_path: Path
+) -> None:
+
+    with anki_session.profile_loaded():
+        from src.media_import.importing import ImportResult, import_media
+        from src.media_import.pathlike.local import LocalRoot
+
+        media_dir = Path(aqt.mw.col.media.dir())
+        (media_dir / "pipe_existing.png").write_bytes(b"existing")
+        (media_dir / "pipe_other.png").write_bytes(b"in collection")
+        files = {
+            "pipe_new.png": b"new",
+            "pipe_dup.png": b"dup",
+            "sub/pipe_dup.png": b"dup",
+            "pipe_clash.png": b"clash 1",
+            "sub2/pipe_clash.png": b"clash 2",
+            "pipe_existing.png": b"existing",
+            "pipe_other.png": b"other",
+            "pipe_cafe\u0301.png": b"unnormalized",
+        }
+        for name, contents in files.items():
+            (tmp_path / name).parent.mkdir(exist_ok=True)
+            (tmp_path / name).write_bytes(contents)
+        root = LocalRoot(tmp_path, lazy=True)
+
+        results: list[ImportResult] = []
+        import_media(root, on_done=results.append)
+        qtbot.wait_until(lambda: len(results) == 1, timeout=8000)
+
+        result = results[0]
+        assert not result.success
+        logs = result.logs
+        assert "8 media files found." in logs
+        assert "1 files were skipped because they are identical." in logs
+        assert "1 files were skipped because they already exist in collection." in logs
+        assert any("1 files have invalid file names" in log for log in logs)
+        idx = logs.index("1 files have the same name as other files being imported:")
+        assert logs[idx + 1].startswith("pipe_clash.png\n")
+        idx = logs.index("1 files have the same name as existing media files:")
+        assert logs[idx + 1].startswith("pipe_other.png\n")
+        assert (media_dir / "pipe_new.png").read_bytes() == b"new"
+        assert (media_dir / "pipe_dup.png").read_bytes() == b"dup"
+        assert (media_dir / "pipe_clash.png").read_bytes() in (b"clash 1", b"clash 2")
+        assert (media_dir / "pipe_other.png").read_bytes() == b"in collection"
+        # The user isn't asked about the conflicts, so the result says what happened.
+        assert "2 files were skipped because of name conflicts." in logs[-1]
+        assert "1 files with invalid names were skipped." in logs[-1]
+
+
+def test_listing_stops_if_transfer_fails(
+    anki_session: AnkiSession,
+    qtbot: QtBot,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+
+    with anki_session.profile_loaded():
+        from src.media_import.importing import (ImportResult, MediaImporter,
+                                                import_media)
+        from src.media_import.pathlike import FileLike, ListingToken
+        from src.media_import.pathlike.local import LocalRoot
+
+        root = LocalRoot(tmp_path, lazy=True)
+        listing: list[str] = []
+
+        def iter_files(token: Optional[ListingToken] = None) -> Iterator[FileLike]:
+            assert token is not None
+            deadline = time.monotonic() + 10
+            while not token.cancelled and time.monotonic() < deadline:
+                time.sleep(0.01)
+            listing.append("cancelled" if token.cancelled else "timed out")
+            yield from ()
+
+        def take_incoming(self: MediaImporter, timeout: Optional[float] = None) -> None:
+            raise RuntimeError("Transfer failed")
+
+        monkeypatch.setattr(root, "iter_files", iter_files)
+        monkeypatch.setattr(MediaImporter, "_take_incoming", take_incoming)
+        results: list[ImportResult] = []
+        import_media(root, on_done=results.append)
+        qtbot.wait_until(lambda: len(results) == 1, timeout=8000)
+
+        assert not results[0].success
+        assert "Transfer failed" in results[0].logs[-1]
+        assert listing == ["cancelled"]
+
+
+def test_interrupted_import_is_resumed(
+    anki_session: AnkiSession,
+    qtbot: QtBot,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+
+    with anki_session.profile_loaded():
+        from src.media_import.importing import ImportResult, resume_import
+        from src.media_import.journal import ImportJournal, latest_journal
+        from src.media_import.pathlike.local import LocalRoot
+
+        for name in ["resume1.png", "resume2.png", "resume3.png", "resume4.png"]:
+            (tmp_path / name).write_bytes(name.encode())
+        root = LocalRoot(tmp_path)
+        journal = ImportJournal.create(root, root.files)
+        assert journal is not None
+        done, remaining, deleted = root.files[0], root.files[1:3], root.files[3]
+        # The import was interrupted after transferring the first file.
+        media_dir = Path(aqt.mw.col.media.dir())
+        (media_dir / done.name).write_bytes(b"already imported")
+        journal.record_done(done)
+        journal.close()
+        (tmp_path / deleted.name).unlink()
+
+        def restore(data: dict) -> LocalRoot:
+            raise AssertionError("The root shouldn't be restored yet")
+
+        # Only the header is read, without checking which files still exist.
+        monkeypatch.setattr(LocalRoot, "from_snapshot", restore)
+        loaded = latest_journal()
+        monkeypatch.undo()
+        assert loaded is not None
+        assert loaded.path == journal.path
+        assert (loaded.name, loaded.remaining, loaded.total) == (tmp_path.name, 3, 4)
+
+        results: list[ImportResult] = []
+        resume_import(loaded, on_done=results.append)
+        qtbot.wait_until(lambda: len(results) == 1, timeout=8000)
+
+        result = results[0]
+        assert result.success
+        logs = "\n".join(result.logs)
+        assert "1 / 4 media files were already imported" in logs
+        assert f"'{deleted.name}' doesn't exist anymore" in logs
+        assert (media_dir / done.name).read_bytes() == b"already imported"
+        for file in remaining:
+            assert (media_dir / file.name).read_bytes() == file.name.encode()
+        assert not (media_dir / deleted.name).exists()
+        assert not Path(journal.path).exists()
+
+
+def test_corrupt_journal_is_ignored(anki_session: AnkiSession, qtbot: QtBot) -> None:
+
+    with anki_session.profile_loaded():
+        from src.media_import.dialog import ImportDialog
+        from src.media_import.journal import journal_dir
+
+        dir = journal_dir()
+        assert dir is not None
+        header = {
+            "version": 2,
+            "type": "LocalRoot",
+            "allow_hardlink": False,
+            "name": "nonexistent",
+            "total": 0,
+            "created": 0,
+            "root": {"raw": "/nonexistent", "files": []},
+        }
+
+        def without(key: str) -> str:
+            return json.dumps({k: v for k, v in header.items() if k != key}) + "\n"
+
+        corrupt = {
+            "empty.jsonl": "",
+            "garbage.jsonl": "not json\n",
+            "list.jsonl": "[1, 2]\n",
+            "unknown_type.jsonl": json.dumps({**header, "type": "FtpRoot"}) + "\n",
+            "no_root.jsonl": without("root"),
+            "no_hardlink.jsonl": without("allow_hardlink"),
+            "no_total.jsonl": without("total"),
+            "old_version.jsonl": json.dumps({**header, "version": 1}) + "\n",
+            "bad_entries.jsonl": json.dumps(header) + "\n5\n[0]\n",
+        }
+        for name, contents in corrupt.items():
+            (Path(dir) / name).write_text(contents, encoding="utf-8")
+
+        dialog = ImportDialog()
+        qtbot.addWidget(dialog)
+
+        for name in corrupt:
+            assert not (Path(dir) / name).exists()
+
+
+@pytest.mark.parametrize(
+    "type, snapshot",
+    [
+        ("ApkgRoot", {"raw": "not_a_zip.apkg", "files": [["a.png", "0"]]}),
+        # Files of an older layout
+        ("LocalRoot", {"raw": "/nonexistent", "files": [{"path": "/nonexistent/a.png"}]}),
+        ("MegaRoot", {"raw": "https://mega.nz/folder/abc#def", "name": "Mega"}),
+    ],
+)
+def test_stale_journal_is_removed_on_resume(
+    anki_session: AnkiSession,
+    qtbot: QtBot,
+    tmp_path: Path,
+    type: str,
+    snapshot: dict,
+) -> None:
+
+    with anki_session.profile_loaded():
+        from src.media_import.importing import ImportResult, resume_import
+        from src.media_import.journal import journal_dir, latest_journal
+
+        dir = journal_dir()
+        assert dir is not None
+        if type == "ApkgRoot":
+            (tmp_path / "not_a_zip.apkg").write_bytes(b"not a zip file")
+            snapshot = {**snapshot, "raw": str(tmp_path / "not_a_zip.apkg")}
+        header = {
+            "version": 2,
+            "type": type,
+            "allow_hardlink": False,
+            "name": "stale",
+            "total": 1,
+            "created": 0,
+            "root": snapshot,
+        }
+        path = Path(dir) / "stale.jsonl"
+        path.write_text(json.dumps(header) + "\n", encoding="utf-8")
+
+        journal = latest_journal()
+        assert journal is not None and journal.path == str(path)
+        results: list[ImportResult] = []
+        resume_import(journal, on_done=results.append)
+        qtbot.wait_until(lambda: len(results) == 1, timeout=8000)
+
+        assert not results[0].success
+        assert "The import from 'stale' can't be resumed anymore." in results[0].logs
+        assert not path.exists()
+
 
 def get_filenames_in_collection(media_dir: Path) -> list[str]:
     return [x.name for x in media_dir.glob("*")]
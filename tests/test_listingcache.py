@@ -0,0 +1,67 @@
+import os
+from pathlib import Path
+from typing import Dict, List
+
+import pytest
+
+from src.media_import.pathlike import listingcache
+from src.media_import.pathlike.listingcache import (LISTING_TTL, MAX_LISTINGS,
+                                                    ListingCache)
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(listingcache.time, "time", clock.time)
+    return clock
+
+
+def snapshot(name: str) -> Dict[str, List[str]]:
+    return {"files": [name]}
+
+
+def test_listing_expires_after_ttl(tmp_path: Path, clock: Clock) -> None:
+    cache = ListingCache(str(tmp_path))
+    cache.put("key", snapshot("a"))
+
+    clock.now += LISTING_TTL - 1
+    assert cache.get("key") == snapshot("a")
+    clock.now += 2
+    assert cache.get("key") is None
+    assert cache.get("key", ttl=LISTING_TTL * 2) == snapshot("a")
+
+
+def test_expired_listing_is_validated(tmp_path: Path, clock: Clock) -> None:
+    cache = ListingCache(str(tmp_path))
+    cache.put("key", snapshot("a"), validator="v1")
+
+    clock.now += LISTING_TTL + 1
+    assert cache.get("key", validator="v2") is None
+    assert cache.get("key", validator="v1") == snapshot("a")
+    # A validated listing counts as fetched again.
+    assert cache.get("key") == snapshot("a")
+    # With ttl=0, only the validator counts.
+    assert cache.get("key", validator="v2", ttl=0) is None
+
+
+def test_least_recently_used_listings_are_removed(tmp_path: Path) -> None:
+    cache = ListingCache(str(tmp_path))
+    for i in range(MAX_LISTINGS):
+        cache.put(f"key{i}", snapshot(str(i)))
+        # Apart, so they are ordered even if the file system's mtime is coarse.
+        os.utime(cache._path(f"key{i}"), (i, i))
+    assert cache.get("key0") == snapshot("0")  # Marks it as recently used
+
+    cache.put("new", snapshot("new"))
+    assert len(os.listdir(tmp_path)) == MAX_LISTINGS
+    assert cache.get("key1") is None
+    for key in ["key0", "key2", f"key{MAX_LISTINGS - 1}", "new"]:
+        assert cache.get(key) is not None
@@ -0,0 +1,234 @@
+import os
+import zipfile
+from hashlib import md5
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Optional
+
+import pytest
+
+from src.media_import.pathlike import FileLike, local
+from src.media_import.pathlike.apkg import FileInZip
+from src.media_import.pathlike.base import SAMPLE_SIZE
+from src.media_import.pathlike.local import IGNORED_DIRS, LocalFile, LocalRoot
+
+MIB = 1024 * 1024
+
+TREE = [
+    "a.png",
+    "notes.txt",
+    ".hidden.png",
+    ".png",
+    "sub/b.jpg",
+    "sub/deeper/c.mp3",
+    "sub/deeper/d.gif",
+    "sub/readme.md",
+    ".hidden_dir/e.png",
+    ".git/objects/f.png",
+    "__MACOSX/g.png",
+    ".Trash-1000/h.png",
+    "other/i.png",
+    "other/.git/j.png",
+    "empty/",
+]
+
+
+@pytest.fixture
+def tree(tmp_path: Path) -> Path:
+    for name in TREE:
+        path = tmp_path / name
+        if name.endswith("/"):
+            path.mkdir(parents=True)
+            continue
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(name.encode())
+    return tmp_path
+
+
+def walk_listing(root: LocalRoot, path: Path, recursive: bool = True) -> List[str]:
+    """Files in the order of the listing before directories were scanned concurrently,
+    without the ignored directories."""
+    files = []
+    for child in path.iterdir():
+        if child.is_file():
+            if len(child.suffix) > 1 and root.has_media_ext(child.suffix[1:]):
+                files.append(str(child))
+        elif recursive and child.is_dir() and not root.is_ignored(child.name):
+            files += walk_listing(root, child)
+    return files
+
+
+def paths(root: LocalRoot) -> List[str]:
+    return [file.key for file in root.files]  # type: ignore
+
+
+@pytest.mark.parametrize("recursive", [True, False])
+def test_listing_matches_walk(tree: Path, recursive: bool) -> None:
+    root = LocalRoot(tree, recursive=recursive)
+    assert paths(root) == walk_listing(root, tree, recursive)
+
+
+def test_ignore_rules(tree: Path) -> None:
+    names = {file.name for file in LocalRoot(tree).files}
+    assert names == {"a.png", ".hidden.png", "b.jpg", "c.mp3", "d.gif", "e.png", "i.png"}
+
+    names = {file.name for file in LocalRoot(tree, ignore=()).files}
+    assert {"f.png", "g.png", "h.png", "j.png"} <= names
+    assert ".Trash*" in IGNORED_DIRS
+
+
+def test_lazy_listing_yields_same_files(tree: Path) -> None:
+    root = LocalRoot(tree, lazy=True)
+    assert not root.listed
+    yielded = [file.key for file in root.iter_files()]  # type: ignore
+    assert root.listed
+    assert sorted(yielded) == sorted(walk_listing(root, tree))
+    assert paths(root) == yielded
+
+
+def test_order_by_inode(tree: Path) -> None:
+    root = LocalRoot(tree, order_by_inode=True)
+    inodes = [os.stat(path).st_ino for path in paths(root)]
+    assert inodes == sorted(inodes)
+    assert sorted(paths(root)) == sorted(walk_listing(root, tree))
+
+
+@pytest.fixture
+def big_file(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    path = tmp_path / "big.png"
+    path.write_bytes(os.urandom(3 * MIB + 123))
+    # So the kernel copies are used even on file systems that support reflinks.
+    monkeypatch.setattr(local, "_reflink", lambda src_fd, dst_fd: False)
+    return path
+
+
+def stop_after(limit: int, copy: Callable[..., int]) -> Callable[..., int]:
+    """Wraps a kernel copy function so it copies at most limit bytes, then returns 0."""
+    copied = 0
+
+    def short_copy(*args: Any) -> int:
+        nonlocal copied
+        if copied >= limit:
+            return 0
+        args = (*args[:-1], min(args[-1], limit - copied))
+        count = copy(*args)
+        copied += count
+        return count
+
+    return short_copy
+
+
+def copy(path: Path, tmp_path: Path) -> str:
+    dst = tmp_path / "copy.png"
+    with dst.open("wb") as f:
+        strategy = LocalFile(path).copy_into(f)
+    assert dst.read_bytes() == path.read_bytes()
+    return strategy
+
+
+@pytest.mark.skipif(not hasattr(os, "copy_file_range"), reason="No copy_file_range")
+def test_short_copy_file_range_falls_back(
+    big_file: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(os, "copy_file_range", stop_after(MIB, os.copy_file_range))
+    assert copy(big_file, tmp_path) in ("sendfile", "stream")
+
+
+@pytest.mark.skipif(not hasattr(os, "copy_file_range"), reason="No copy_file_range")
+def test_short_kernel_copies_fall_back_to_stream(
+    big_file: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(os, "copy_file_range", stop_after(MIB, os.copy_file_range))
+    if hasattr(os, "sendfile"):
+        monkeypatch.setattr(os, "sendfile", stop_after(2 * MIB, os.sendfile))
+    assert copy(big_file, tmp_path) == "stream"
+
+
+class RemoteFile(FileLike):
+    """A file whose md5 is known from an API, and that can't be read cheaply."""
+
+    def __init__(self, contents: bytes, md5: Optional[str]) -> None:
+        self.id = self.name = "remote.png"
+        self.extension = "png"
+        self.size = len(contents)
+        self.known_md5 = md5
+        self.contents = contents
+
+    def read_bytes(self) -> bytes:
+        return self.contents
+
+    def iter_chunks(self, chunk_size: int = MIB) -> Iterator[bytes]:
+        yield self.contents
+
+
+@pytest.fixture
+def make_file(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> Callable[[str, bytes], LocalFile]:
+    monkeypatch.setattr(local, "hash_cache", lambda: None)
+
+    def make_file(name: str, contents: bytes) -> LocalFile:
+        path = tmp_path / name
+        path.write_bytes(contents)
+        return LocalFile(path)
+
+    return make_file
+
+
+def flip_middle_byte(contents: bytes) -> bytes:
+    middle = len(contents) // 2
+    return contents[:middle] + bytes([contents[middle] ^ 1]) + contents[middle + 1 :]
+
+
+LARGE = os.urandom(2 * SAMPLE_SIZE + 1000)
+
+
+def test_identical_local_files(make_file: Callable[[str, bytes], LocalFile]) -> None:
+    assert make_file("a.png", LARGE).is_identical(make_file("b.png", LARGE))
+
+
+def test_different_size(make_file: Callable[[str, bytes], LocalFile]) -> None:
+    assert not make_file("a.png", LARGE).is_identical(make_file("b.png", LARGE + b"x"))
+
+
+def test_middle_byte_difference(make_file: Callable[[str, bytes], LocalFile]) -> None:
+    a, b = make_file("a.png", LARGE), make_file("b.png", flip_middle_byte(LARGE))
+    # Only the full md5 can tell them apart.
+    assert a.sample_hash() == b.sample_hash()
+    assert not a.is_identical(b)
+    assert not b.is_identical(a)
+
+
+@pytest.mark.parametrize("size", [1, SAMPLE_SIZE, 2 * SAMPLE_SIZE])
+def test_small_files_are_compared_by_samples(
+    make_file: Callable[[str, bytes], LocalFile], size: int
+) -> None:
+    contents = os.urandom(size)
+    a = make_file("a.png", contents)
+    assert a.is_identical(make_file("b.png", contents))
+    assert not a.is_identical(make_file("c.png", flip_middle_byte(contents)))
+
+
+def test_local_file_against_zip_member(
+    make_file: Callable[[str, bytes], LocalFile], tmp_path: Path
+) -> None:
+    zip_path = tmp_path / "media.zip"
+    with zipfile.ZipFile(zip_path, "w") as zfile:
+        zfile.writestr("same.png", LARGE)
+        zfile.writestr("changed.png", flip_middle_byte(LARGE))
+    with zipfile.ZipFile(zip_path) as zfile:
+        same = FileInZip("same.png", zip_file=zfile, name_in_zip="same.png")
+        changed = FileInZip("changed.png", zip_file=zfile, name_in_zip="changed.png")
+        local_file = make_file("a.png", LARGE)
+        assert local_file.is_identical(same)
+        assert same.is_identical(local_file)
+        assert not local_file.is_identical(changed)
+        assert not changed.is_identical(local_file)
+
+
+def test_known_md5_on_one_side(make_file: Callable[[str, bytes], LocalFile]) -> None:
+    local_file = make_file("a.png", LARGE)
+    assert local_file.is_identical(RemoteFile(LARGE, md5(LARGE).hexdigest()))
+    changed = flip_middle_byte(LARGE)
+    assert not RemoteFile(changed, md5(changed).hexdigest()).is_identical(local_file)
+    # Without a checksum, files that can't be read cheaply are compared by size only.
+    assert local_file.is_identical(RemoteFile(changed, None))
@@ -0,0 +1,200 @@
+import os
+import re
+import time
+from typing import Any, Dict, Iterator, List, Sequence, Set, Tuple, Union
+
+import pytest
+
+from src.media_import.pathlike import aes
+from src.media_import.pathlike import mega as mega_module
+from src.media_import.pathlike.errors import RequestError, RootNotFoundError
+from src.media_import.pathlike.mega import Mega
+from src.media_import.pathlike.megacrypto import a32_to_str  # type: ignore
+
+FILE_KEY = (
+    0x01234567, 0x89ABCDEF, 0x0F1E2D3C, 0x4B5A6978, 0x11223344, 0x55667788, 7, 8
+)
+PLAINTEXT = os.urandom(1000)
+URL = "https://fake.userstorage.mega.co.nz/dl/abc"
+
+
+def encrypt(data: bytes) -> bytes:
+    """CTR mode, so encrypting is the same as decrypting."""
+    k_str = a32_to_str(Mega().xor_key(FILE_KEY))
+    initial_counter = ((FILE_KEY[4] << 32) + FILE_KEY[5]) << 64
+    return aes.ctr(k_str, initial_counter)(data)
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, content: bytes = b"") -> None:
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.reason = "Fake"
+        self.content = content
+
+    def iter_content(self, chunk_size: int) -> Iterator[bytes]:
+        for offset in range(0, len(self.content), chunk_size):
+            yield self.content[offset : offset + chunk_size]
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "FakeResponse":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+
+class FakeStorage:
+    """Serves the encrypted file like Mega's storage servers, whole or by ranges.
+    URLs in expired get 403."""
+
+    def __init__(self) -> None:
+        self.encrypted = encrypt(PLAINTEXT)
+        self.requests: List[str] = []
+        self.expired: Set[str] = set()
+
+    def get(self, url: str, stream: bool = False, **kwargs: Any) -> FakeResponse:
+        self.requests.append(url)
+        match = re.fullmatch(r"(.*)/(\d+)-(\d+)", url)
+        base = match.group(1) if match else url
+        assert base.startswith(URL)
+        if base in self.expired:
+            return FakeResponse(403)
+        if match is None:
+            return FakeResponse(200, self.encrypted)
+        first, last = int(match.group(2)), int(match.group(3))
+        return FakeResponse(200, self.encrypted[first : last + 1])
+
+
+@pytest.fixture
+def storage(monkeypatch: pytest.MonkeyPatch) -> FakeStorage:
+    storage = FakeStorage()
+    monkeypatch.setattr(mega_module.transport, "get", storage.get)
+    # Small ranges, so a small file is split into many of them.
+    monkeypatch.setattr(mega_module, "RANGE_SIZE", 64)
+    return storage
+
+
+@pytest.fixture
+def api(monkeypatch: pytest.MonkeyPatch) -> Mega:
+    api = Mega()
+
+    def download_url(
+        root_folder: str, file_id: str, prefetch_ids: Sequence[str] = ()
+    ) -> Tuple[str, int]:
+        return (URL, len(PLAINTEXT))
+
+    monkeypatch.setattr(api, "download_url", download_url)
+    return api
+
+
+def download(api: Mega, start: int = 0, chunk_size: int = 7) -> bytes:
+    return b"".join(
+        api.iter_download("root", "file", FILE_KEY, chunk_size=chunk_size, start=start)
+    )
+
+
+def test_streamed_download(
+    api: Mega, storage: FakeStorage, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(mega_module, "RANGE_DOWNLOAD_THRESHOLD", len(PLAINTEXT) + 1)
+    assert download(api) == PLAINTEXT
+    assert storage.requests == [URL]
+
+
+@pytest.mark.parametrize("start", [0, 1, 15, 16, 17, 63, 64, 65, 500, 999])
+def test_ranged_download_matches_streamed(
+    api: Mega, storage: FakeStorage, monkeypatch: pytest.MonkeyPatch, start: int
+) -> None:
+    monkeypatch.setattr(mega_module, "RANGE_DOWNLOAD_THRESHOLD", 0)
+    assert download(api, start) == PLAINTEXT[start:]
+    # Ranges are requested from the start of the AES block.
+    first_range = storage.requests[0].rsplit("/", 1)[1]
+    assert first_range.startswith(f"{start - start % aes.BLOCK_SIZE}-")
+    assert all(url != URL for url in storage.requests)
+
+
+def test_ranges_are_reassembled_in_order(
+    api: Mega, storage: FakeStorage, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(mega_module, "RANGE_DOWNLOAD_THRESHOLD", 0)
+    # Later ranges finish first.
+    get = storage.get
+
+    def slow_first_ranges(url: str, **kwargs: Any) -> FakeResponse:
+        first = int(url.rsplit("/", 1)[1].split("-")[0])
+        if first < 128:
+            time.sleep(0.05)
+        return get(url, **kwargs)
+
+    monkeypatch.setattr(mega_module.transport, "get", slow_first_ranges)
+    assert download(api, chunk_size=100) == PLAINTEXT
+
+
+class FakeApi:
+    """Answers the "g" commands of download_url() with a new URL each time,
+    or with the result set in results."""
+
+    def __init__(self) -> None:
+        self.posts: List[List[str]] = []
+        self.results: Dict[str, Union[int, dict]] = {}
+
+    def post(self, data: List[dict], root_folder: str) -> List[Union[int, dict]]:
+        ids = [command["n"] for command in data]
+        self.posts.append(ids)
+        new_url = {"s": len(PLAINTEXT)}
+        return [
+            self.results.get(id, {**new_url, "g": f"{URL}/{id}/{len(self.posts)}"})
+            for id in ids
+        ]
+
+
+@pytest.fixture
+def fake_api(monkeypatch: pytest.MonkeyPatch) -> Tuple[Mega, FakeApi]:
+    api, server = Mega(), FakeApi()
+    monkeypatch.setattr(api, "_post", server.post)
+    return (api, server)
+
+
+def test_download_urls_are_batched(fake_api: Tuple[Mega, FakeApi]) -> None:
+    api, server = fake_api
+    server.results = {"gone": -9, "hidden": {"s": 5}}
+
+    (url, size) = api.download_url("root", "a", ["a", "b", "gone", "hidden"])
+    assert (url, size) == (f"{URL}/a/1", len(PLAINTEXT))
+    assert server.posts == [["a", "b", "gone", "hidden"]]
+    # Prefetched URLs are used without another request.
+    assert api.download_url("root", "b")[0] == f"{URL}/b/1"
+    assert len(server.posts) == 1
+
+    # Errors of single commands are raised only for the file that was asked for.
+    with pytest.raises(RootNotFoundError):
+        api.download_url("root", "gone")
+    with pytest.raises(RequestError):
+        api.download_url("root", "hidden")
+    assert server.posts[1:] == [["gone"], ["hidden"]]
+
+
+@pytest.mark.parametrize(
+    "threshold", [0, len(PLAINTEXT) + 1], ids=["ranged", "streamed"]
+)
+def test_expired_url_is_requested_again_once(
+    fake_api: Tuple[Mega, FakeApi],
+    storage: FakeStorage,
+    monkeypatch: pytest.MonkeyPatch,
+    threshold: int,
+) -> None:
+    api, server = fake_api
+    monkeypatch.setattr(mega_module, "RANGE_DOWNLOAD_THRESHOLD", threshold)
+    storage.expired.add(f"{URL}/file/1")
+    assert download(api) == PLAINTEXT
+    assert server.posts == [["file"], ["file"]]
+
+    # A new URL that doesn't work either isn't replaced again.
+    storage.expired.update({f"{URL}/file/3", f"{URL}/file/4"})
+    with pytest.raises(RequestError) as err:
+        download(api)
+    assert err.value.code == 403
+    assert len(server.posts) == 4
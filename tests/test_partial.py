@@ -0,0 +1,149 @@
+import os
+from pathlib import Path
+from typing import Any, Iterator, List, Optional
+
+import pytest
+
+from src.media_import.importing import download_resumable
+from src.media_import.pathlike import FileLike
+from src.media_import.pathlike.gdrive import gdrive
+from src.media_import.pathlike.partial import PartialDownload
+
+CONTENTS = bytes(range(256)) * 4
+
+
+class Interrupted(Exception):
+    pass
+
+
+class RemoteFile(FileLike):
+    """A resumable file whose download can be made to fail after some bytes."""
+
+    resumable = True
+
+    def __init__(self, contents: bytes = CONTENTS, md5: str = "a" * 32) -> None:
+        self.id = "remote"
+        self.name = "remote.png"
+        self.extension = "png"
+        self.size = len(contents)
+        self.known_md5 = md5
+        self.contents = contents
+        self.fail_after: Optional[int] = None
+        self.starts: List[int] = []
+
+    def read_bytes(self) -> bytes:
+        return self.contents
+
+    def iter_chunks(self, chunk_size: int = 100) -> Iterator[bytes]:
+        return self.iter_chunks_from(0, chunk_size)
+
+    def iter_chunks_from(self, start: int, chunk_size: int = 100) -> Iterator[bytes]:
+        self.starts.append(start)
+        for offset in range(start, self.size, chunk_size):
+            if self.fail_after is not None and offset >= self.fail_after:
+                raise Interrupted
+            yield self.contents[offset : offset + chunk_size]
+
+
+class StreamFile(FileLike):
+    """A file that can only be read from the beginning."""
+
+    def __init__(self, contents: bytes) -> None:
+        self.id = self.name = "stream.png"
+        self.extension = "png"
+        self.size = len(contents)
+        self.contents = contents
+
+    def read_bytes(self) -> bytes:
+        return self.contents
+
+    def iter_chunks(self, chunk_size: int = 100) -> Iterator[bytes]:
+        for offset in range(0, self.size, chunk_size):
+            yield self.contents[offset : offset + chunk_size]
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body: bytes) -> None:
+        self.status_code = status_code
+        self.body = body
+
+    def iter_content(self, chunk_size: int) -> Iterator[bytes]:
+        for offset in range(0, len(self.body), chunk_size):
+            yield self.body[offset : offset + chunk_size]
+
+    def __enter__(self) -> "FakeResponse":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+
+def test_download_resumes_from_journal(tmp_path: Path) -> None:
+    file = RemoteFile()
+    dst = str(tmp_path / "remote.png")
+    file.fail_after = 500
+    with pytest.raises(Interrupted):
+        download_resumable(file, dst, str(tmp_path))
+    assert not os.path.exists(dst)
+    assert PartialDownload(str(tmp_path), file).completed == 500
+
+    file.fail_after = None
+    assert download_resumable(file, dst, str(tmp_path)) == "resume"
+    assert file.starts == [0, 500]
+    assert Path(dst).read_bytes() == CONTENTS
+    assert os.listdir(tmp_path) == ["remote.png"]
+
+
+@pytest.mark.parametrize(
+    "changed", [RemoteFile(CONTENTS + b"more"), RemoteFile(md5="b" * 32)]
+)
+def test_changed_file_is_downloaded_again(tmp_path: Path, changed: RemoteFile) -> None:
+    file = RemoteFile()
+    file.fail_after = 500
+    with pytest.raises(Interrupted):
+        download_resumable(file, str(tmp_path / "remote.png"), str(tmp_path))
+
+    assert PartialDownload(str(tmp_path), changed).completed == 0
+    dst = str(tmp_path / "remote.png")
+    assert download_resumable(changed, dst, str(tmp_path)) == "stream"
+    assert changed.starts == [0]
+    assert Path(dst).read_bytes() == changed.contents
+
+
+def test_journal_ahead_of_data_is_not_trusted(tmp_path: Path) -> None:
+    file = RemoteFile()
+    partial = PartialDownload(str(tmp_path), file)
+    partial.open()
+    partial.write(CONTENTS[:300])
+    partial.record()
+    partial.close()
+    with open(partial.data_path, "r+b") as f:
+        f.truncate(200)
+
+    assert PartialDownload(str(tmp_path), file).completed == 200
+
+
+def test_gdrive_range_is_used(monkeypatch: pytest.MonkeyPatch) -> None:
+    headers = []
+
+    def make_request(url: str, params: dict, **kwargs: Any) -> FakeResponse:
+        headers.append(kwargs["headers"])
+        return FakeResponse(206, CONTENTS[100:])
+
+    monkeypatch.setattr(gdrive, "make_request", make_request)
+    assert b"".join(gdrive.iter_download("id", 64, start=100)) == CONTENTS[100:]
+    assert headers == [{"Range": "bytes=100-"}]
+
+
+def test_gdrive_ignored_range_skips_start(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(
+        gdrive, "make_request", lambda *args, **kwargs: FakeResponse(200, CONTENTS)
+    )
+    assert b"".join(gdrive.iter_download("id", 64, start=100)) == CONTENTS[100:]
+    assert b"".join(gdrive.iter_download("id", 64, start=0)) == CONTENTS
+
+
+@pytest.mark.parametrize("start", [0, 1, 6, 7, 150, len(CONTENTS)])
+def test_default_iter_chunks_from_skips_start(start: int) -> None:
+    file = StreamFile(CONTENTS)
+    assert b"".join(file.iter_chunks_from(start, 7)) == CONTENTS[start:]
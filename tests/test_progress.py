@@ -0,0 +1,162 @@
+import math
+from typing import Any, Callable, List, Tuple
+
+import pytest
+
+from src.media_import import importing
+from src.media_import.importing import (ETA_SAMPLE_SECONDS, ETA_TIME_CONSTANT,
+                                        PROGRESS_UPDATES_PER_SECOND, ImportInfo,
+                                        ProgressReporter)
+from src.media_import.pathlike import FileLike
+
+
+class FakeTime:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class FakeMainWindow:
+    """Keeps the callbacks for the main thread until run_main() is called."""
+
+    def __init__(self) -> None:
+        self.taskman = self
+        self.progress = self
+        self.on_main: List[Callable[[], None]] = []
+        self.shown: List[Tuple[str, int, int]] = []
+
+    def run_on_main(self, callback: Callable[[], None]) -> None:
+        self.on_main.append(callback)
+
+    def update(self, label: str, value: int, max: int) -> None:
+        self.shown.append((label, value, max))
+
+    def run_main(self) -> None:
+        callbacks, self.on_main = self.on_main, []
+        for callback in callbacks:
+            callback()
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> FakeTime:
+    clock = FakeTime()
+    monkeypatch.setattr(importing, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def mw(monkeypatch: pytest.MonkeyPatch) -> FakeMainWindow:
+    mw = FakeMainWindow()
+    monkeypatch.setattr(importing.aqt, "mw", mw)
+    return mw
+
+
+def test_updates_are_rate_limited(clock: FakeTime, mw: FakeMainWindow) -> None:
+    reporter = ProgressReporter()
+    # An update per file, every millisecond for a second
+    start = clock.now
+    for i in range(1000):
+        clock.now = start + i / 1000
+        reporter.update(f"file {i}", i, 1000)
+        mw.run_main()
+
+    assert len(mw.shown) == PROGRESS_UPDATES_PER_SECOND
+    values = [value for _, value, _ in mw.shown]
+    assert all(b - a >= 100 for a, b in zip(values, values[1:]))
+
+
+def test_one_update_is_pending_at_a_time(clock: FakeTime, mw: FakeMainWindow) -> None:
+    reporter = ProgressReporter()
+    # The main thread is busy for a while.
+    for i in range(50):
+        reporter.update(f"file {i}", i, 50)
+        clock.sleep(0.1)
+        assert not reporter.due()
+    assert len(mw.on_main) == 1
+
+    # Once it runs, it shows the latest state.
+    mw.run_main()
+    assert mw.shown == [("file 49", 49, 50)]
+    assert reporter.due()
+    reporter.update("done", 50, 50)
+    assert len(mw.on_main) == 1
+
+
+def test_forced_update_ignores_rate(clock: FakeTime, mw: FakeMainWindow) -> None:
+    reporter = ProgressReporter()
+    reporter.update("first", 0, 2)
+    mw.run_main()
+    reporter.update("skipped", 1, 2)
+    reporter.update("last", 2, 2, force=True)
+    mw.run_main()
+    assert mw.shown == [("first", 0, 2), ("last", 2, 2)]
+
+
+class SizedFile(FileLike):
+    def __init__(self, size: int) -> None:
+        self.id = self.name = f"{size}.png"
+        self.extension = "png"
+        self.size = size
+
+    def read_bytes(self) -> bytes:
+        return b"\0" * self.size
+
+    def iter_chunks(self, chunk_size: int = 100) -> Any:
+        yield self.read_bytes()
+
+
+def transfer(info: ImportInfo, clock: FakeTime, size: int, seconds: float) -> None:
+    clock.sleep(seconds)
+    info.update_size(SizedFile(size))
+
+
+def test_eta_is_smoothed(clock: FakeTime) -> None:
+    info = ImportInfo([SizedFile(100_000)])
+    assert info.remaining_time_str == ""
+
+    # Files within a sample count as one.
+    for _ in range(4):
+        transfer(info, clock, 100, ETA_SAMPLE_SECONDS / 4 - 0.01)
+        assert info.throughput is None
+    transfer(info, clock, 600, 0.04)
+    first = 1000 / ETA_SAMPLE_SECONDS
+    assert info.throughput == pytest.approx(first)
+    assert info.remaining_time_str == f"{int(99_000 / first)}s"
+
+    # A faster sample moves the average by the weight of its length, not all the way.
+    transfer(info, clock, 9000, 1)
+    weight = 1 - math.exp(-1 / ETA_TIME_CONSTANT)
+    expected = first + weight * (9000 - first)
+    assert info.throughput == pytest.approx(expected)
+
+    # After a long pause, the older samples have almost faded.
+    transfer(info, clock, 100, 10 * ETA_TIME_CONSTANT)
+    rate = 100 / (10 * ETA_TIME_CONSTANT)
+    expected += (1 - math.exp(-10)) * (rate - expected)
+    assert info.throughput == pytest.approx(expected)
+    assert info.throughput < 2 * rate
+
+
+@pytest.mark.parametrize(
+    "seconds, expected",
+    [
+        (0, "0s"),
+        (59, "59s"),
+        (61, "1m 1s"),
+        (3600, "1h 0m"),
+        (3661, "1h 1m"),
+        (86399, "23h 59m"),
+        # Over a day, minutes and seconds aren't shown.
+        (86400 + 3600 + 61, "1d 1h"),
+        (30 * 86400, "30d 0h"),
+    ],
+)
+def test_remaining_time_format(clock: FakeTime, seconds: int, expected: str) -> None:
+    info = ImportInfo([SizedFile(seconds)])
+    info.throughput = 1.0
+    assert info.remaining_time_str == expected
@@ -0,0 +1,246 @@
+from typing import Iterator, List
+
+import pytest
+
+from src.media_import import scheduler
+from src.media_import.pathlike import FileLike
+from src.media_import.scheduler import CircuitBreaker, Throttle, TransferQueue
+
+
+class Clock:
+    """Replaces time.monotonic() so the tests don't have to sleep."""
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class DummyFile(FileLike):
+    def __init__(self, name: str, size: int = 1) -> None:
+        self.id = name
+        self.name = name
+        self.extension = "png"
+        self.size = size
+
+    def read_bytes(self) -> bytes:
+        return b"\0" * self.size
+
+    def iter_chunks(self, chunk_size: int = 1) -> Iterator[bytes]:
+        yield self.read_bytes()
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(scheduler.time, "monotonic", clock)
+    # No jitter, so the delays are predictable.
+    monkeypatch.setattr(scheduler.random, "uniform", lambda a, b: b)
+    return clock
+
+
+def files(*names: str) -> List[FileLike]:
+    return [DummyFile(name) for name in names]
+
+
+def test_queue_pops_in_order(clock: Clock) -> None:
+    a, b, c = files("a", "b", "c")
+    queue = TransferQueue([a, b, c])
+    assert [queue.pop(), queue.pop(), queue.pop(), queue.pop()] == [a, b, c, None]
+    assert len(queue) == 0
+    assert queue.seconds_until_ready() is None
+
+
+def test_put_back_returns_file_to_front(clock: Clock) -> None:
+    a, b = files("a", "b")
+    queue = TransferQueue([a, b])
+    assert queue.pop() is a
+    queue.put_back(a)
+    assert queue.attempts(a) == 0
+    assert queue.pop() is a
+
+
+def test_retry_waits_for_backoff(clock: Clock) -> None:
+    a, b = files("a", "b")
+    queue = TransferQueue([a, b], base_delay=1.0)
+    assert queue.pop() is a
+    assert queue.retry(a)
+    assert a in queue
+    # The retried file waits, the others go first.
+    assert queue.pop() is b
+    assert queue.pop() is None
+    assert queue.seconds_until_ready() == pytest.approx(1.0)
+    clock.advance(1.0)
+    assert queue.pop() is a
+
+
+def test_retry_delay_doubles(clock: Clock) -> None:
+    (a,) = files("a")
+    queue = TransferQueue([a], base_delay=1.0, max_delay=3.0)
+    delays = []
+    for _ in range(3):
+        assert queue.pop() is a
+        queue.retry(a)
+        delays.append(queue.seconds_until_ready())
+        clock.advance(delays[-1])
+    # Capped at max_delay
+    assert delays == pytest.approx([1.0, 2.0, 3.0])
+
+
+def test_delayed_files_are_ordered_by_due_time(clock: Clock) -> None:
+    a, b = files("a", "b")
+    queue = TransferQueue([a], base_delay=1.0)
+    assert queue.pop() is a
+    queue.retry(a)
+    clock.advance(1.0)
+    assert queue.pop() is a
+    queue.retry(a)  # Second attempt: due after 2 seconds
+    queue.add(b)
+    assert queue.pop() is b
+    queue.retry(b)  # First attempt: due after 1 second
+    clock.advance(2.0)
+    assert [queue.pop(), queue.pop()] == [b, a]
+
+
+def test_retry_drops_file_after_max_attempts(clock: Clock) -> None:
+    (a,) = files("a")
+    queue = TransferQueue([a], max_attempts=3)
+    results = []
+    for _ in range(3):
+        assert queue.pop() is a
+        results.append(queue.retry(a))
+        clock.advance(60)
+    assert results == [True, True, False]
+    assert queue.attempts(a) == 3
+    assert len(queue) == 0
+
+
+def test_breaker_trips_after_threshold(clock: Clock) -> None:
+    breaker = CircuitBreaker(threshold=3, cooldown=10.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert not breaker.is_open
+    breaker.record_failure()
+    assert breaker.is_open
+    assert breaker.seconds_until_closed == pytest.approx(10.0)
+    clock.advance(10.0)
+    assert not breaker.is_open
+
+
+def test_breaker_success_resets_failures(clock: Clock) -> None:
+    breaker = CircuitBreaker(threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert not breaker.is_open
+
+
+def test_breaker_cooldown_doubles(clock: Clock) -> None:
+    breaker = CircuitBreaker(threshold=1, cooldown=10.0)
+    cooldowns = []
+    for _ in range(3):
+        breaker.record_failure()
+        cooldowns.append(breaker.seconds_until_closed)
+        clock.advance(cooldowns[-1])
+    assert cooldowns == pytest.approx([10.0, 20.0, 40.0])
+
+    # A success starts over.
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.seconds_until_closed == pytest.approx(10.0)
+
+
+def test_breaker_is_broken_after_max_trips(clock: Clock) -> None:
+    breaker = CircuitBreaker(threshold=1, cooldown=1.0, max_trips=2)
+    for _ in range(2):
+        breaker.record_failure()
+        clock.advance(breaker.seconds_until_closed)
+        assert not breaker.is_broken
+    breaker.record_failure()
+    assert breaker.is_broken
+
+
+MIB = 1024 * 1024
+
+
+def test_rate_limit_halves_concurrency(clock: Clock) -> None:
+    throttle = Throttle(8)
+    limits = []
+    for _ in range(4):
+        throttle.record_rate_limit()
+        limits.append(throttle.limit)
+        clock.advance(2)
+    assert limits == [4, 2, 1, 1]
+
+
+def test_rate_is_set_below_success_rate(clock: Clock) -> None:
+    throttle = Throttle(4)
+    assert throttle.rate is None
+    for _ in range(10):
+        clock.advance(0.5)
+        throttle.record_success(0.1, MIB)
+    success_rate = throttle.success_rate()
+    assert success_rate == pytest.approx(10 / 4.5)
+
+    throttle.record_rate_limit()
+    assert throttle.rate is not None
+    assert throttle.rate == pytest.approx(success_rate * throttle.rate_decrease)
+    # The bucket starts empty.
+    assert not throttle.try_acquire()
+    clock.advance(1 / throttle.rate)
+    assert throttle.try_acquire()
+    assert not throttle.try_acquire()
+
+
+def test_rate_never_drops_below_minimum(clock: Clock) -> None:
+    throttle = Throttle(4, min_rate=0.5)
+    throttle.record_rate_limit()
+    assert throttle.rate == 0.5
+
+
+def test_success_increases_additively(clock: Clock) -> None:
+    throttle = Throttle(4)
+    throttle.record_rate_limit()
+    assert (throttle.concurrency, throttle.rate) == (2.0, throttle.min_rate)
+
+    throttle.record_success(0.1, MIB)
+    assert throttle.concurrency == pytest.approx(2.5)
+    assert throttle.rate == pytest.approx(throttle.min_rate + throttle.rate_increase)
+    for _ in range(10):
+        throttle.record_success(0.1, MIB)
+    assert throttle.concurrency == 4.0
+
+
+def test_slow_transfer_decreases_concurrency(clock: Clock) -> None:
+    throttle = Throttle(8)
+    throttle.record_success(0.5, MIB)
+    # Slower than usual, but too short to be congestion.
+    throttle.record_success(0.9, MIB // 4)
+    assert throttle.limit == 8
+
+    throttle.record_success(3.0, MIB)
+    assert throttle.limit == 4
+    # Slowness alone doesn't start rate limiting.
+    assert throttle.rate is None
+    # Large files aren't slow just because they take longer.
+    clock.advance(2)
+    throttle.record_success(5.0, 10 * MIB)
+    assert throttle.concurrency > 4
+
+
+def test_decreases_once_per_second(clock: Clock) -> None:
+    throttle = Throttle(16)
+    throttle.record_rate_limit()
+    throttle.record_rate_limit()
+    clock.advance(0.5)
+    throttle.record_success(3.0, MIB // 2)
+    throttle.record_success(30.0, MIB)
+    assert throttle.limit == 8
+
+    clock.advance(0.5)
+    throttle.record_rate_limit()
+    assert throttle.limit == 4
@@ -0,0 +1,92 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterator, List, Optional, Tuple
+
+import pytest
+
+from src.media_import.pathlike.transport import Transport, in_context, observing
+
+Request = Tuple[str, Optional[int]]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keeps connections alive
+
+    def do_GET(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def url() -> Iterator[str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+    server.server_close()
+
+
+def test_only_requests_of_the_block_are_observed(url: str) -> None:
+    transport = Transport()
+    observed: List[Request] = []
+    other: List[Request] = []
+
+    def observe(host: str, seconds: float, status: Optional[int], retries: int) -> None:
+        observed.append((host, status))
+
+    def observe_other(
+        host: str, seconds: float, status: Optional[int], retries: int
+    ) -> None:
+        other.append((host, status))
+
+    transport.get(url)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        with observing(observe):
+            transport.get(url)
+            # Tasks keep the observer only if they are started with in_context().
+            executor.submit(in_context(transport.get), url).result()
+            executor.submit(transport.get, url).result()
+            list(executor.map(in_context(transport.get), [url] * 3))
+        with observing(observe_other):
+            executor.submit(in_context(transport.get), url).result()
+    transport.get(url)
+
+    assert observed == [("127.0.0.1", 200)] * 5
+    assert other == [("127.0.0.1", 200)]
+
+
+def test_stats_since_snapshot(url: str) -> None:
+    transport = Transport()
+    for _ in range(3):
+        transport.get(url)
+    before = transport.stats()
+    assert before["127.0.0.1"].requests == 3
+
+    assert transport.stats(before) == {}
+    assert transport.stats_str(before) == ""
+    transport.get(url)
+    transport.get(url)
+    stats = transport.stats(before)["127.0.0.1"]
+    assert (stats.requests, stats.connections, stats.reused) == (2, 0, 2)
+
+
+def test_reserve_only_grows_the_pools(url: str) -> None:
+    transport = Transport(pool_size=2)
+    transport.get(url)
+    transport.reserve(1)
+    assert transport.pool_size == 2
+    assert transport.stats()["127.0.0.1"].requests == 1
+
+    transport.reserve(16)
+    assert transport.pool_size == 16
+    transport.get(url)
+    pool = transport._adapter.poolmanager.connection_from_url(url)
+    assert pool.pool.maxsize == 16  # type: ignore
+    assert transport.stats()["127.0.0.1"].requests == 1